@@ -1,10 +1,37 @@
 # aggregation.py
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 
+from storage import (read_table, write_table, update_by_date, list_partitions, clear_table,
+                     compact_soundings)
+
+logger = logging.getLogger(__name__)
+
+# Latitude bands (every 30°)
+LAT_BINS = [-90, -60, -30, 0, 30, 60, 90]
+LAT_LABELS = ['-90 to -60', '-60 to -30', '-30 to 0',
+              '0 to 30', '30 to 60', '60 to 90']
+
+# Groupings maintained by the fused aggregation engine
+GROUPINGS = {
+    'global': ['date'],
+    'lat_band': ['lat_band', 'date'],
+    'country': ['country', 'date'],
+}
+
+# Accumulators hold sums of (xco2 - ACC_SHIFT); shifting by a typical value keeps
+# the sum-of-squares variance formula numerically stable for ~400 ppm data.
+ACC_SHIFT = 400.0
+
 def aggregate_global_lat_bands(
     input_file: str,
-    output_global: str = "./oco2_ingested/daily_global_mean.csv",
-    output_latband: str = "./oco2_ingested/daily_latband_mean.csv"
+    output_global: str = "./oco2_ingested/daily_global_mean.parquet",
+    output_latband: str = "./oco2_ingested/daily_latband_mean.parquet",
+    dates: list[str] | None = None
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Compute daily global mean CO₂ and daily mean CO₂ by latitude band.
@@ -12,56 +39,314 @@ def aggregate_global_lat_bands(
     Parameters
     ----------
     input_file : str
-        Path to cleaned CO₂ data CSV (must include 'date', 'latitude', 'xco2').
+        Path to cleaned CO₂ data, Parquet store or CSV (must include 'date', 'latitude', 'xco2').
     output_global : str, optional
-        File path to save global daily mean (default: './oco2_ingested/daily_global_mean.csv').
+        File path to save global daily mean (default: './oco2_ingested/daily_global_mean.parquet').
+        A '.csv' path exports CSV instead.
     output_latband : str, optional
-        File path to save latitude-band daily mean (default: './oco2_ingested/daily_latband_mean.csv').
+        File path to save latitude-band daily mean (default: './oco2_ingested/daily_latband_mean.parquet').
+    dates : list[str] | None, optional
+        If given (e.g. the touched dates of an incremental ingest), only these dates are
+        read from the partitioned input and recomputed; their rows are replaced in the
+        existing outputs and all other dates are kept.
 
     Returns
     -------
     (pd.DataFrame, pd.DataFrame)
-        - global_daily: daily mean CO₂ (global)
-        - latband_daily: daily mean CO₂ by latitude band
+        - global_daily: daily mean CO₂ (global), with 'xco2_std' and 'count'
+        - latband_daily: daily mean CO₂ by latitude band, with 'xco2_std' and 'count'
+
+    Notes
+    -----
+    A thin wrapper over scan_partials/PartialAggregates.finalize; the pipeline uses
+    aggregate_all, which produces these tables and the country table in one scan.
     """
 
-    # Load the cleaned, ingested CSV
-    df = pd.read_csv(input_file)
-    df['date'] = pd.to_datetime(df['date'])
+    # CSV input cannot be read by date; merging would duplicate the untouched dates
+    if dates is not None and not Path(input_file).is_dir():
+        raise ValueError("Date-restricted aggregation requires a partitioned Parquet input.")
+
+    results = scan_partials(input_file, dates=dates).finalize()
+    global_daily = results.get('global', empty_stats('global'))
+    latband_daily = results.get('lat_band', empty_stats('lat_band'))
 
-    # 1. Daily global mean CO₂
-    global_daily = df.groupby('date')['xco2'].mean().reset_index()
+    # Incremental update: replace only the recomputed dates in the existing outputs
+    if dates is not None:
+        global_daily = update_by_date(output_global, global_daily, dates, ['date'])
+        latband_daily = update_by_date(output_latband, latband_daily, dates, ['date'])
+        latband_daily['lat_band'] = pd.Categorical(latband_daily['lat_band'].astype(str),
+                                                   categories=LAT_LABELS)
+        latband_daily = latband_daily.sort_values(['lat_band', 'date'], ignore_index=True)
 
-    # 2. Latitude bands (every 30°)
-    lat_bins = [-90, -60, -30, 0, 30, 60, 90]
-    lat_labels = ['-90 to -60', '-60 to -30', '-30 to 0',
-                  '0 to 30', '30 to 60', '60 to 90']
+    # Save outputs
+    write_table(global_daily, output_global)
+    write_table(latband_daily, output_latband)
+
+    logger.info(f"✅ Saved global daily mean to {output_global}")
+    logger.info(f"✅ Saved latitude-band daily mean to {output_latband}")
+
+    return global_daily, latband_daily
+
+
+def empty_stats(name: str) -> pd.DataFrame:
+    """
+    Statistics table of a grouping without any rows (e.g. no soundings were read).
+    """
+    return pd.DataFrame(columns=GROUPINGS[name] + ['xco2', 'xco2_std', 'count'])
 
+
+def add_lat_band(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the 30° 'lat_band' column used by the latitude-band aggregates.
+    """
     df['lat_band'] = pd.cut(df['latitude'],
-                            bins=lat_bins,
-                            labels=lat_labels,
+                            bins=LAT_BINS,
+                            labels=LAT_LABELS,
                             include_lowest=True)
+    return df
 
-    latband_daily = (
-        df.groupby(['lat_band', 'date'], observed=True)['xco2']
-        .mean()
-        .reset_index()
-    )
 
-    # Save outputs
-    global_daily.to_csv(output_global, index=False)
-    latband_daily.to_csv(output_latband, index=False)
+@dataclass
+class PartialAggregates:
+    """
+    Mergeable per-group accumulators (sum, sum of squares, count) of xco2.
 
-    print(f"✅ Saved global daily mean to {output_global}")
-    print(f"✅ Saved latitude-band daily mean to {output_latband}")
+    One instance is built per chunk (e.g. a date partition or granule); instances are
+    combined with merge(), which is exact, so sharded or incremental runs produce the
+    same statistics as a single scan.
+    """
+    tables: dict[str, pd.DataFrame] = field(default_factory=dict)
 
-    return global_daily, latband_daily
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, groupings: dict[str, list[str]] = GROUPINGS) -> "PartialAggregates":
+        """
+        Accumulate one chunk of soundings. Groupings whose key columns are missing
+        (e.g. 'country' without a shapefile) are skipped; rows with a missing key are
+        dropped from that grouping. Other groupings than GROUPINGS (e.g. the regions of
+        a polygon layer) can be passed as {name: key columns}.
+        """
+        x = df['xco2'].astype('float64') - ACC_SHIFT
+        work = df.assign(_x=x, _x2=x * x)
+        tables = {}
+        for name, keys in groupings.items():
+            if not all(k in work.columns for k in keys):
+                continue
+            tables[name] = (
+                work.groupby(keys, observed=True)
+                .agg(sum=('_x', 'sum'), sumsq=('_x2', 'sum'), count=('_x', 'size'))
+            )
+        return cls(tables)
+
+    def merge(self, other: "PartialAggregates") -> "PartialAggregates":
+        """
+        Combine two partial aggregates.
+        """
+        tables = dict(self.tables)
+        for name, table in other.tables.items():
+            if name in tables:
+                combined = pd.concat([tables[name], table])
+                tables[name] = combined.groupby(level=list(table.index.names), observed=True).sum()
+            else:
+                tables[name] = table
+        return PartialAggregates(tables)
+
+    def drop_dates(self, dates: list[str]) -> "PartialAggregates":
+        """
+        Remove the accumulators of some dates (before merging their recomputed values).
+        """
+        drop = pd.to_datetime(dates)
+        return PartialAggregates({
+            name: table[~table.index.get_level_values('date').isin(drop)]
+            for name, table in self.tables.items()
+        })
+
+    def finalize(self) -> dict[str, pd.DataFrame]:
+        """
+        Turn accumulators into per-group mean, sample standard deviation and count.
+
+        Returns
+        -------
+        dict[str, pd.DataFrame]
+            Grouping name -> DataFrame with the key columns plus 'xco2' (mean),
+            'xco2_std' and 'count'.
+        """
+        results = {}
+        for name, table in self.tables.items():
+            n = table['count'].astype('float64')
+            mean = table['sum'] / n
+            var = (table['sumsq'] - table['sum'] * mean) / (n - 1)
+            out = pd.DataFrame({
+                'xco2': mean + ACC_SHIFT,
+                'xco2_std': np.sqrt(var.clip(lower=0)).where(n > 1),
+                'count': table['count'],
+            })
+            keys = list(table.index.names)
+            out = out.reset_index()
+            if 'country' in out.columns:
+                out['country'] = out['country'].astype(str)
+            if name == 'lat_band':
+                # Merging can drop the categorical dtype; restore the band order
+                out['lat_band'] = pd.Categorical(out['lat_band'].astype(str), categories=LAT_LABELS)
+            results[name] = out.sort_values(keys, ignore_index=True)
+        return results
+
+    def save(self, state_dir: str) -> None:
+        """
+        Persist the accumulators (one Parquet file per grouping).
+        """
+        clear_table(state_dir)
+        Path(state_dir).mkdir(parents=True)
+        for name, table in self.tables.items():
+            table.reset_index().to_parquet(Path(state_dir) / f"{name}.parquet", index=False)
+
+    @classmethod
+    def load(cls, state_dir: str) -> "PartialAggregates":
+        """
+        Load accumulators written by save(); a missing directory gives an empty instance.
+        """
+        tables = {}
+        for name, keys in GROUPINGS.items():
+            path = Path(state_dir) / f"{name}.parquet"
+            if not path.exists():
+                continue
+            table = pd.read_parquet(path)
+            if name == 'lat_band':
+                table['lat_band'] = pd.Categorical(table['lat_band'].astype(str),
+                                                   categories=LAT_LABELS)
+            tables[name] = table.set_index(keys)
+        return cls(tables)
+
+
+def scan_partials(
+    input_file: str,
+    dates: list[str] | None = None,
+    shapefile_path: str | None = None,
+    country_method: str = "grid",
+    grid_resolution: float = 0.05,
+    grid_cache_dir: str = "./oco2_ingested/country_grid_cache"
+) -> PartialAggregates:
+    """
+    Scan cleaned soundings once, one date partition at a time, into PartialAggregates.
+
+    Parameters
+    ----------
+    input_file : str
+        Path to cleaned CO₂ data, Parquet store or CSV (must include 'date', 'latitude',
+        'xco2', and 'longitude' when a shapefile is given).
+    dates : list[str] | None, optional
+        Only scan these date partitions (partitioned input only).
+    shapefile_path : str | None, optional
+        Country polygons for the country grouping; None skips it.
+    country_method, grid_resolution, grid_cache_dir
+        Country assignment settings passed to country.assign_countries.
+
+    Returns
+    -------
+    PartialAggregates
+        Accumulators of the global, latitude-band and (with a shapefile) country groupings.
+    """
+    columns = ['date', 'latitude', 'xco2'] + (['longitude'] if shapefile_path is not None else [])
+
+    if Path(input_file).is_dir():
+        keys = list(list_partitions(input_file))
+        if dates is not None:
+            keys = [k for k in keys if k in set(dates)]
+        chunks = ([k] for k in keys)
+    else:
+        if dates is not None:
+            raise ValueError("Date-restricted aggregation requires a partitioned Parquet input.")
+        chunks = iter([None])
+
+    if shapefile_path is not None:
+        from country import assign_countries
+
+    partials = PartialAggregates()
+    for partitions in chunks:
+        df = compact_soundings(read_table(input_file, columns=columns, partitions=partitions))
+        if df.empty:
+            continue
+        add_lat_band(df)
+        if shapefile_path is not None:
+            df['country'] = assign_countries(df, shapefile_path, country_method,
+                                             grid_resolution, grid_cache_dir)
+        partials = partials.merge(PartialAggregates.from_frame(df))
+    return partials
+
+
+def aggregate_all(
+    input_file: str,
+    shapefile_path: str | None = None,
+    output_dir: str = "./oco2_ingested",
+    dates: list[str] | None = None,
+    country_method: str = "grid",
+    output_global: str | None = None,
+    output_latband: str | None = None,
+    output_country: str | None = None
+) -> dict[str, pd.DataFrame]:
+    """
+    Single-pass aggregation engine: daily global, latitude-band and country statistics.
+
+    The cleaned soundings are scanned once, one date partition at a time. Each chunk is
+    reduced to PartialAggregates, merged, and finalised into mean, standard deviation and
+    count per group. The merged accumulators are persisted under output_dir/aggregate_state
+    so later incremental runs only rescan the dates they touch.
+
+    Parameters
+    ----------
+    input_file : str
+        Path to cleaned CO₂ data, Parquet store or CSV (must include 'date', 'latitude',
+        'longitude', 'xco2').
+    shapefile_path : str | None, optional
+        Natural Earth shapefile for the country grouping; None skips it.
+    output_dir : str, optional
+        Folder for the statistics tables and accumulator state (default: './oco2_ingested').
+    dates : list[str] | None, optional
+        If given, only these dates are rescanned and merged into the saved state
+        (without a saved state, everything is scanned).
+    country_method : str, optional
+        Country assignment method passed to country.assign_countries (default: 'grid').
+    output_global, output_latband, output_country : str | None, optional
+        Output tables (default: 'daily_global_stats.parquet', 'daily_latband_stats.parquet'
+        and 'country_daily_stats.parquet' in output_dir).
+
+    Returns
+    -------
+    dict[str, pd.DataFrame]
+        'global', 'lat_band' and (with a shapefile) 'country' statistics tables.
+    """
+    state_dir = Path(output_dir) / "aggregate_state"
+    if dates is not None and not state_dir.is_dir():
+        logger.warning(f"⚠️ No aggregation state in {state_dir}, scanning every date")
+        dates = None
+
+    partials = scan_partials(input_file, dates, shapefile_path, country_method,
+                             grid_cache_dir=str(Path(output_dir) / "country_grid_cache"))
+    if dates is not None:
+        partials = PartialAggregates.load(state_dir).drop_dates(dates).merge(partials)
+    partials.save(state_dir)
+
+    results = partials.finalize()
+    outputs = {
+        'global': output_global or Path(output_dir) / "daily_global_stats.parquet",
+        'lat_band': output_latband or Path(output_dir) / "daily_latband_stats.parquet",
+        'country': output_country or Path(output_dir) / "country_daily_stats.parquet",
+    }
+    for name, output_path in outputs.items():
+        if name == 'country' and shapefile_path is None:
+            continue
+        table = results.setdefault(name, empty_stats(name))
+        write_table(table, output_path)
+        logger.info(f"✅ Saved {name} daily statistics to {output_path}")
+
+    return results
 
 
 # Example usage
 if __name__ == "__main__":
+    from instrumentation import configure_logging
+    configure_logging()
     g, l = aggregate_global_lat_bands(
-        input_file="./oco2_ingested/cleaned_oco2_data.csv"
+        input_file="./oco2_ingested/cleaned_oco2_data.parquet"
     )
     print("Global daily mean sample:")
     print(g.head())
@@ -1,13 +1,492 @@
 # arima.py
+import logging
+import os
+import re
+import json
+import time
+import math
+import hashlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
-import matplotlib.pyplot as plt
-from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+from storage import read_table
+from instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ORDER = (1, 1, 1)
+DEFAULT_SEASONAL_ORDER = (1, 1, 1, 12)  # seasonal order 12 = yearly seasonality
+SEASONAL_PERIOD = 12
+
+
+def monthly_country_series(df: pd.DataFrame) -> dict[str, pd.Series]:
+    """
+    Resample daily country means to monthly means for every country in one groupby.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Country-level daily table with 'country', 'date', 'xco2'.
+
+    Returns
+    -------
+    dict[str, pd.Series]
+        Country -> monthly mean CO₂ series with a month-end frequency index.
+    """
+    monthly = (
+        df.set_index('date')
+        .sort_index()
+        .groupby('country')['xco2']
+        .resample('ME')
+        .mean()
+    )
+    return {
+        country: series.droplevel('country').asfreq('ME')
+        for country, series in monthly.groupby(level='country')
+    }
+
+
+def _fit_sarima(series: pd.Series,
+                order: tuple = DEFAULT_ORDER,
+                seasonal_order: tuple = DEFAULT_SEASONAL_ORDER,
+                start_params=None,
+                maxiter: int | None = None):
+    """
+    Fit a SARIMA model, optionally warm-started from previously estimated parameters.
+    maxiter caps the optimiser iterations (statsmodels' default when None).
+    """
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    model = SARIMAX(
+        series,
+        order=order,
+        seasonal_order=seasonal_order,
+        enforce_stationarity=False,
+        enforce_invertibility=False
+    )
+    if start_params is not None and len(start_params) != len(model.start_params):
+        start_params = None
+    fit_kwargs = {} if maxiter is None else {'maxiter': maxiter}
+    return model.fit(disp=False, start_params=start_params, **fit_kwargs)
+
+
+def _series_hash(series: pd.Series) -> str:
+    """
+    Hash of a series' index and values, used to detect revised training data.
+    """
+    return hashlib.sha256(pd.util.hash_pandas_object(series, index=True).values.tobytes()).hexdigest()
+
+
+class ArimaModelCache:
+    """
+    On-disk cache of fitted SARIMAX results per country and model order.
+
+    get_results() returns cached results when the training series is unchanged. When new
+    observations only extend the series, the cached model is updated by appending them to
+    its state (parameters kept, no re-estimation). A full refit happens when the data was
+    revised, or when the last estimation is older than max_age_days or more than
+    max_new_obs observations have been appended since.
+
+    Counters of hits, appends, refits and estimated fit time saved are kept in `stats`.
+    """
+
+    def __init__(self,
+                 cache_dir: str = "./oco2_ingested/arima_cache",
+                 max_age_days: float | None = 180,
+                 max_new_obs: int | None = 12):
+        self.cache_dir = cache_dir
+        self.max_age_days = max_age_days
+        self.max_new_obs = max_new_obs
+        self.stats = {"hits": 0, "appends": 0, "refits": 0, "seconds_saved": 0.0}
+
+    def _paths(self, country: str, order: tuple, seasonal_order: tuple) -> tuple[str, str]:
+        slug = re.sub(r"[^A-Za-z0-9_-]+", "_", country)
+        orders = "_".join(str(v) for v in (*order, *seasonal_order))
+        base = os.path.join(self.cache_dir, f"{slug}__{orders}")
+        return base + ".pkl", base + ".json"
+
+    def _is_stale(self, meta: dict, new_obs: int) -> bool:
+        if self.max_age_days is not None:
+            if time.time() - meta["fitted_at"] > self.max_age_days * 86400:
+                return True
+        if self.max_new_obs is not None:
+            if meta.get("appended", 0) + new_obs > self.max_new_obs:
+                return True
+        return False
+
+    def _save(self, results, meta: dict, model_path: str, meta_path: str) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        results.save(model_path)
+        with open(meta_path, "w", encoding="utf-8") as fh:
+            json.dump(meta, fh, indent=2)
+
+    def get_results(self, country: str, series: pd.Series,
+                    order: tuple = DEFAULT_ORDER,
+                    seasonal_order: tuple = DEFAULT_SEASONAL_ORDER,
+                    start_params=None):
+        """
+        Return fitted SARIMAX results for series, reusing or updating the cached model.
+        """
+        from statsmodels.tsa.statespace.sarimax import SARIMAXResults
+
+        model_path, meta_path = self._paths(country, order, seasonal_order)
+        series_hash = _series_hash(series)
+
+        meta = None
+        if os.path.exists(model_path) and os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as fh:
+                meta = json.load(fh)
+
+        if meta is not None:
+            if meta["series_hash"] == series_hash:
+                self.stats["hits"] += 1
+                count("cache_hits")
+                self.stats["seconds_saved"] += meta["fit_seconds"]
+                return SARIMAXResults.load(model_path)
+
+            n_old = meta["n_obs"]
+            new_obs = len(series) - n_old
+            extends = new_obs > 0 and _series_hash(series.iloc[:n_old]) == meta["series_hash"]
+            if extends and not self._is_stale(meta, new_obs):
+                start = time.perf_counter()
+                results = SARIMAXResults.load(model_path).append(series.iloc[n_old:])
+                elapsed = time.perf_counter() - start
+                meta.update(series_hash=series_hash, n_obs=len(series),
+                            appended=meta.get("appended", 0) + new_obs)
+                self._save(results, meta, model_path, meta_path)
+                self.stats["appends"] += 1
+                count("cache_hits")
+                self.stats["seconds_saved"] += max(meta["fit_seconds"] - elapsed, 0.0)
+                return results
+
+        start = time.perf_counter()
+        results = _fit_sarima(series, order, seasonal_order, start_params)
+        meta = {
+            "series_hash": series_hash,
+            "n_obs": len(series),
+            "fit_seconds": time.perf_counter() - start,
+            "fitted_at": time.time(),
+            "appended": 0,
+        }
+        self._save(results, meta, model_path, meta_path)
+        self.stats["refits"] += 1
+        count("cache_misses")
+        return results
+
+    def report(self) -> str:
+        """
+        One-line summary of cache activity.
+        """
+        return (f"♻️ ARIMA model cache: {self.stats['hits']} hits, {self.stats['appends']} appends, "
+                f"{self.stats['refits']} refits, ~{self.stats['seconds_saved']:.1f}s saved")
+
+
+def candidate_orders(max_p: int = 2,
+                     max_q: int = 2,
+                     max_P: int = 1,
+                     max_Q: int = 1,
+                     d_values: tuple = (1,),
+                     D_values: tuple = (1,),
+                     period: int = SEASONAL_PERIOD) -> list[tuple[tuple, tuple]]:
+    """
+    Grid of (order, seasonal_order) candidates for the automatic order search.
+
+    Information criteria are only comparable between models fitted on the same
+    differenced series, so the default grid fixes d and D and searches the AR/MA terms.
+
+    Returns
+    -------
+    list[tuple[tuple, tuple]]
+        (p, d, q), (P, D, Q, period) pairs.
+    """
+    return [
+        ((p, d, q), (P, D, Q, period))
+        for d, D, p, q, P, Q in itertools.product(d_values, D_values, range(max_p + 1),
+                                                  range(max_q + 1), range(max_P + 1),
+                                                  range(max_Q + 1))
+    ]
+
+
+def _usable_obs(n_obs: int, order: tuple, seasonal_order: tuple) -> int:
+    """
+    Observations left once differencing and the longest AR/MA lag are accounted for.
+    """
+    p, d, q = order
+    P, D, Q, m = seasonal_order
+    return n_obs - d - D * m - max(p + P * m, q + Q * m)
+
+
+def _n_params(order: tuple, seasonal_order: tuple) -> int:
+    return order[0] + order[2] + seasonal_order[0] + seasonal_order[2] + 1  # + variance
+
+
+def _score_task(task: tuple) -> tuple[str, tuple, tuple, float | None, list | None]:
+    """
+    Process-pool worker: fit one (country, candidate) pair and return its criterion value.
+
+    With maxiter set the optimiser stops early; the parameters reached are returned so the
+    full fit of a surviving candidate resumes from them instead of starting over.
+    """
+    import warnings
+
+    country, series, order, seasonal_order, criterion, maxiter, start_params = task
+    try:
+        with warnings.catch_warnings():
+            # Truncated fits are expected not to converge
+            warnings.simplefilter("ignore")
+            results = _fit_sarima(series, order, seasonal_order, start_params, maxiter)
+        score = float(getattr(results, criterion))
+        if not math.isfinite(score):
+            return country, order, seasonal_order, None, None
+        return country, order, seasonal_order, score, list(results.params)
+    except Exception:
+        return country, order, seasonal_order, None, None
+
+
+def _grid_key(candidates: list, criterion: str) -> str:
+    text = json.dumps([criterion, [[list(o), list(s)] for o, s in candidates]])
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def _order_is_stale(entry: dict | None, series: pd.Series, grid: str,
+                    max_new_obs: int | None, revision_tol: float,
+                    max_age_days: float | None) -> bool:
+    """
+    Whether a cached order selection no longer holds for series.
+
+    The search is repeated when the candidate grid changed, the entry is older than
+    max_age_days, more than max_new_obs months were added, or any previously seen
+    monthly value moved by more than revision_tol ppm.
+    """
+    if entry is None or entry["grid"] != grid:
+        return True
+    if max_age_days is not None and time.time() - entry["searched_at"] > max_age_days * 86400:
+        return True
+    if str(series.index[0].date()) != entry["start"]:
+        return True
+    n_old = len(entry["values"])
+    new_obs = len(series) - n_old
+    if new_obs < 0 or (max_new_obs is not None and new_obs > max_new_obs):
+        return True
+    old = pd.Series(entry["values"], dtype=float).to_numpy()
+    current = series.iloc[:n_old].to_numpy(dtype=float)
+    if (pd.isna(old) != pd.isna(current)).any():
+        return True
+    diff = abs(old - current)
+    return bool((diff[~pd.isna(diff)] > revision_tol).any())
+
+
+def select_orders(
+    series_by_country: dict[str, pd.Series],
+    candidates: list[tuple[tuple, tuple]] | None = None,
+    criterion: str = "aic",
+    workers: int | None = None,
+    short_maxiter: int = 15,
+    keep_fraction: float = 0.25,
+    margin: float = 10.0,
+    cache_file: str | None = None,
+    max_new_obs: int | None = 12,
+    revision_tol: float = 0.5,
+    max_age_days: float | None = 365
+) -> dict[str, tuple[tuple, tuple]]:
+    """
+    Choose SARIMA orders per country by information criterion, with early pruning.
+
+    The search runs in two rounds, each spread over one process pool across all
+    countries and candidates:
+
+    1. Candidates leaving too few observations for their parameter count are dropped
+       without fitting; the rest get a short fit (short_maxiter optimiser iterations).
+       Because the optimiser only improves the likelihood, a short-fit score is roughly
+       an upper bound of the converged one.
+    2. Only candidates within margin of the best short-fit score, and at most
+       keep_fraction of them, are fitted to convergence, resuming from the short-fit
+       parameters. The lowest criterion wins.
+
+    Selections are cached in cache_file with the series they were made on; a country is
+    searched again only when its data changed materially (see _order_is_stale).
+
+    Parameters
+    ----------
+    series_by_country : dict[str, pd.Series]
+        Monthly series per country (see monthly_country_series).
+    candidates : list[tuple[tuple, tuple]] | None, default=None
+        (order, seasonal_order) pairs; None uses candidate_orders().
+    criterion : str, default='aic'
+        'aic', 'bic' or 'hqic'.
+    workers : int | None, default=None
+        Number of processes (None = one per CPU).
+    short_maxiter : int, default=15
+        Optimiser iterations of the pruning fits.
+    keep_fraction : float, default=0.25
+        Largest share of candidates fitted to convergence per country.
+    margin : float, default=10.0
+        Candidates whose short-fit score exceeds the best by more are pruned.
+    cache_file : str | None, default=None
+        JSON file of selected orders per country; None disables caching.
+    max_new_obs, revision_tol, max_age_days
+        Staleness limits of cached selections: new months, largest revision (ppm) of
+        previously seen months and age in days.
+
+    Returns
+    -------
+    dict[str, tuple[tuple, tuple]]
+        Country -> (order, seasonal_order); countries where every candidate failed
+        fall back to the default orders.
+    """
+    if criterion not in ("aic", "bic", "hqic"):
+        raise ValueError(f"Unknown information criterion: {criterion}")
+    candidates = candidates or candidate_orders()
+    grid = _grid_key(candidates, criterion)
+
+    cached = {}
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file, "r", encoding="utf-8") as fh:
+            cached = json.load(fh)
+
+    selected, to_search = {}, {}
+    for country, series in series_by_country.items():
+        entry = cached.get(country)
+        if _order_is_stale(entry, series, grid, max_new_obs, revision_tol, max_age_days):
+            to_search[country] = series
+            count("cache_misses")
+        else:
+            selected[country] = (tuple(entry["order"]), tuple(entry["seasonal_order"]))
+            count("cache_hits")
+    logger.info(f"🔎 Order search: {len(selected)} countries cached, {len(to_search)} to search "
+                f"over {len(candidates)} candidates")
+    if not to_search:
+        return selected
+
+    short_tasks = [
+        (country, series, order, seasonal_order, criterion, short_maxiter, None)
+        for country, series in to_search.items()
+        for order, seasonal_order in candidates
+        if _usable_obs(series.count(), order, seasonal_order) >= 3 * _n_params(order, seasonal_order)
+    ]
+    n_pruned = len(to_search) * len(candidates) - len(short_tasks)
+
+    short_scores = {country: [] for country in to_search}
+    n_full = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for country, order, seasonal_order, score, params in pool.map(_score_task, short_tasks):
+            if score is not None:
+                short_scores[country].append((score, order, seasonal_order, params))
+
+        full_tasks = []
+        for country, scores in short_scores.items():
+            scores.sort(key=lambda item: item[0])
+            keep = max(1, math.ceil(keep_fraction * len(scores)))
+            survivors = [s for s in scores[:keep] if s[0] <= scores[0][0] + margin]
+            n_pruned += len(scores) - len(survivors)
+            full_tasks += [
+                (country, to_search[country], order, seasonal_order, criterion, None, params)
+                for _, order, seasonal_order, params in survivors
+            ]
+        n_full = len(full_tasks)
+
+        best = {}
+        for country, order, seasonal_order, score, _ in pool.map(_score_task, full_tasks):
+            if score is not None and (country not in best or score < best[country][0]):
+                best[country] = (score, order, seasonal_order)
+
+    for country, series in to_search.items():
+        if country not in best:
+            logger.warning(f"⚠️ Order search failed for {country}, using default orders")
+            selected[country] = (DEFAULT_ORDER, DEFAULT_SEASONAL_ORDER)
+            continue
+        score, order, seasonal_order = best[country]
+        selected[country] = (order, seasonal_order)
+        cached[country] = {
+            "order": list(order),
+            "seasonal_order": list(seasonal_order),
+            "criterion": criterion,
+            "score": score,
+            "grid": grid,
+            "start": str(series.index[0].date()),
+            "values": [None if pd.isna(v) else float(v) for v in series],
+            "searched_at": time.time(),
+        }
+        logger.debug(f"{country}: SARIMA{order}x{seasonal_order} {criterion}={score:.1f}")
+
+    logger.info(f"✅ Orders selected for {len(to_search)} countries in "
+                f"{time.perf_counter() - start:.1f}s ({n_full} full fits, {n_pruned} candidates pruned)")
+    if cache_file:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        with open(cache_file, "w", encoding="utf-8") as fh:
+            json.dump(cached, fh, indent=2, sort_keys=True)
+    return selected
+
+
+def _orders_file(csv_path: str) -> str:
+    return os.path.join(os.path.dirname(csv_path) or ".", "arima_orders.json")
+
+
+def _order_key(order: tuple, seasonal_order: tuple) -> str:
+    return f"{tuple(order)}x{tuple(seasonal_order)}"
+
+
+def _forecast_frame(country: str, results, steps: int) -> pd.DataFrame:
+    """
+    Tidy forecast table: country, date, forecast, lower, upper (95% interval).
+    """
+    forecast = results.get_forecast(steps=steps)
+    ci = forecast.conf_int()
+    return pd.DataFrame({
+        'country': country,
+        'date': forecast.predicted_mean.index,
+        'forecast': forecast.predicted_mean.to_numpy(),
+        'lower': ci.iloc[:, 0].to_numpy(),
+        'upper': ci.iloc[:, 1].to_numpy(),
+    })
+
+
+def plot_arima_forecast(observed: pd.Series,
+                        forecast: pd.DataFrame,
+                        country: str,
+                        save_plot: str | None = None):
+    """
+    Plot observed monthly CO₂ with a forecast table from arima_forecast_all/_forecast_frame.
+
+    Rendering never opens a window (see render.plot_forecast); for many countries use
+    arima_forecast_all(plot_dir=...), which renders in parallel.
+
+    Parameters
+    ----------
+    observed : pd.Series
+        Observed monthly mean CO₂.
+    forecast : pd.DataFrame
+        Rows of one country with 'date', 'forecast', 'lower', 'upper'.
+    country : str
+        Country name used in the title.
+    save_plot : str | None, default=None
+        If a file path is provided, saves the plot there; otherwise the Figure is returned.
+
+    Returns
+    -------
+    matplotlib.figure.Figure | None
+        The Figure when save_plot is None.
+    """
+    from render import plot_forecast
+
+    if not save_plot:
+        return plot_forecast(observed, forecast, country, model='ARIMA')
+    plot_forecast(observed, forecast, country, save_plot, model='ARIMA', dpi=300)
+    logger.info(f"✅ Plot saved to {save_plot}")
+    return None
+
 
 def arima_forecast_country(
     csv_path: str,
     country: str,
     forecast_months: int = 12,
-    save_plot: str | None = None
+    save_plot: str | None = None,
+    cache: ArimaModelCache | None = None,
+    order: tuple | str = DEFAULT_ORDER,
+    seasonal_order: tuple = DEFAULT_SEASONAL_ORDER
 ):
     """
     Fit an ARIMA (SARIMA) model to forecast CO₂ for a given country.
@@ -15,13 +494,21 @@ def arima_forecast_country(
     Parameters
     ----------
     csv_path : str
-        Path to country-level daily CO₂ CSV (must include 'country', 'date', 'xco2').
+        Path to country-level daily CO₂ table, Parquet or CSV (must include 'country', 'date', 'xco2').
     country : str
         Name of the country to forecast.
     forecast_months : int, default=12
         Number of months to forecast into the future.
     save_plot : str | None, default=None
-        If a file path is provided, saves the forecast plot as an image.
+        If a file path is provided, saves the forecast plot as an image; otherwise no
+        figure is built.
+    cache : ArimaModelCache | None, default=None
+        If provided, fitted models are reused or updated from this cache.
+    order : tuple | str, default=(1, 1, 1)
+        SARIMA order, or 'auto' to select both orders with select_orders (cached in
+        'arima_orders.json' next to csv_path).
+    seasonal_order : tuple, default=(1, 1, 1, 12)
+        Seasonal order; ignored when order is 'auto'.
 
     Returns
     -------
@@ -30,8 +517,7 @@ def arima_forecast_country(
     """
 
     # Load country aggregated CO₂ data
-    df = pd.read_csv(csv_path)
-    df['date'] = pd.to_datetime(df['date'])
+    df = read_table(csv_path, columns=['country', 'date', 'xco2'])
 
     # Filter for the specified country
     country_df = df[df['country'] == country].copy()
@@ -43,56 +529,174 @@ def arima_forecast_country(
     country_df.sort_index(inplace=True)
 
     # Resample to monthly frequency with mean CO₂
-    monthly_co2 = country_df['xco2'].resample('M').mean()
+    monthly_co2 = country_df['xco2'].resample('ME').mean()
 
     # Data sufficiency check
     if len(monthly_co2) < 24:
-        print("⚠️ Warning: Less than 2 years of data may limit forecast accuracy.")
+        logger.warning("⚠️ Warning: Less than 2 years of data may limit forecast accuracy.")
 
-    # Fit SARIMA model (seasonal order 12 = yearly seasonality)
-    model = SARIMAX(
-        monthly_co2,
-        order=(1, 1, 1),
-        seasonal_order=(1, 1, 1, 12),
-        enforce_stationarity=False,
-        enforce_invertibility=False
-    )
-    results = model.fit(disp=False)
-
-    # Forecast next n months
-    forecast = results.get_forecast(steps=forecast_months)
-    forecast_ci = forecast.conf_int()
-
-    # Plot
-    plt.figure(figsize=(12, 6))
-    plt.plot(monthly_co2.index, monthly_co2, label='Observed')
-    plt.plot(forecast.predicted_mean.index, forecast.predicted_mean,
-             label='Forecast', color='red')
-    plt.fill_between(
-        forecast_ci.index,
-        forecast_ci.iloc[:, 0],
-        forecast_ci.iloc[:, 1],
-        color='pink',
-        alpha=0.3
-    )
-    plt.title(f'ARIMA Forecast of Monthly CO₂ for {country}')
-    plt.xlabel('Date')
-    plt.ylabel('CO₂ (ppm)')
-    plt.legend()
-    plt.grid(True)
+    if order == 'auto':
+        order, seasonal_order = select_orders({country: monthly_co2},
+                                              cache_file=_orders_file(csv_path))[country]
+        logger.info(f"🔎 {country}: SARIMA{order}x{seasonal_order}")
 
+    # Fit SARIMA model and forecast next n months
+    if cache is not None:
+        results = cache.get_results(country, monthly_co2, order, seasonal_order)
+        logger.info(cache.report())
+    else:
+        results = _fit_sarima(monthly_co2, order, seasonal_order)
+    forecast = _forecast_frame(country, results, forecast_months)
+
+    # Plot only when asked to: building the figure costs more than the forecast itself
     if save_plot:
-        plt.savefig(save_plot, dpi=300, bbox_inches="tight")
-        print(f"✅ Plot saved to {save_plot}")
+        plot_arima_forecast(monthly_co2, forecast, country, save_plot)
+
+    return forecast.set_index('date')['forecast'].rename('predicted_mean')
+
+
+def _forecast_task(task: tuple) -> tuple[str, pd.DataFrame | None, list | None, dict | None, str | None]:
+    """
+    Process-pool worker: fit one country and return (country, forecast, params, cache stats, error).
+    """
+    country, series, steps, order, seasonal_order, start_params, cache_config = task
+    try:
+        if cache_config is not None:
+            cache = ArimaModelCache(**cache_config)
+            results = cache.get_results(country, series, order, seasonal_order, start_params)
+            stats = cache.stats
+        else:
+            results = _fit_sarima(series, order, seasonal_order, start_params)
+            stats = None
+        return country, _forecast_frame(country, results, steps), list(results.params), stats, None
+    except Exception as e:
+        return country, None, None, None, str(e)
+
+
+def arima_forecast_all(
+    csv_path: str,
+    countries: list[str] | None = None,
+    forecast_months: int = 12,
+    workers: int | None = None,
+    order: tuple | str = DEFAULT_ORDER,
+    seasonal_order: tuple = DEFAULT_SEASONAL_ORDER,
+    criterion: str = "aic",
+    orders_file: str | None = None,
+    params_file: str | None = None,
+    cache_dir: str | None = None,
+    max_age_days: float | None = 180,
+    max_new_obs: int | None = 12,
+    plot_dir: str | None = None
+) -> pd.DataFrame:
+    """
+    Forecast monthly CO₂ for many countries at once.
+
+    The country table is loaded once and resampled to monthly means for all countries in
+    one groupby. SARIMA models are fitted in parallel across processes, each warm-started
+    from the parameters of that country's previous fit (stored in params_file). Plots
+    are only drawn when plot_dir is given, in parallel after all fits.
+
+    Parameters
+    ----------
+    csv_path : str
+        Path to country-level daily CO₂ table (must include 'country', 'date', 'xco2').
+    countries : list[str] | None, default=None
+        Countries to forecast; None forecasts every country in the table.
+    forecast_months : int, default=12
+        Number of months to forecast into the future.
+    workers : int | None, default=None
+        Number of processes (None = one per CPU).
+    order, seasonal_order : tuple
+        SARIMA orders used for every country. order='auto' selects the orders of each
+        country with select_orders instead.
+    criterion : str, default='aic'
+        Information criterion of the automatic order search.
+    orders_file : str | None, default=None
+        JSON cache of automatically selected orders
+        (default: 'arima_orders.json' next to csv_path).
+    params_file : str | None, default=None
+        JSON file of fitted parameters per country used for warm starts
+        (default: 'arima_params.json' next to csv_path).
+    cache_dir : str | None, default=None
+        If given, fitted models are persisted there and reused/updated via ArimaModelCache.
+    max_age_days, max_new_obs
+        Staleness limits forcing a full refit (see ArimaModelCache).
+    plot_dir : str | None, default=None
+        If given, one forecast PNG per country is rendered there (render.render_forecasts).
+
+    Returns
+    -------
+    pd.DataFrame
+        Tidy table with 'country', 'date', 'forecast', 'lower', 'upper'.
+    """
+    df = read_table(csv_path, columns=['country', 'date', 'xco2'])
+    series_by_country = monthly_country_series(df)
+    if countries is not None:
+        missing = sorted(set(countries) - set(series_by_country))
+        if missing:
+            logger.warning(f"⚠️ No data found for countries: {', '.join(missing)}")
+        series_by_country = {c: series_by_country[c] for c in countries if c in series_by_country}
+
+    params_file = params_file or os.path.join(os.path.dirname(csv_path) or ".", "arima_params.json")
+    warm_params = {}
+    if os.path.exists(params_file):
+        with open(params_file, "r", encoding="utf-8") as fh:
+            warm_params = json.load(fh)
+
+    cache_config = None
+    if cache_dir is not None:
+        cache_config = dict(cache_dir=cache_dir, max_age_days=max_age_days, max_new_obs=max_new_obs)
+    cache = ArimaModelCache(**(cache_config or {}))
+
+    if order == "auto":
+        orders = select_orders(series_by_country, criterion=criterion, workers=workers,
+                               cache_file=orders_file or _orders_file(csv_path))
     else:
-        plt.show()
+        orders = dict.fromkeys(series_by_country, (tuple(order), tuple(seasonal_order)))
+
+    tasks = [
+        (country, series, forecast_months, *orders[country],
+         warm_params.get(country, {}).get(_order_key(*orders[country])), cache_config)
+        for country, series in series_by_country.items()
+    ]
+    logger.info(f"⚙️ Fitting SARIMA for {len(tasks)} countries")
+
+    forecasts = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for country, forecast, params, stats, error in pool.map(_forecast_task, tasks):
+            if error is not None:
+                logger.error(f"❌ Failed to forecast {country}: {error}")
+                continue
+            forecasts.append(forecast)
+            warm_params.setdefault(country, {})[_order_key(*orders[country])] = params
+            for name, value in (stats or {}).items():
+                cache.stats[name] += value
+            if stats:
+                # Workers cannot report to this process's stage metrics; count here
+                count("cache_hits", stats["hits"] + stats["appends"])
+                count("cache_misses", stats["refits"])
+    if cache_config is not None:
+        logger.info(cache.report())
+
+    with open(params_file, "w", encoding="utf-8") as fh:
+        json.dump(warm_params, fh, indent=2, sort_keys=True)
+
+    if not forecasts:
+        return pd.DataFrame(columns=['country', 'date', 'forecast', 'lower', 'upper'])
+    result = pd.concat(forecasts, ignore_index=True)
+    logger.info(f"✅ Forecasts computed for {result['country'].nunique()} countries")
 
-    return forecast.predicted_mean
+    if plot_dir is not None:
+        from render import render_forecasts
+        render_forecasts(series_by_country, result, plot_dir, model='ARIMA', workers=workers)
+    return result
 
 
 # Example usage
 if __name__ == "__main__":
-    csv_path = './oco2_ingested/country_daily_co2.csv'
+    from instrumentation import configure_logging
+    configure_logging()
+    csv_path = './oco2_ingested/country_daily_co2.parquet'
     country_name = 'India'
     forecast_values = arima_forecast_country(csv_path, country_name)
     print(forecast_values.head())
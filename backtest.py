@@ -0,0 +1,291 @@
+# backtest.py
+import os
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from storage import read_table, write_table
+from arima import (monthly_country_series, select_orders, _fit_sarima, _forecast_frame,
+                   DEFAULT_ORDER, DEFAULT_SEASONAL_ORDER)
+
+logger = logging.getLogger(__name__)
+
+METHODS = ("arima", "lstm")
+INTERVAL = 0.95  # nominal coverage of the 'lower'/'upper' bounds of both methods
+PREDICTION_COLUMNS = ["country", "method", "origin", "step", "date", "forecast", "lower", "upper", "actual"]
+
+
+def rolling_origins(last_month: pd.Timestamp, horizon: int = 6, n_origins: int = 8,
+                    step: int = 3) -> list[pd.Timestamp]:
+    """
+    Forecast origins (month ends), the latest one leaving a full horizon before last_month.
+
+    Args:
+        last_month (pd.Timestamp): Last observed month end.
+        horizon (int): Months forecast from every origin.
+        n_origins (int): Number of origins.
+        step (int): Months between consecutive origins.
+
+    Returns:
+        list[pd.Timestamp]: Origins in ascending order.
+    """
+    return [last_month - pd.offsets.MonthEnd(horizon + step * k) for k in reversed(range(n_origins))]
+
+
+def _with_actuals(frame: pd.DataFrame, series: pd.Series, method: str, origin) -> pd.DataFrame:
+    frame = frame.assign(method=method, origin=origin, step=np.arange(1, len(frame) + 1))
+    frame["actual"] = series.reindex(frame["date"]).to_numpy()
+    return frame.reindex(columns=PREDICTION_COLUMNS)
+
+
+def _arima_task(task: tuple) -> tuple[str, pd.DataFrame | None, float, str | None]:
+    """
+    Process-pool worker: rolling-origin ARIMA forecasts of one country.
+
+    The model is estimated once, on the data before the first origin. Every later origin
+    extends the state-space results with the months observed since the previous one
+    (a Kalman filter pass over the new months only, parameters kept), unless
+    refit_every asks for a re-estimation, which is warm-started from the current
+    parameters. Returns (country, predictions, seconds, error).
+    """
+    country, series, origins, horizon, order, seasonal_order, refit_every, min_train = task
+    start = time.perf_counter()
+    try:
+        frames, results, last, fits = [], None, None, 0
+        for origin in origins:
+            train = series.loc[:origin]
+            if train.count() < min_train:
+                continue
+            if results is None or (refit_every and fits % refit_every == 0):
+                params = None if results is None else results.params
+                results = _fit_sarima(train, order, seasonal_order, params)
+            elif len(train) > len(series.loc[:last]):
+                results = results.extend(train.iloc[len(series.loc[:last]):])
+            fits += 1
+            last = origin
+            frames.append(_with_actuals(_forecast_frame(country, results, horizon), series, "arima", origin))
+        if not frames:
+            return country, None, time.perf_counter() - start, f"fewer than {min_train} months before every origin"
+        return country, pd.concat(frames, ignore_index=True), time.perf_counter() - start, None
+    except Exception as e:
+        return country, None, time.perf_counter() - start, str(e)
+
+
+def _lstm_task(task: tuple) -> tuple[pd.Timestamp, pd.DataFrame | None, float, str | None]:
+    """
+    Process-pool worker: train one global LSTM on the months before an origin and
+    forecast every country from it. Returns (origin, predictions, seconds, error).
+    """
+    from lstm import fit_forecast_global
+
+    origin, series_by_country, horizon, min_train, lstm_kwargs = task
+    start = time.perf_counter()
+    try:
+        frames = []
+        for country, series in series_by_country.items():
+            train = series.loc[:origin]
+            if train.count() < min_train:
+                continue
+            # The LSTM needs gap-free windows; months without soundings are interpolated
+            train = train.interpolate(limit_area="inside").dropna()
+            frames.append(pd.DataFrame({"country": country, "date": train.index, "xco2": train.to_numpy()}))
+        if not frames:
+            return origin, None, time.perf_counter() - start, f"fewer than {min_train} months before origin"
+        df = pd.concat(frames, ignore_index=True)
+        tail = (1 - INTERVAL) / 2 * 100
+        names, preds, lower, upper, _ = fit_forecast_global(
+            df, forecast_horizon=horizon, interval=(tail, 100 - tail), verbose=0, **lstm_kwargs)
+
+        dates = pd.date_range(origin, periods=horizon + 1, freq="ME")[1:]
+        out = []
+        for i, name in enumerate(names):
+            frame = pd.DataFrame({"country": name, "date": dates, "forecast": preds[i]})
+            if lower is not None:
+                frame["lower"], frame["upper"] = lower[i], upper[i]
+            out.append(_with_actuals(frame, series_by_country[name], "lstm", origin))
+        return origin, pd.concat(out, ignore_index=True), time.perf_counter() - start, None
+    except Exception as e:
+        return origin, None, time.perf_counter() - start, str(e)
+
+
+def error_table(predictions: pd.DataFrame, seconds: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-country, per-method forecast errors over all origins and steps with an actual.
+
+    Args:
+        predictions (pd.DataFrame): Rolling-origin forecasts (PREDICTION_COLUMNS).
+        seconds (pd.DataFrame): 'country', 'method', 'seconds' runtime per pair.
+
+    Returns:
+        pd.DataFrame: 'country', 'method', 'origins', 'n' (scored forecasts), 'mae',
+            'rmse', 'coverage' (share of actuals inside [lower, upper]; NaN without
+            intervals), 'nominal' and 'seconds'.
+    """
+    scored = predictions.dropna(subset=["actual", "forecast"])
+    error = scored["forecast"] - scored["actual"]
+    has_interval = scored["lower"].notna() & scored["upper"].notna()
+    inside = (scored["actual"] >= scored["lower"]) & (scored["actual"] <= scored["upper"])
+    scored = scored.assign(abs_error=error.abs(), sq_error=error ** 2,
+                           inside=inside.where(has_interval).astype(float))
+    table = (
+        scored.groupby(["country", "method"], sort=True)
+        .agg(origins=("origin", "nunique"), n=("actual", "size"), mae=("abs_error", "mean"),
+             rmse=("sq_error", "mean"), coverage=("inside", "mean"))
+        .reset_index()
+    )
+    table["rmse"] = np.sqrt(table["rmse"])
+    table["nominal"] = INTERVAL
+    return table.merge(seconds, on=["country", "method"], how="left")
+
+
+def run_backtest(
+    csv_path: str = "./oco2_ingested/country_daily_co2.parquet",
+    methods: tuple = METHODS,
+    countries: list[str] | None = None,
+    horizon: int = 6,
+    n_origins: int = 8,
+    step: int = 3,
+    min_train: int = 24,
+    workers: int | None = None,
+    order: tuple | str = DEFAULT_ORDER,
+    seasonal_order: tuple = DEFAULT_SEASONAL_ORDER,
+    refit_every: int | None = None,
+    lstm_kwargs: dict | None = None,
+    output_dir: str | None = "./oco2_ingested/backtest"
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Rolling-origin evaluation of ARIMA and LSTM forecasts of monthly CO₂ for every country.
+
+    From each origin both methods forecast `horizon` months using only data up to the
+    origin; forecasts are scored against the observed monthly means. All work runs in
+    one process pool: one ARIMA task per country (estimated once, then extended from
+    origin to origin instead of refitted) and one LSTM task per origin (a single global
+    model for all countries), so ARIMA fits and LSTM training overlap.
+
+    Args:
+        csv_path (str): Country-level daily CO₂ table ('country', 'date', 'xco2').
+        methods (tuple): Subset of ('arima', 'lstm').
+        countries (list[str] | None): Countries to evaluate; None evaluates all.
+        horizon (int): Months forecast from every origin.
+        n_origins (int): Number of forecast origins.
+        step (int): Months between consecutive origins.
+        min_train (int): Observed months required before an origin to forecast from it.
+        workers (int | None): Number of processes (None = one per CPU).
+        order, seasonal_order: SARIMA orders; order='auto' selects them per country with
+            arima.select_orders on the data before the first origin (not cached, so the
+            forecast order cache is left alone).
+        refit_every (int | None): Re-estimate ARIMA parameters every that many origins;
+            None extends the first fit through all origins.
+        lstm_kwargs (dict | None): Options of lstm.fit_forecast_global (n_steps, epochs,
+            dropout, mc_samples, ...). Intervals need dropout > 0 and mc_samples > 0.
+        output_dir (str | None): If given, 'backtest_errors.csv' and
+            'backtest_predictions.parquet' are written there.
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: Error table (see error_table) and the
+            forecasts of every origin with their actuals.
+    """
+    unknown = set(methods) - set(METHODS)
+    if unknown:
+        raise ValueError(f"Unknown forecast methods: {', '.join(sorted(unknown))}")
+    lstm_kwargs = {"n_steps": 12, "epochs": 50, "dropout": 0.2, "mc_samples": 50, **(lstm_kwargs or {})}
+
+    df = read_table(csv_path, columns=["country", "date", "xco2"])
+    series_by_country = monthly_country_series(df)
+    if countries is not None:
+        series_by_country = {c: s for c, s in series_by_country.items() if c in set(countries)}
+    if not series_by_country:
+        raise ValueError("No country series to backtest.")
+    last_month = max(series.index[-1] for series in series_by_country.values())
+    origins = rolling_origins(last_month, horizon, n_origins, step)
+    logger.info(f"🧪 Backtesting {', '.join(methods)} on {len(series_by_country)} countries, "
+                f"{len(origins)} origins {origins[0]:%Y-%m} → {origins[-1]:%Y-%m}, {horizon}-month horizon")
+
+    if "arima" in methods and order == "auto":
+        orders = select_orders({c: s.loc[:origins[0]] for c, s in series_by_country.items()
+                                if s.loc[:origins[0]].count() >= min_train}, workers=workers)
+    else:
+        orders = {}
+
+    frames, seconds = [], []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        if "lstm" in methods:
+            # Submitted first: one long task per origin
+            futures += [pool.submit(_lstm_task, (origin, series_by_country, horizon, min_train, lstm_kwargs))
+                        for origin in origins]
+        if "arima" in methods:
+            futures += [
+                pool.submit(_arima_task, (country, series, origins, horizon,
+                                          *orders.get(country, (order, seasonal_order)),
+                                          refit_every, min_train))
+                for country, series in series_by_country.items()
+            ]
+        for future in futures:
+            key, frame, elapsed, error = future.result()
+            if error is not None:
+                name = f"ARIMA {key}" if isinstance(key, str) else f"LSTM origin {key:%Y-%m}"
+                logger.error(f"❌ Backtest failed for {name}: {error}")
+                continue
+            frames.append(frame)
+            if isinstance(key, str):
+                seconds.append({"country": key, "method": "arima", "seconds": elapsed})
+            else:
+                # One model serves every country of the origin; share its cost evenly
+                names = frame["country"].unique()
+                seconds += [{"country": name, "method": "lstm", "seconds": elapsed / len(names)}
+                            for name in names]
+
+    if not frames:
+        raise ValueError("Backtest produced no forecasts.")
+    predictions = pd.concat(frames, ignore_index=True).sort_values(
+        ["country", "method", "origin", "step"], ignore_index=True)
+    seconds = pd.DataFrame(seconds).groupby(["country", "method"], as_index=False)["seconds"].sum()
+    errors = error_table(predictions, seconds)
+    logger.info(f"✅ Backtest done in {time.perf_counter() - start:.1f}s")
+
+    if len(set(errors["method"])) > 1:
+        best = errors.loc[errors.groupby("country")["rmse"].idxmin(), "method"].value_counts()
+        logger.info("🏁 Lowest RMSE per country: " + ", ".join(f"{m} {n}" for m, n in best.items()))
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        errors.to_csv(os.path.join(output_dir, "backtest_errors.csv"), index=False)
+        write_table(predictions, os.path.join(output_dir, "backtest_predictions.parquet"))
+        logger.info(f"💾 Backtest results saved to {output_dir}")
+    return errors, predictions
+
+
+def main(argv: list[str] | None = None) -> None:
+    from instrumentation import configure_logging
+
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of ARIMA vs LSTM forecasts.")
+    parser.add_argument("--input", default="./oco2_ingested/country_daily_co2.parquet")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+    parser.add_argument("--countries", nargs="+", default=None)
+    parser.add_argument("--horizon", type=int, default=6)
+    parser.add_argument("--origins", type=int, default=8)
+    parser.add_argument("--step", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--auto-order", action="store_true", help="Select SARIMA orders per country")
+    parser.add_argument("--refit-every", type=int, default=None)
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--output-dir", default="./oco2_ingested/backtest")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    errors, _ = run_backtest(args.input, tuple(args.methods), args.countries, args.horizon,
+                             args.origins, args.step, workers=args.workers,
+                             order="auto" if args.auto_order else DEFAULT_ORDER,
+                             refit_every=args.refit_every, lstm_kwargs={"epochs": args.epochs},
+                             output_dir=args.output_dir)
+    print(errors.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
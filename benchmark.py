@@ -0,0 +1,300 @@
+# benchmark.py
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import multiprocessing
+from pathlib import Path
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+STAGES = ("ingest", "preprocess", "aggregation", "country", "arima", "lstm")
+RESULTS_DIR = "./benchmarks"
+INPUTS_NAME = "inputs.json"
+
+
+def _paths(workdir: str) -> dict:
+    work = Path(workdir)
+    return {
+        "granules": str(work / "granules"),
+        "ingested": str(work / "ingested"),
+        "combined": str(work / "ingested" / "combined_oco2_data.parquet"),
+        "cleaned": str(work / "ingested" / "cleaned_oco2_data.parquet"),
+        "shapefile": str(work / "countries.shp"),
+        "country": str(work / "ingested" / "country_daily_co2.parquet"),
+        "forecast_input": str(work / "forecast_country_daily.parquet"),
+    }
+
+
+def _stage_body(stage: str, paths: dict, params: dict) -> str:
+    """
+    Run one stage and return the table whose row count measures its throughput.
+    """
+    if stage == "ingest":
+        from ingest import ingest_data
+        ingest_data(paths["granules"], paths["ingested"], overwrite=True,
+                    workers=params.get("workers", 1))
+        return paths["combined"]
+    if stage == "preprocess":
+        from preprocessing import preprocess_oco2_data
+        preprocess_oco2_data(paths["combined"], paths["cleaned"], plot=False)
+        return paths["combined"]
+    if stage == "aggregation":
+        from aggregation import aggregate_global_lat_bands
+        out = Path(paths["ingested"])
+        aggregate_global_lat_bands(paths["cleaned"], str(out / "daily_global_mean.parquet"),
+                                   str(out / "daily_latband_mean.parquet"))
+        return paths["cleaned"]
+    if stage == "country":
+        from country import aggregate_country_daily
+        aggregate_country_daily(paths["cleaned"], paths["shapefile"], paths["country"],
+                                method=params.get("country_method", "grid"))
+        return paths["cleaned"]
+    if stage == "arima":
+        from arima import arima_forecast_all
+        arima_forecast_all(paths["forecast_input"], workers=params.get("workers", 1))
+        return paths["forecast_input"]
+    if stage == "lstm":
+        from lstm import lstm_forecast_all
+        lstm_forecast_all(paths["forecast_input"], epochs=params.get("lstm_epochs", 5))
+        return paths["forecast_input"]
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def _measure_stage(stage: str, workdir: str, params: dict) -> dict:
+    # Runs in a fresh process so peak RSS belongs to this stage alone
+    sys.path.insert(0, str(Path(__file__).parent))
+    from storage import read_table
+    from instrumentation import configure_logging, stage_metrics
+
+    configure_logging(params.get("log_level", "INFO"))
+    with stage_metrics(stage) as metrics:
+        table = _stage_body(stage, _paths(workdir), params)
+    rows = len(read_table(table, columns=["xco2"]))
+    return {
+        "stage": stage,
+        "rows": rows,
+        "rows_per_second": rows / metrics.wall_seconds if metrics.wall_seconds else None,
+        **metrics.as_dict(),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(
+    workdir: str = "./benchmarks/work",
+    stages: tuple = STAGES,
+    days: int = 10,
+    soundings: int = 100_000,
+    countries: int = 20,
+    results_dir: str = RESULTS_DIR,
+    **params
+) -> dict:
+    """
+    Generate synthetic inputs, run each stage in a fresh process and save the results.
+
+    Args:
+        workdir (str): Scratch directory for synthetic inputs and stage outputs. Inputs
+            are regenerated when days, soundings or countries differ from the settings
+            recorded in its inputs.json.
+        stages (tuple): Stages to run, in pipeline order.
+        days (int): Number of synthetic daily granules.
+        soundings (int): Soundings per granule.
+        countries (int): Number of synthetic countries for the forecaster inputs.
+        results_dir (str): Directory receiving '<timestamp>_<commit>.json'.
+        **params: Stage options (workers, country_method, lstm_epochs, log_level).
+
+    Returns:
+        dict: The saved report, with one record per stage.
+    """
+    from synthetic import generate_granules, generate_country_shapefile, generate_country_daily
+
+    paths = _paths(workdir)
+    # Inputs from an earlier run are reused only if they were generated with the same settings
+    inputs_path = Path(workdir) / INPUTS_NAME
+    recorded = json.loads(inputs_path.read_text(encoding="utf-8")) if inputs_path.exists() else {}
+    wanted = {"granules": {"days": days, "soundings": soundings},
+              "shapefile": {},
+              "forecast_input": {"countries": countries}}
+
+    def stale(name: str) -> bool:
+        return recorded.get(name) != wanted[name] or not Path(paths[name]).exists()
+
+    if stale("granules"):
+        # Drop the old granules so a smaller --days does not leave extra files behind
+        shutil.rmtree(paths["granules"], ignore_errors=True)
+        generate_granules(paths["granules"], days=days, soundings=soundings)
+        recorded["granules"] = wanted["granules"]
+    if "country" in stages and stale("shapefile"):
+        generate_country_shapefile(paths["shapefile"])
+        recorded["shapefile"] = wanted["shapefile"]
+    if {"arima", "lstm"} & set(stages) and stale("forecast_input"):
+        generate_country_daily(paths["forecast_input"], countries=countries)
+        recorded["forecast_input"] = wanted["forecast_input"]
+    inputs_path.parent.mkdir(parents=True, exist_ok=True)
+    inputs_path.write_text(json.dumps(recorded, indent=2), encoding="utf-8")
+
+    records = []
+    spawn = multiprocessing.get_context("spawn")
+    for stage in stages:
+        print(f"\n=== BENCHMARK: {stage} ===")
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            record = pool.submit(_measure_stage, stage, workdir, params).result()
+        records.append(record)
+        print(f"⏱️ {stage}: {record['wall_seconds']:.2f}s, "
+              f"{record['rows_per_second'] or 0:,.0f} rows/s, peak {record['peak_rss_mb']:.0f} MB")
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {"days": days, "soundings": soundings, "countries": countries, **params},
+        "stages": records,
+    }
+    os.makedirs(results_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    out_path = Path(results_dir) / f"{stamp}_{report['commit']}.json"
+    with open(out_path, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\n✅ Benchmark results saved to {out_path}")
+    return report
+
+
+def _legacy_soundings(soundings: int, granules: int, seed: int = 0):
+    """
+    Sounding table in the pre-compact layout: float64 measurements, datetime.date
+    objects in 'date' and the granule name repeated as a string on every row.
+    """
+    import numpy as np
+    import pandas as pd
+    from synthetic import _synthetic_xco2
+
+    rng = np.random.default_rng(seed)
+    day = rng.integers(0, granules, soundings)
+    seconds = day * 86400 + rng.integers(0, 86400, soundings)
+    time = pd.to_datetime("2020-01-01") + pd.to_timedelta(seconds, unit="s")
+    latitude = rng.uniform(-90, 90, soundings)
+    df = pd.DataFrame({
+        "xco2": _synthetic_xco2(pd.DatetimeIndex(time), latitude, rng),
+        "latitude": latitude,
+        "longitude": rng.uniform(-180, 180, soundings),
+        "time": time,
+    })
+    df["date"] = df["time"].dt.date
+    df["source_file"] = [f"oco2_LtCO2_{d:03d}_B11014Ar_synthetic.nc4" for d in day]
+    return df
+
+
+def memory_benchmark(soundings: int = 2_000_000, granules: int = 30, repeats: int = 3) -> dict:
+    """
+    Compare the memory footprint and groupby speed of the legacy and compact schemas.
+
+    Args:
+        soundings (int): Rows in the synthetic table.
+        granules (int): Number of distinct days / source granules.
+        repeats (int): Timing repetitions (the best is reported).
+
+    Returns:
+        dict: Per-layout 'memory_mb', 'groupby_date_s' and 'groupby_source_s'.
+    """
+    from storage import compact_soundings
+
+    legacy = _legacy_soundings(soundings, granules)
+    layouts = {"legacy": legacy, "compact": compact_soundings(legacy)}
+    report = {}
+    for name, df in layouts.items():
+        timings = {}
+        for label, keys in (("groupby_date_s", ["date"]), ("groupby_source_s", ["source_file", "date"])):
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                df.groupby(keys, observed=True)["xco2"].mean()
+                best = min(best, time.perf_counter() - start)
+            timings[label] = best
+        report[name] = {"memory_mb": df.memory_usage(deep=True).sum() / (1 << 20), **timings}
+        print(f"{name:<8} {report[name]['memory_mb']:9.1f} MB   groupby(date) "
+              f"{timings['groupby_date_s']:.3f}s   groupby(source_file, date) {timings['groupby_source_s']:.3f}s")
+    ratio = report["legacy"]["memory_mb"] / report["compact"]["memory_mb"]
+    print(f"✅ Compact schema uses {ratio:.1f}x less memory for {soundings:,} soundings")
+    return report
+
+
+def compare(baseline: str, candidate: str, threshold: float = 0.10) -> list[dict]:
+    """
+    Compare two saved benchmark reports stage by stage.
+
+    Args:
+        baseline (str): Path to the reference report.
+        candidate (str): Path to the new report.
+        threshold (float): Relative slowdown (wall time) or memory growth flagged as a
+            regression (default 10%).
+
+    Returns:
+        list[dict]: Per-stage wall-time and peak-memory ratios with a 'regression' flag.
+    """
+    with open(baseline, "r", encoding="utf-8") as fh:
+        base = {r["stage"]: r for r in json.load(fh)["stages"]}
+    with open(candidate, "r", encoding="utf-8") as fh:
+        cand = {r["stage"]: r for r in json.load(fh)["stages"]}
+
+    rows = []
+    for stage in [s for s in STAGES if s in base and s in cand]:
+        wall_ratio = cand[stage]["wall_seconds"] / base[stage]["wall_seconds"]
+        mem_ratio = cand[stage]["peak_rss_mb"] / base[stage]["peak_rss_mb"]
+        regression = wall_ratio > 1 + threshold or mem_ratio > 1 + threshold
+        rows.append({"stage": stage, "wall_ratio": wall_ratio, "memory_ratio": mem_ratio,
+                     "regression": regression})
+        flag = "❌" if regression else "✅"
+        print(f"{flag} {stage:<12} wall x{wall_ratio:.2f}   peak RSS x{mem_ratio:.2f}")
+    return rows
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Stage-by-stage benchmarks on synthetic OCO-2 data.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the benchmarks and save a report")
+    run.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    run.add_argument("--days", type=int, default=10)
+    run.add_argument("--soundings", type=int, default=100_000)
+    run.add_argument("--countries", type=int, default=20)
+    run.add_argument("--workers", type=int, default=1)
+    run.add_argument("--country-method", choices=["grid", "sjoin"], default="grid")
+    run.add_argument("--lstm-epochs", type=int, default=5)
+    run.add_argument("--workdir", default="./benchmarks/work")
+
+    memory = sub.add_parser("memory", help="compare legacy and compact sounding schemas")
+    memory.add_argument("--soundings", type=int, default=2_000_000)
+    memory.add_argument("--granules", type=int, default=30)
+
+    cmp_parser = sub.add_parser("compare", help="compare two saved reports")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("candidate")
+    cmp_parser.add_argument("--threshold", type=float, default=0.10)
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run_benchmarks(args.workdir, tuple(args.stages), args.days, args.soundings, args.countries,
+                       workers=args.workers, country_method=args.country_method,
+                       lstm_epochs=args.lstm_epochs)
+        return 0
+    if args.command == "memory":
+        memory_benchmark(args.soundings, args.granules)
+        return 0
+    rows = compare(args.baseline, args.candidate, args.threshold)
+    return 1 if any(r["regression"] for r in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
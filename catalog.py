@@ -0,0 +1,305 @@
+# catalog.py
+import os
+import json
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "ingest_manifest.json"
+CLEAN_MANIFEST_NAME = "clean_manifest.json"
+# Store described by each manifest
+STORE_NAMES = {
+    MANIFEST_NAME: "combined_oco2_data.parquet",
+    CLEAN_MANIFEST_NAME: "cleaned_oco2_data.parquet",
+}
+STAT_COLUMNS = ("xco2", "latitude", "longitude")
+
+
+def granule_stats(df: pd.DataFrame) -> dict:
+    """
+    Catalog statistics of one decoded granule, recorded in the ingest manifest.
+
+    Args:
+        df (pd.DataFrame): Soundings of the granule ('time', 'date' and STAT_COLUMNS).
+
+    Returns:
+        dict: time_min/time_max (ISO strings), rows_by_date ({date: rows}) and
+            {min, max, mean} of every column in STAT_COLUMNS (None when empty).
+    """
+    stats = {
+        "time_min": None if df.empty else df["time"].min().isoformat(),
+        "time_max": None if df.empty else df["time"].max().isoformat(),
+        "rows_by_date": {
+            pd.Timestamp(date).strftime("%Y-%m-%d"): int(n)
+            for date, n in df["date"].value_counts(sort=False).sort_index().items()
+        },
+    }
+    for column in STAT_COLUMNS:
+        values = df[column].to_numpy(dtype=np.float64)
+        stats[column] = {
+            "min": float(values.min()) if len(values) else None,
+            "max": float(values.max()) if len(values) else None,
+            "mean": float(values.mean()) if len(values) else None,
+        }
+    return stats
+
+
+class DatasetCatalog:
+    """
+    Answers coverage, gap and summary questions about an ingested store from its manifest.
+
+    ingest_data/ingest_clean_data record per-granule statistics in the manifest they
+    maintain anyway (see granule_stats), so the catalog is a few KB of JSON per thousand
+    granules: loading it and every query take milliseconds, and no sounding is ever read.
+    """
+
+    def __init__(self, manifest: dict, store: str | None = None):
+        self.manifest = manifest
+        self.store = store
+        self.granules = self._granule_table(manifest.get("files", {}))
+
+    @classmethod
+    def load(cls, output_folder: str = "./oco2_ingested", name: str = MANIFEST_NAME) -> "DatasetCatalog":
+        """
+        Load the catalog of a store from its manifest.
+
+        Args:
+            output_folder (str): Folder holding the store and its manifest.
+            name (str): MANIFEST_NAME (combined store) or CLEAN_MANIFEST_NAME (cleaned store).
+
+        Raises:
+            ValueError: If the data was ingested as CSV, which keeps no manifest.
+        """
+        store = Path(output_folder) / STORE_NAMES.get(name, "")
+        if name in STORE_NAMES and not store.exists() and store.with_suffix(".csv").exists():
+            raise ValueError(f"{store.with_suffix('.csv')} is a CSV export, which has no catalog; "
+                             "ingest with output_format='parquet' to query coverage and gaps.")
+        path = Path(output_folder) / name
+        manifest = {"files": {}}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as fh:
+                manifest = json.load(fh)
+        else:
+            logger.warning(f"⚠️ No manifest found at {path}")
+        return cls(manifest, str(store))
+
+    @staticmethod
+    def _granule_table(entries: dict) -> pd.DataFrame:
+        records = []
+        for file, entry in sorted(entries.items()):
+            dates = sorted(entry.get("rows_by_date") or entry.get("dates") or [])
+            record = {
+                "file": file,
+                "rows": entry.get("rows"),
+                "first_date": dates[0] if dates else None,
+                "last_date": dates[-1] if dates else None,
+                "time_min": entry.get("time_min"),
+                "time_max": entry.get("time_max"),
+                "size": entry.get("size"),
+                "sha256": entry.get("sha256"),
+            }
+            for column in STAT_COLUMNS:
+                for stat in ("min", "max", "mean"):
+                    record[f"{column}_{stat}"] = (entry.get(column) or {}).get(stat)
+            records.append(record)
+        table = pd.DataFrame.from_records(records, columns=[
+            "file", "rows", "first_date", "last_date", "time_min", "time_max", "size", "sha256",
+            *(f"{c}_{s}" for c in STAT_COLUMNS for s in ("min", "max", "mean")),
+        ])
+        for column in ("first_date", "last_date", "time_min", "time_max"):
+            table[column] = pd.to_datetime(table[column])
+        return table
+
+    def missing_stats(self) -> list[str]:
+        """
+        Granules ingested before statistics were recorded (see backfill_catalog).
+        """
+        return [f for f, e in self.manifest.get("files", {}).items() if "rows_by_date" not in e]
+
+    def coverage(self) -> pd.DataFrame:
+        """
+        Rows and contributing granules per date.
+
+        Returns:
+            pd.DataFrame: 'date', 'rows' and 'granules', sorted by date. Granules without
+                statistics count towards 'granules' only.
+        """
+        rows, granules = {}, {}
+        for entry in self.manifest.get("files", {}).values():
+            by_date = entry.get("rows_by_date")
+            for date in by_date or entry.get("dates", []):
+                granules[date] = granules.get(date, 0) + 1
+                rows[date] = rows.get(date, 0) + (by_date[date] if by_date else 0)
+        dates = sorted(granules)
+        return pd.DataFrame({
+            "date": pd.to_datetime(dates),
+            "rows": [rows[d] for d in dates],
+            "granules": [granules[d] for d in dates],
+        })
+
+    def dates(self) -> pd.DatetimeIndex:
+        """
+        Distinct dates present in the store.
+        """
+        return pd.DatetimeIndex(self.coverage()["date"])
+
+    def gaps(self, start: str | None = None, end: str | None = None) -> pd.DataFrame:
+        """
+        Runs of consecutive days without data.
+
+        Args:
+            start (str | None): First expected date (default: first date in the store).
+            end (str | None): Last expected date (default: last date in the store).
+
+        Returns:
+            pd.DataFrame: 'start', 'end' and 'days' of every gap.
+        """
+        present = self.dates()
+        if present.empty and (start is None or end is None):
+            return pd.DataFrame(columns=["start", "end", "days"])
+        expected = pd.date_range(start or present[0], end or present[-1], freq="D")
+        missing = expected[~expected.isin(present)]
+        if missing.empty:
+            return pd.DataFrame(columns=["start", "end", "days"])
+        # A new run starts wherever the previous missing day is not yesterday
+        run = np.cumsum(np.diff(missing.asi8, prepend=missing.asi8[0]) != pd.Timedelta(days=1).value)
+        runs = pd.Series(missing).groupby(run)
+        return pd.DataFrame({
+            "start": runs.min().to_numpy(),
+            "end": runs.max().to_numpy(),
+            "days": runs.size().to_numpy(),
+        })
+
+    def summary(self) -> dict:
+        """
+        Store-wide totals: granules, rows, date/time range, days covered and gaps, and the
+        overall min/max/mean of every column in STAT_COLUMNS (means weighted by rows).
+        """
+        table = self.granules
+        coverage = self.coverage()
+        gaps = self.gaps()
+        summary = {
+            "store": self.store,
+            "granules": len(table),
+            "rows": int(table["rows"].fillna(0).sum()),
+            "first_date": None if coverage.empty else str(coverage["date"].iloc[0].date()),
+            "last_date": None if coverage.empty else str(coverage["date"].iloc[-1].date()),
+            "days": len(coverage),
+            "missing_days": int(gaps["days"].sum()) if len(gaps) else 0,
+            "gaps": len(gaps),
+            "time_min": None if table["time_min"].isna().all() else table["time_min"].min().isoformat(),
+            "time_max": None if table["time_max"].isna().all() else table["time_max"].max().isoformat(),
+            "granules_without_stats": len(self.missing_stats()),
+        }
+        weights = table["rows"].fillna(0).to_numpy(dtype=np.float64)
+        for column in STAT_COLUMNS:
+            means = table[f"{column}_mean"].to_numpy(dtype=np.float64)
+            known = ~np.isnan(means) & (weights > 0)
+            summary[column] = {
+                "min": None if table[f"{column}_min"].isna().all() else float(table[f"{column}_min"].min()),
+                "max": None if table[f"{column}_max"].isna().all() else float(table[f"{column}_max"].max()),
+                "mean": float(np.average(means[known], weights=weights[known])) if known.any() else None,
+            }
+        return summary
+
+    def schema(self) -> dict[str, str]:
+        """
+        Column types of the store, read from the footer of one part file.
+        """
+        import pyarrow.parquet as pq
+        from storage import list_partitions
+
+        partitions = list_partitions(self.store) if self.store else {}
+        if not partitions:
+            return {}
+        schema = pq.read_schema(next(iter(partitions.values()))[0])
+        # 'date' is not stored in the part files but in the partition directory names
+        return {field.name: str(field.type) for field in schema} | {"date": "timestamp[ns]"}
+
+
+def backfill_catalog(
+    output_folder: str = "./oco2_ingested",
+    name: str = MANIFEST_NAME,
+    data_folder: str | None = None
+) -> int:
+    """
+    Add statistics to manifest entries written before the catalog existed.
+
+    Reads only the part files of those granules from the store. Checksums are computed
+    when data_folder still holds the granule files.
+
+    Args:
+        output_folder (str): Folder holding the store and its manifest.
+        name (str): Manifest file name.
+        data_folder (str | None): Folder of the raw granules, for checksums.
+
+    Returns:
+        int: Number of granules backfilled.
+    """
+    from ingest import load_manifest, _save_manifest, _sha256
+    from storage import partition_dir, compact_soundings, concat_soundings
+
+    store = Path(output_folder) / STORE_NAMES[name]
+    manifest = load_manifest(output_folder, name)
+    missing = DatasetCatalog(manifest, str(store)).missing_stats()
+    for file in missing:
+        entry = manifest["files"][file]
+        parts = [(date, partition_dir(store, date) / f"{Path(file).stem}.parquet")
+                 for date in entry.get("dates", [])]
+        frames = [pd.read_parquet(p, columns=["time", *STAT_COLUMNS]).assign(date=pd.Timestamp(date))
+                  for date, p in parts if p.exists()]
+        entry.update(granule_stats(compact_soundings(concat_soundings(frames)) if frames else
+                                   pd.DataFrame(columns=["time", "date", *STAT_COLUMNS])))
+        if data_folder is not None and "sha256" not in entry and os.path.exists(os.path.join(data_folder, file)):
+            entry["sha256"] = _sha256(os.path.join(data_folder, file))
+    if missing:
+        _save_manifest(Path(output_folder) / name, manifest)
+        logger.info(f"✅ Catalog statistics backfilled for {len(missing)} granules")
+    return len(missing)
+
+
+def _print_table(df: pd.DataFrame, as_json: bool) -> None:
+    if as_json:
+        print(df.to_json(orient="records", date_format="iso"))
+    else:
+        print(df.to_string(index=False))
+
+
+def main(argv: list[str] | None = None) -> None:
+    from instrumentation import configure_logging
+
+    parser = argparse.ArgumentParser(description="Query the dataset catalog of an ingested store.")
+    parser.add_argument("command", choices=("summary", "coverage", "gaps", "granules", "schema", "backfill"))
+    parser.add_argument("--folder", default="./oco2_ingested")
+    parser.add_argument("--clean", action="store_true", help="Catalog of the cleaned store")
+    parser.add_argument("--start", default=None, help="First expected date for 'gaps'")
+    parser.add_argument("--end", default=None, help="Last expected date for 'gaps'")
+    parser.add_argument("--data-folder", default=None, help="Raw granules, for 'backfill' checksums")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    name = CLEAN_MANIFEST_NAME if args.clean else MANIFEST_NAME
+    if args.command == "backfill":
+        backfill_catalog(args.folder, name, args.data_folder)
+        return
+    catalog = DatasetCatalog.load(args.folder, name)
+    if args.command == "summary":
+        print(json.dumps(catalog.summary(), indent=None if args.json else 2))
+    elif args.command == "schema":
+        print(json.dumps(catalog.schema(), indent=None if args.json else 2))
+    elif args.command == "coverage":
+        _print_table(catalog.coverage(), args.json)
+    elif args.command == "gaps":
+        _print_table(catalog.gaps(args.start, args.end), args.json)
+    else:
+        _print_table(catalog.granules, args.json)
+
+
+if __name__ == "__main__":
+    main()
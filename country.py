@@ -1,72 +1,296 @@
 # country.py
+import logging
+import hashlib
+import importlib.util
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Point
 
-def aggregate_country_daily(input_file: str,
-                            shapefile_path: str,
-                            output_file: str = "./oco2_ingested/country_daily_co2.csv") -> pd.DataFrame:
+from storage import write_table, update_by_date
+from instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+SHAPEFILE_SIDECARS = (".shp", ".shx", ".dbf", ".prj")
+
+
+def _shapefile_hash(shapefile_path: str) -> str:
     """
-    Assign each CO₂ measurement to a country and compute daily country-level averages.
+    SHA-256 over the shapefile and its sidecar files (geometry, index, attributes, CRS).
+    """
+    digest = hashlib.sha256()
+    base = Path(shapefile_path)
+    for suffix in SHAPEFILE_SIDECARS:
+        part = base.with_suffix(suffix)
+        if part.exists():
+            digest.update(suffix.encode())
+            digest.update(part.read_bytes())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=4)
+def _read_world(shapefile_path: str):
+    """
+    Read country polygons once per process; chunked callers assign many batches.
+    """
+    import geopandas as gpd
+
+    return gpd.read_file(shapefile_path)
+
+
+@lru_cache(maxsize=4)
+def build_country_grid(shapefile_path: str,
+                       resolution: float = 0.05,
+                       cache_dir: str = "./oco2_ingested/country_grid_cache",
+                       name_column: str = "NAME") -> tuple[np.ndarray, np.ndarray, list[str]]:
+    """
+    Rasterise country polygons into a global integer country-ID grid.
+
+    The grid is cached as a .npz file keyed by the shapefile's hash, the resolution and
+    the name column, so the rasterisation only runs once per shapefile and labelling.
 
     Parameters
     ----------
-    input_file : str
-        Path to cleaned CO₂ data CSV (must include 'longitude', 'latitude', 'xco2', 'date').
     shapefile_path : str
         Path to Natural Earth shapefile with country polygons.
-    output_file : str, optional
-        Path to save country-level aggregated data (default: './oco2_ingested/country_daily_co2.csv').
+    resolution : float, optional
+        Grid cell size in degrees (default: 0.05).
+    cache_dir : str, optional
+        Directory for cached grids.
+    name_column : str, optional
+        Attribute column holding the country name (default: 'NAME').
 
     Returns
     -------
-    pd.DataFrame
-        DataFrame containing daily average xco2 by country.
+    (np.ndarray, np.ndarray, list[str])
+        - ids: int16 grid (row 0 = 90°N, column 0 = 180°W) of indices into names, -1 outside all countries
+        - border: boolean grid marking cells crossed by a country boundary
+        - names: country names
+    """
+    cache_path = (Path(cache_dir)
+                  / f"{_shapefile_hash(shapefile_path)[:16]}_{resolution:g}_{name_column}.npz")
+    if cache_path.exists():
+        count("cache_hits")
+        cached = np.load(cache_path, allow_pickle=False)
+        return cached['ids'], cached['border'], cached['names'].tolist()
+
+    count("cache_misses")
+    from rasterio import features
+    from rasterio.transform import from_origin
+
+    world = _read_world(shapefile_path)[['geometry', name_column]].reset_index(drop=True)
+    shape = (int(round(180 / resolution)), int(round(360 / resolution)))
+    transform = from_origin(-180, 90, resolution, resolution)
+
+    ids = features.rasterize(
+        ((geom, i) for i, geom in enumerate(world.geometry)),
+        out_shape=shape, transform=transform, fill=-1, dtype='int32'
+    ).astype(np.int16)
+
+    # Any cell touched by a boundary may contain points of more than one country (or sea)
+    border = features.rasterize(
+        ((geom.boundary, 1) for geom in world.geometry),
+        out_shape=shape, transform=transform, fill=0, all_touched=True, dtype='uint8'
+    ).astype(bool)
+
+    names = world[name_column].astype(str).tolist()
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(cache_path, ids=ids, border=border, names=np.array(names))
+    logger.info(f"✅ Country grid ({shape[0]}x{shape[1]}) cached to {cache_path}")
+    return ids, border, names
+
+
+def assign_countries_grid(df: pd.DataFrame,
+                          shapefile_path: str,
+                          resolution: float = 0.05,
+                          cache_dir: str = "./oco2_ingested/country_grid_cache",
+                          name_column: str = "NAME") -> pd.Series:
+    """
+    Assign each sounding to a country using the cached raster grid.
+
+    Points in interior cells are resolved by array indexing; only points in cells
+    crossed by a boundary get an exact point-in-polygon test, so the result matches
+    the sjoin path.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Soundings with 'longitude' and 'latitude'.
+    shapefile_path, resolution, cache_dir, name_column
+        See build_country_grid.
+
+    Returns
+    -------
+    pd.Series
+        Categorical country name per row of df (NaN outside all countries).
+    """
+    ids, border, names = build_country_grid(shapefile_path, resolution, cache_dir, name_column)
+
+    # Index in float64 so float32 coordinates do not pick up rounding at cell edges
+    lon = df['longitude'].to_numpy(dtype=np.float64)
+    lat = df['latitude'].to_numpy(dtype=np.float64)
+    rows = np.clip(((90 - lat) / resolution).astype(np.int64), 0, ids.shape[0] - 1)
+    cols = np.clip(((lon + 180) / resolution).astype(np.int64), 0, ids.shape[1] - 1)
+
+    point_ids = ids[rows, cols].astype(np.int32)
+    on_border = border[rows, cols]
+
+    if on_border.any():
+        import geopandas as gpd
+
+        world = _read_world(shapefile_path)[['geometry']].reset_index(drop=True)
+        candidates = gpd.GeoDataFrame(
+            geometry=gpd.points_from_xy(lon[on_border], lat[on_border]),
+            crs="EPSG:4326"
+        )
+        joined = gpd.sjoin(candidates, world, how='left', predicate='within')
+        joined = joined[~joined.index.duplicated(keep='first')]
+        exact = joined['index_right'].reindex(candidates.index).fillna(-1).astype(np.int32)
+        point_ids[on_border] = exact.to_numpy()
+
+    # Categorical straight from the grid ids (-1 is a missing code, i.e. "no country");
+    # duplicate names in the shapefile share one category
+    categories, codes = np.unique(np.array(names, dtype=object), return_inverse=True)
+    codes = np.where(point_ids >= 0, codes[point_ids], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories),
+                     index=df.index, name='country')
+
+
+@lru_cache(maxsize=1)
+def _grid_available() -> bool:
+    """
+    Whether rasterio (needed to rasterise the country grid) can be imported; warns once.
+    """
+    if importlib.util.find_spec("rasterio") is not None:
+        return True
+    logger.warning("⚠️ rasterio is not installed; assigning countries with method='sjoin' instead of 'grid'")
+    return False
+
+
+def assign_countries(df: pd.DataFrame,
+                     shapefile_path: str,
+                     method: str = "grid",
+                     grid_resolution: float = 0.05,
+                     grid_cache_dir: str = "./oco2_ingested/country_grid_cache") -> pd.Series:
+    """
+    Assign each sounding to a country.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Soundings with 'longitude' and 'latitude'.
+    shapefile_path : str
+        Path to Natural Earth shapefile with country polygons.
+    method : str, optional
+        'grid' (default) looks points up in the cached raster grid and runs exact
+        point-in-polygon tests only near borders; 'sjoin' runs a full spatial join.
+        Both give the same countries; 'grid' is much faster once the grid is cached but
+        needs rasterio, and falls back to 'sjoin' when it is not installed.
+    grid_resolution, grid_cache_dir
+        Grid settings used when method='grid'.
+
+    Returns
+    -------
+    pd.Series
+        Country name per row of df (NaN outside all countries).
     """
+    if method == "grid" and _grid_available():
+        return assign_countries_grid(df, shapefile_path, grid_resolution, grid_cache_dir)
+    if method not in ("sjoin", "grid"):
+        raise ValueError(f"Unknown country assignment method: {method}")
 
-    # Load cleaned CO2 data
-    df = pd.read_csv(input_file)
-    df['date'] = pd.to_datetime(df['date'])
+    import geopandas as gpd
+    from shapely.geometry import Point
 
     # Create GeoDataFrame from lat/lon
     geometry = [Point(xy) for xy in zip(df['longitude'], df['latitude'])]
-    gdf = gpd.GeoDataFrame(df, geometry=geometry, crs="EPSG:4326")
-
-    # Load world country polygons
-    world = gpd.read_file(shapefile_path)
+    gdf = gpd.GeoDataFrame(df[[]], geometry=geometry, crs="EPSG:4326")
 
     # Spatial join: assign points to countries
-    gdf_with_country = gpd.sjoin(
+    joined = gpd.sjoin(
         gdf,
-        world[['geometry', 'NAME']],
+        _read_world(shapefile_path)[['geometry', 'NAME']],
         how='left',
         predicate='within'
     )
+    # Points inside overlapping polygons are kept once
+    joined = joined[~joined.index.duplicated(keep='first')]
+    return joined['NAME'].rename('country')
 
-    # Rename and aggregate
-    gdf_with_country.rename(columns={'NAME': 'country'}, inplace=True)
-    country_daily = (
-        gdf_with_country
-        .groupby(['country', 'date'])['xco2']
-        .mean()
-        .reset_index()
-    )
 
-    # Drop measurements not inside any country (e.g., ocean)
-    country_daily = country_daily.dropna(subset=['country'])
+def aggregate_country_daily(input_file: str,
+                            shapefile_path: str,
+                            output_file: str = "./oco2_ingested/country_daily_co2.parquet",
+                            dates: list[str] | None = None,
+                            method: str = "grid",
+                            grid_resolution: float = 0.05,
+                            grid_cache_dir: str | None = None) -> pd.DataFrame:
+    """
+    Assign each CO₂ measurement to a country and compute daily country-level averages.
+
+    Parameters
+    ----------
+    input_file : str
+        Path to cleaned CO₂ data, Parquet store or CSV (must include 'longitude', 'latitude', 'xco2', 'date').
+    shapefile_path : str
+        Path to Natural Earth shapefile with country polygons.
+    output_file : str, optional
+        Path to save country-level aggregated data (default: './oco2_ingested/country_daily_co2.parquet').
+        A '.csv' path exports CSV instead.
+    dates : list[str] | None, optional
+        If given (e.g. the touched dates of an incremental ingest), only these dates are
+        read from the partitioned input and recomputed; their rows are replaced in the
+        existing output and all other dates are kept.
+    method : str, optional
+        'grid' (default) or 'sjoin', see assign_countries.
+    grid_resolution : float, optional
+        Cell size in degrees of the country grid (default: 0.05).
+    grid_cache_dir : str | None, optional
+        Cache directory for the country grid (default: 'country_grid_cache' next to output_file).
+
+    Returns
+    -------
+    pd.DataFrame
+        Daily 'xco2' mean, 'xco2_std' and 'count' by country.
+
+    Notes
+    -----
+    A thin wrapper over aggregation.scan_partials/PartialAggregates.finalize; the
+    pipeline uses aggregation.aggregate_all, which produces this table together with the
+    global and latitude-band tables in one scan.
+    """
+    from aggregation import scan_partials, empty_stats
+
+    # CSV input cannot be read by date; merging would duplicate the untouched dates
+    if dates is not None and not Path(input_file).is_dir():
+        raise ValueError("Date-restricted aggregation requires a partitioned Parquet input.")
+
+    # Assign points to countries and aggregate, one date partition at a time;
+    # measurements not inside any country (e.g. ocean) have no group
+    cache_dir = grid_cache_dir or str(Path(output_file).parent / "country_grid_cache")
+    partials = scan_partials(input_file, dates, shapefile_path, method, grid_resolution, cache_dir)
+    country_daily = partials.finalize().get('country', empty_stats('country'))
+
+    # Incremental update: replace only the recomputed dates in the existing output
+    if dates is not None:
+        country_daily = update_by_date(output_file, country_daily, dates, ['country', 'date'])
 
     # Save
-    country_daily.to_csv(output_file, index=False)
-    print(f"✅ Country-level daily CO₂ aggregation saved to {output_file}")
+    write_table(country_daily, output_file)
+    logger.info(f"✅ Country-level daily CO₂ aggregation saved to {output_file}")
 
     return country_daily
 
 
 # Example usage
 if __name__ == "__main__":
+    from instrumentation import configure_logging
+    configure_logging()
     shapefile = r"C:/code_1/earth_one/data/naturalearth/ne_110m_admin_0_countries.shp"
     result = aggregate_country_daily(
-        input_file="./oco2_ingested/cleaned_oco2_data.csv",
+        input_file="./oco2_ingested/cleaned_oco2_data.parquet",
         shapefile_path=shapefile
     )
     print(result.head())
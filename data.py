@@ -1,7 +1,17 @@
 # oco2_downloader.py
+import logging
+import os
+import json
+import hashlib
+import threading
 import earthaccess
 from pathlib import Path
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = ".download_index.json"
 
 def login_to_earthdata():
     """
@@ -28,7 +38,7 @@ def fetch_oco2_data(
 
     for year in years:
         day = f"{year}-07-01"
-        print(f"🔎 Checking OCO-2 data for {day}")
+        logger.info(f"🔎 Checking OCO-2 data for {day}")
 
         results = earthaccess.search_data(
             short_name=short_name,
@@ -37,7 +47,7 @@ def fetch_oco2_data(
         )
 
         if not results:
-            print(f"⚠️ No data found for {day}")
+            logger.warning(f"⚠️ No data found for {day}")
             continue
 
         # Check if all files already exist
@@ -49,10 +59,219 @@ def fetch_oco2_data(
                 break
 
         if all_exist:
-            print(f"✅ Files for {day} already downloaded, skipping.")
+            logger.info(f"✅ Files for {day} already downloaded, skipping.")
             continue
 
-        print(f"⬇️ Downloading new files for {day}")
+        logger.info(f"⬇️ Downloading new files for {day}")
         earthaccess.download(results, output_dir)
 
-    print(f"🎉 Download complete. Files saved in: {output_dir}")
+    logger.info(f"🎉 Download complete. Files saved in: {output_dir}")
+
+
+class HTTPTransport:
+    """
+    Streams granule URLs to disk over a requests-compatible session.
+
+    The default session is earthaccess's authenticated HTTPS session; any object with a
+    requests-style get(url, headers=..., stream=True, timeout=...) works, e.g. a plain
+    requests.Session pointed at a local stand-in server.
+    """
+
+    def __init__(self, session=None, chunk_size: int = 1 << 20, timeout: int = 60):
+        self.session = session or earthaccess.get_requests_https_session()
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def download(self, url: str, dest: Path, offset: int = 0) -> None:
+        """
+        Write url to dest, resuming at offset bytes when the server honours Range.
+        """
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            if offset and r.status_code == 416:
+                # Nothing left after offset: the partial file is complete, leave it to _verify
+                return
+            r.raise_for_status()
+            # 200 means the server ignored the Range header and sent the whole file
+            mode = "ab" if offset and r.status_code == 206 else "wb"
+            with open(dest, mode) as fh:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    fh.write(chunk)
+
+
+def _granule_info(result) -> dict:
+    """
+    Extract download URL, file name, size and checksum from an earthaccess search result.
+    """
+    url = result.data_links()[0]
+    name = Path(url).name
+    info = {"url": url, "name": name, "size": None, "checksum": None, "algorithm": None}
+    archive = result["umm"].get("DataGranule", {}).get("ArchiveAndDistributionInformation", [])
+    for entry in archive:
+        if entry.get("Name", name) == name:
+            info["size"] = entry.get("SizeInBytes")
+            checksum = entry.get("Checksum") or {}
+            info["checksum"] = checksum.get("Value")
+            info["algorithm"] = checksum.get("Algorithm")
+            break
+    return info
+
+
+def _file_checksum(path: Path, algorithm: str) -> str:
+    digest = hashlib.new(algorithm.replace("-", "").lower())
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _verify(path: Path, info: dict) -> str | None:
+    """
+    Check a downloaded file against the search metadata. Returns an error message or None.
+    """
+    size = path.stat().st_size
+    if info["size"] is not None and size != int(info["size"]):
+        return f"size {size} != expected {info['size']}"
+    if info["checksum"] and info["algorithm"]:
+        actual = _file_checksum(path, info["algorithm"])
+        if actual.lower() != info["checksum"].lower():
+            return f"{info['algorithm']} checksum mismatch"
+    return None
+
+
+def load_download_index(output_dir: str) -> dict:
+    """
+    Load the local index of verified downloads ({file name: {size, checksum}}).
+    """
+    path = Path(output_dir) / INDEX_NAME
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _save_download_index(output_dir: str, index: dict) -> None:
+    path = Path(output_dir) / INDEX_NAME
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(index, fh, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def download_granules(
+    granules: List[dict],
+    output_dir: str,
+    transport=None,
+    concurrency: int = 4,
+    retries: int = 3
+) -> dict:
+    """
+    Download granules with bounded concurrency, resuming partial files.
+
+    Files are streamed to '<name>.part', verified against the expected size/checksum and
+    then renamed. Verified files are recorded in a local index, which is used to skip
+    granules that are already on disk; a granule listed in the index is downloaded again
+    if its file was deleted or no longer has the recorded size.
+
+    Args:
+        granules (List[dict]): Granule descriptions with url, name, size, checksum, algorithm.
+        output_dir (str): Directory to save downloaded files.
+        transport: Object with download(url, dest, offset); defaults to HTTPTransport().
+        concurrency (int): Maximum number of simultaneous downloads.
+        retries (int): Attempts per granule before giving up.
+
+    Returns:
+        dict: Counts of 'downloaded', 'skipped' and 'failed' granules.
+    """
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    transport = transport or HTTPTransport()
+    index = load_download_index(output_dir)
+    lock = threading.Lock()
+    counts = {"downloaded": 0, "skipped": 0, "failed": 0}
+
+    pending = []
+    for info in granules:
+        known = index.get(info["name"])
+        local = output_path / info["name"]
+        if (known and (info["size"] is None or known.get("size") == info["size"])
+                and local.is_file() and local.stat().st_size == known.get("size")):
+            counts["skipped"] += 1
+        else:
+            pending.append(info)
+    logger.info(f"🔎 {len(granules)} granules: {counts['skipped']} already downloaded, "
+                f"{len(pending)} to fetch")
+
+    def fetch(info):
+        final = output_path / info["name"]
+        part = output_path / (info["name"] + ".part")
+        error = None
+        for _ in range(retries):
+            offset = part.stat().st_size if part.exists() else 0
+            try:
+                if info["size"] is None or offset < int(info["size"]):
+                    transport.download(info["url"], part, offset)
+            except Exception as e:
+                error = str(e)
+                continue
+            error = _verify(part, info)
+            if error is None:
+                os.replace(part, final)
+                break
+            # A corrupt partial file cannot be resumed; start again from scratch
+            part.unlink(missing_ok=True)
+
+        with lock:
+            if error is None:
+                index[info["name"]] = {"size": final.stat().st_size, "checksum": info["checksum"]}
+                _save_download_index(output_dir, index)
+                counts["downloaded"] += 1
+                logger.info(f"⬇️ Downloaded {info['name']}")
+            else:
+                counts["failed"] += 1
+                logger.error(f"❌ Failed to download {info['name']}: {error}")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(fetch, pending))
+
+    return counts
+
+
+def fetch_oco2_range(
+    start_date: str,
+    end_date: str,
+    output_dir: str = "./oco2_downloads",
+    short_name: str = "OCO2_L2_Lite_FP",
+    concurrency: int = 4,
+    transport=None
+) -> dict:
+    """
+    Download all OCO-2 Lite granules in a date range with one search request.
+
+    Args:
+        start_date (str): First day, 'YYYY-MM-DD'.
+        end_date (str): Last day (inclusive), 'YYYY-MM-DD'.
+        output_dir (str): Directory to save downloaded files.
+        short_name (str): Dataset short name (default: OCO2_L2_Lite_FP).
+        concurrency (int): Maximum number of simultaneous downloads.
+        transport: Download transport (see HTTPTransport); defaults to an Earthdata session.
+
+    Returns:
+        dict: Counts of 'downloaded', 'skipped' and 'failed' granules.
+    """
+    earthaccess.login()
+    logger.info(f"🔎 Searching OCO-2 data for {start_date} to {end_date}")
+    results = earthaccess.search_data(
+        short_name=short_name,
+        temporal=(start_date, end_date),
+        bounding_box=(-180, -90, 180, 90),
+    )
+    if not results:
+        logger.warning(f"⚠️ No data found for {start_date} to {end_date}")
+        return {"downloaded": 0, "skipped": 0, "failed": 0}
+
+    counts = download_granules([_granule_info(r) for r in results], output_dir,
+                               transport=transport, concurrency=concurrency)
+    logger.info(f"🎉 Download complete. Files saved in: {output_dir} "
+                f"({counts['downloaded']} new, {counts['skipped']} skipped, {counts['failed']} failed)")
+    return counts
@@ -1,20 +1,16 @@
-import pandas as pd
+from catalog import DatasetCatalog, CLEAN_MANIFEST_NAME
 
-# Load the combined CSV
-df = pd.read_csv("./oco2_ingested/combined_oco2_data.csv")
+# Load the catalog of the cleaned store written by the pipeline (manifest only, no soundings are read)
+catalog = DatasetCatalog.load("./oco2_ingested", CLEAN_MANIFEST_NAME)
 
-# Display first few rows with the date column
-print(df[["source_file", "date"]].head())
+# Display first few granules with their date range
+print(catalog.granules[["file", "first_date", "last_date", "rows"]].head())
 
-# Check data types and info
-print(df.info())
+# Check data types of the store
+print(catalog.schema())
 
-# Convert to datetime (if not already)
-df["date"] = pd.to_datetime(df["date"])
-print(df["date"].head())
+# ✅ Get unique dates (sorted)
+print(catalog.dates())
 
-# ✅ Get unique dates
-print(df["date"].unique())
-
-# Or if you want sorted unique values
-print(df["date"].sort_values().unique())
+# Gaps in the daily coverage
+print(catalog.gaps())
@@ -0,0 +1,203 @@
+# gridding.py
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from storage import read_table, list_partitions, clear_table
+from aggregation import ACC_SHIFT
+
+logger = logging.getLogger(__name__)
+
+VARIABLES = ("xco2", "xco2_std", "count")
+
+
+def _grid_axes(resolution: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Cell-centre latitudes (south to north) and longitudes (west to east).
+    """
+    ny, nx = int(round(180 / resolution)), int(round(360 / resolution))
+    lat = -90 + resolution * (np.arange(ny) + 0.5)
+    lon = -180 + resolution * (np.arange(nx) + 0.5)
+    return lat, lon
+
+
+def _period_start(dates: pd.Series, freq: str) -> pd.Series:
+    if freq == "D":
+        return dates.dt.normalize()
+    if freq == "M":
+        return dates.dt.to_period("M").dt.to_timestamp()
+    raise ValueError(f"Unsupported gridding frequency: {freq} (use 'D' or 'M')")
+
+
+class _GridAccumulator:
+    """
+    Running sum / sum of squares / count per grid cell for one time period.
+    """
+
+    def __init__(self, resolution: float):
+        self.resolution = resolution
+        self.lat, self.lon = _grid_axes(resolution)
+        size = len(self.lat) * len(self.lon)
+        self.sum = np.zeros(size)
+        self.sumsq = np.zeros(size)
+        self.count = np.zeros(size, dtype=np.int64)
+
+    def add(self, latitude: np.ndarray, longitude: np.ndarray, xco2: np.ndarray) -> None:
+        ny, nx = len(self.lat), len(self.lon)
+        rows = np.clip(((latitude + 90) / self.resolution).astype(np.int64), 0, ny - 1)
+        cols = np.clip(((longitude + 180) / self.resolution).astype(np.int64), 0, nx - 1)
+        cell = rows * nx + cols
+        x = xco2.astype(np.float64) - ACC_SHIFT
+        size = ny * nx
+        self.sum += np.bincount(cell, weights=x, minlength=size)
+        self.sumsq += np.bincount(cell, weights=x * x, minlength=size)
+        self.count += np.bincount(cell, minlength=size)
+
+    def to_dataset(self, period: pd.Timestamp) -> xr.Dataset:
+        shape = (1, len(self.lat), len(self.lon))
+        n = self.count.astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sum / n
+            var = (self.sumsq - self.sum * mean) / (n - 1)
+        std = np.where(n > 1, np.sqrt(np.clip(var, 0, None)), np.nan)
+        dims = ("time", "lat", "lon")
+        return xr.Dataset(
+            {
+                "xco2": (dims, (mean + ACC_SHIFT).astype(np.float32).reshape(shape),
+                         {"units": "ppm", "long_name": "mean XCO2"}),
+                "xco2_std": (dims, std.astype(np.float32).reshape(shape),
+                             {"units": "ppm", "long_name": "XCO2 sample standard deviation"}),
+                "count": (dims, self.count.astype(np.int32).reshape(shape),
+                          {"long_name": "number of soundings"}),
+            },
+            coords={"time": [period], "lat": self.lat, "lon": self.lon},
+            attrs={"resolution_deg": self.resolution},
+        )
+
+
+def _append_netcdf(path: Path, ds: xr.Dataset, index: int) -> None:
+    """
+    Write a one-period dataset at position index of the unlimited time dimension.
+    """
+    import netCDF4
+
+    with netCDF4.Dataset(path, "a") as nc:
+        time = nc.variables["time"]
+        period = pd.Timestamp(ds["time"].values[0]).to_pydatetime()
+        time[index] = netCDF4.date2num(period, time.units, getattr(time, "calendar", "standard"))
+        for name in VARIABLES:
+            nc.variables[name][index] = ds[name].values[0]
+
+
+def _iter_chunks(input_file: str, columns: list[str]):
+    """
+    Yield sounding chunks: one date partition at a time, or the whole CSV/Parquet file.
+    """
+    if Path(input_file).is_dir():
+        for key in list_partitions(input_file):
+            yield read_table(input_file, columns=columns, partitions=[key])
+    else:
+        yield read_table(input_file, columns=columns)
+
+
+def grid_soundings(
+    input_file: str = "./oco2_ingested/cleaned_oco2_data.parquet",
+    output_path: str = "./oco2_ingested/xco2_l3_daily.zarr",
+    resolution: float = 1.0,
+    freq: str = "D",
+    time_chunk: int = 1
+) -> str:
+    """
+    Bin cleaned soundings into a gridded Level-3 product (mean, std, count per cell).
+
+    Each cell's statistics come from np.bincount over flattened cell indices, not
+    groupbys. The input is streamed one date partition at a time and each finished
+    period is appended to the output, so memory holds a single grid whatever the
+    number of periods.
+
+    Args:
+        input_file (str): Cleaned soundings (Parquet store or CSV) with date, latitude,
+            longitude and xco2.
+        output_path (str): '.zarr' writes a chunked Zarr store; '.nc' writes a chunked
+            NetCDF-4 file with an unlimited time dimension (needs netCDF4). Both are
+            appended period by period.
+        resolution (float): Cell size in degrees (default 1.0).
+        freq (str): 'D' for daily or 'M' for monthly grids.
+        time_chunk (int): Periods per chunk along time. The default of 1 keeps
+            single-period map slices cheap.
+
+    Returns:
+        str: Path to the gridded product.
+    """
+    output_path = Path(output_path)
+    is_zarr = output_path.suffix == ".zarr"
+    clear_table(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    lat, lon = _grid_axes(resolution)
+    chunk_shape = (time_chunk, len(lat), len(lon))
+    key = "chunks" if is_zarr else "chunksizes"
+    encoding = {name: {key: chunk_shape} for name in VARIABLES}
+    if not is_zarr:
+        # Fixed units so later periods can be encoded without xarray
+        encoding["time"] = {"units": "days since 1970-01-01", "calendar": "standard",
+                            "dtype": "float64"}
+
+    written = 0
+
+    def flush(period, acc):
+        nonlocal written
+        ds = acc.to_dataset(period)
+        if written == 0:
+            if is_zarr:
+                ds.to_zarr(output_path, mode="w", encoding=encoding)
+            else:
+                ds.to_netcdf(output_path, encoding=encoding, unlimited_dims=["time"])
+        elif is_zarr:
+            ds.to_zarr(output_path, append_dim="time")
+        else:
+            _append_netcdf(output_path, ds, written)
+        written += 1
+
+    current, acc = None, None
+    for df in _iter_chunks(str(input_file), ["date", "latitude", "longitude", "xco2"]):
+        if df.empty:
+            continue
+        periods = _period_start(df["date"], freq)
+        for period, idx in periods.groupby(periods).groups.items():
+            if period != current:
+                if acc is not None:
+                    flush(current, acc)
+                current, acc = period, _GridAccumulator(resolution)
+            part = df.loc[idx]
+            acc.add(part["latitude"].to_numpy(), part["longitude"].to_numpy(),
+                    part["xco2"].to_numpy())
+    if acc is not None:
+        flush(current, acc)
+
+    if not written:
+        logger.warning("⚠️ No soundings to grid.")
+        return ""
+
+    logger.info(f"✅ Gridded {written} {'daily' if freq == 'D' else 'monthly'} "
+                f"{resolution:g}° maps saved to {output_path}")
+    return str(output_path)
+
+
+def open_grid(path: str = "./oco2_ingested/xco2_l3_daily.zarr") -> xr.Dataset:
+    """
+    Open a gridded product lazily; slices are read from disk only when accessed.
+    """
+    if Path(path).suffix == ".zarr":
+        return xr.open_zarr(path)
+    return xr.open_dataset(path, chunks={})
+
+
+# Example manual run
+if __name__ == "__main__":
+    from instrumentation import configure_logging
+    configure_logging()
+    grid_soundings()
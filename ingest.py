@@ -1,62 +1,372 @@
 # oco2_ingestor.py
+import logging
 import os
+import json
+import shutil
+import hashlib
+import numpy as np
 import xarray as xr
 import pandas as pd
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from storage import write_partitions, partition_dir, is_csv, compact_soundings
+from preprocessing import valid_sounding_mask
+from instrumentation import count, count_files
+from catalog import MANIFEST_NAME, CLEAN_MANIFEST_NAME, granule_stats
+
+logger = logging.getLogger(__name__)
+
+
+def _read_granule(
+    filepath: str,
+    file: str,
+    clean: bool = False,
+    quality_filter: bool = False
+) -> pd.DataFrame:
+    """
+    Decode a single OCO-2 granule into a DataFrame of valid soundings.
+
+    Args:
+        filepath (str): Full path to the .nc4/.h5 file.
+        file (str): File name recorded in the 'source_file' column.
+        clean (bool): If True, apply the preprocessing range filters as NumPy masks on
+            the raw variables before any DataFrame is built.
+        quality_filter (bool): With clean=True, also keep only xco2_quality_flag == 0.
+
+    Returns:
+        pd.DataFrame: Soundings with xco2, latitude, longitude, time, date and source_file,
+            in the compact schema of storage.compact_soundings.
+    """
+    with xr.open_dataset(filepath, decode_times=True) as ds:
+        xco2 = ds["xco2"].values
+        latitude = ds["latitude"].values
+        longitude = ds["longitude"].values
+        time = ds["time"].values
+        if clean:
+            quality_flag = ds["xco2_quality_flag"].values if quality_filter else None
+            mask = valid_sounding_mask(xco2, latitude, longitude, quality_flag) & ~pd.isna(time)
+            xco2, latitude, longitude, time = xco2[mask], latitude[mask], longitude[mask], time[mask]
+
+    df = pd.DataFrame({
+        "xco2": xco2,
+        "latitude": latitude,
+        "longitude": longitude,
+        "time": pd.to_datetime(time),
+    })
+    # Midnight timestamps rather than datetime.date objects: 8 bytes per row, no boxing
+    df["date"] = df["time"].dt.normalize()
+    if not clean:
+        df = df.dropna(subset=["xco2", "latitude", "longitude", "date"])
+    # One dictionary entry for the whole granule instead of a string per row
+    df = df.assign(source_file=pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8),
+                                                         categories=[file]))
+    return compact_soundings(df)
+
+
+def _read_granule_task(task: tuple[str, str, bool, bool]) -> tuple[pd.DataFrame | None, str | None]:
+    """
+    Process-pool wrapper around _read_granule that returns errors instead of raising,
+    so a single bad granule does not abort the whole pool.
+    """
+    try:
+        return _read_granule(*task), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _sha256(filepath: str, chunk_size: int = 1 << 20) -> str:
+    """
+    SHA-256 of a file's contents, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fingerprint(filepath: str, checksum: bool = False) -> dict:
+    """
+    Size and mtime (and optionally SHA-256) used to detect new or changed granules.
+    """
+    st = os.stat(filepath)
+    fingerprint = {"size": st.st_size, "mtime": st.st_mtime_ns}
+    if checksum:
+        fingerprint["sha256"] = _sha256(filepath)
+    return fingerprint
+
+
+def _is_unchanged(entry: dict, fingerprint: dict) -> bool:
+    """
+    Compare a manifest entry with a fresh fingerprint. When a checksum is available
+    it takes precedence over mtime, so touched-but-identical files are not re-decoded.
+    """
+    if entry.get("size") != fingerprint["size"]:
+        return False
+    if "sha256" in fingerprint and "sha256" in entry:
+        return entry["sha256"] == fingerprint["sha256"]
+    return entry.get("mtime") == fingerprint["mtime"]
+
+
+def load_manifest(output_folder: str = "./oco2_ingested", name: str = MANIFEST_NAME) -> dict:
+    """
+    Load the processed-granule manifest written by ingest_data (or ingest_clean_data).
+
+    Args:
+        output_folder (str): Folder holding the store and its manifest.
+        name (str): Manifest file name; CLEAN_MANIFEST_NAME for the fused cleaned store.
+
+    Returns:
+        dict: {"files": {name: {size, mtime, sha256, rows, dates, ...}}, "touched_dates": [...]}
+            where "touched_dates" lists the dates added, changed or retracted by the last run.
+            Entries also hold the granule statistics of catalog.granule_stats.
+    """
+    path = Path(output_folder) / name
+    if not path.exists():
+        return {"files": {}, "touched_dates": []}
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _save_manifest(path: Path, manifest: dict) -> None:
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _remove_granule_parts(store: Path, file: str, dates: list[str]) -> None:
+    """
+    Retract the rows of one granule from the partitioned store.
+    """
+    for date in dates:
+        part_dir = partition_dir(store, date)
+        (part_dir / f"{Path(file).stem}.parquet").unlink(missing_ok=True)
+        if part_dir.is_dir() and not any(part_dir.iterdir()):
+            part_dir.rmdir()
+
+
+def _decode_granules(tasks: list[tuple[str, str, bool, bool]], workers: int = 1):
+    """
+    Decode granules serially or in a process pool, yielding (file, DataFrame) in task
+    order. Failed granules are reported and skipped.
+
+    With a pool, at most two granules per worker are in flight, so decoded frames never
+    pile up faster than the caller writes them out.
+    """
+    if workers > 1:
+        logger.info(f"⚙️ Decoding {len(tasks)} files with {workers} workers")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            todo = iter(tasks)
+            window = deque()
+            for task in todo:
+                window.append((task, pool.submit(_read_granule_task, task)))
+                if len(window) == 2 * workers:
+                    break
+            # Results are taken in submission order, keeping the merge deterministic
+            while window:
+                (filepath, file, *_), future = window.popleft()
+                df_clean, error = future.result()
+                task = next(todo, None)
+                if task is not None:
+                    window.append((task, pool.submit(_read_granule_task, task)))
+                logger.info(f"📂 Processing file: {filepath}")
+                if error is not None:
+                    logger.error(f"❌ Failed to process {file}: {error}")
+                    continue
+                count_files("bytes_read", [filepath])
+                count("rows_in", len(df_clean))
+                yield file, df_clean
+    else:
+        for task in tasks:
+            filepath, file = task[:2]
+            logger.info(f"📂 Processing file: {filepath}")
+            try:
+                df_clean = _read_granule(*task)
+            except Exception as e:
+                logger.error(f"❌ Failed to process {file}: {e}")
+                continue
+            count_files("bytes_read", [filepath])
+            count("rows_in", len(df_clean))
+            yield file, df_clean
+
+
+def _run_ingest(
+    data_folder: str,
+    output_path: Path,
+    manifest_path: Path,
+    workers: int,
+    incremental: bool,
+    checksum: bool,
+    clean: bool = False,
+    quality_filter: bool = False
+) -> str:
+    """
+    Shared streaming core of ingest_data and ingest_clean_data.
+
+    Granules are decoded one at a time (or one per worker) and each result is written
+    out immediately, so peak memory is bounded by a granule rather than the archive.
+    """
+    data_files = [f for f in os.listdir(data_folder) if f.endswith((".nc4", ".h5"))]
+
+    def make_tasks(files):
+        return [(os.path.join(data_folder, file), file, clean, quality_filter) for file in files]
+
+    if is_csv(output_path):
+        if not data_files:
+            logger.warning("⚠️ No data files found to ingest.")
+            return ""
+        output_path.unlink(missing_ok=True)
+        rows = 0
+        for _, df_clean in _decode_granules(make_tasks(data_files), workers):
+            df_clean.to_csv(output_path, mode="a", header=not output_path.exists(), index=False)
+            rows += len(df_clean)
+        if rows:
+            count("rows_out", rows)
+            count_files("bytes_written", [output_path])
+            logger.info(f"🎉 Ingestion complete. Combined data saved to {output_path}")
+            return str(output_path)
+        logger.warning("⚠️ No valid data ingested.")
+        return ""
+
+    # Parquet store: one part file per (date, granule) so granules can be retracted
+    manifest = {"files": {}}
+    if incremental and output_path.is_dir() and manifest_path.exists():
+        manifest = load_manifest(manifest_path.parent, manifest_path.name)
+    if not incremental and output_path.exists():
+        shutil.rmtree(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    fingerprints = {
+        file: _fingerprint(os.path.join(data_folder, file), checksum) for file in data_files
+    }
+    entries = manifest["files"]
+    pending = [f for f in data_files if f not in entries or not _is_unchanged(entries[f], fingerprints[f])]
+    retract = [f for f in entries if f not in fingerprints or f in pending]
+    count("cache_hits", len(data_files) - len(pending))
+    count("cache_misses", len(pending))
+
+    if not data_files and not retract:
+        logger.warning("⚠️ No data files found to ingest.")
+        return ""
+    if incremental:
+        logger.info(f"🔁 Incremental ingest: {len(pending)} new/changed, "
+                    f"{len([f for f in retract if f not in fingerprints])} deleted, "
+                    f"{len(data_files) - len(pending)} unchanged")
+
+    touched = set()
+    for file in retract:
+        dates = entries.pop(file).get("dates", [])
+        _remove_granule_parts(output_path, file, dates)
+        touched.update(dates)
+
+    for file, df_clean in _decode_granules(make_tasks(pending), workers):
+        dates = write_partitions(df_clean, output_path, "date", part_name=Path(file).stem)
+        # The checksum is only computed for new/changed granules, right after decoding
+        sha256 = fingerprints[file].get("sha256") or _sha256(os.path.join(data_folder, file))
+        entries[file] = {**fingerprints[file], "sha256": sha256, "rows": len(df_clean),
+                         "dates": dates, **granule_stats(df_clean)}
+        touched.update(dates)
+
+    manifest["touched_dates"] = sorted(touched)
+    _save_manifest(manifest_path, manifest)
+
+    if not entries:
+        logger.warning("⚠️ No valid data ingested.")
+        return ""
+    logger.info(f"🎉 Ingestion complete. Combined data saved to {output_path} "
+                f"({len(touched)} dates updated)")
+    return str(output_path)
+
 
 def ingest_data(
     data_folder: str,
     output_folder: str = "./oco2_ingested",
-    overwrite: bool = False
+    overwrite: bool = False,
+    workers: int = 1,
+    output_format: str = "parquet",
+    incremental: bool = False,
+    checksum: bool = False
 ) -> str:
     """
-    Ingest OCO-2 NetCDF/HDF files into a single cleaned CSV file.
+    Ingest OCO-2 NetCDF/HDF files into a single combined sounding table.
 
     Args:
         data_folder (str): Path to the folder containing downloaded .nc4/.h5 files.
-        output_folder (str): Path to the folder to save processed CSV.
+        output_folder (str): Path to the folder to save the combined table.
         overwrite (bool): If True, reprocess data even if output already exists.
+        workers (int): Number of processes used to decode granules. With more than one
+            worker each granule is decoded in a separate process; results are merged in
+            the same order as the serial path, so the output file is identical.
+        output_format (str): "parquet" (default) writes a Parquet store partitioned by
+            date; "csv" exports a single combined CSV instead (without a manifest, so
+            it has no dataset catalog).
+        incremental (bool): If True, only decode granules that are new or changed since
+            the last run (according to the manifest) and retract rows of granules that
+            were changed or deleted. Requires the Parquet store.
+        checksum (bool): If True, compare SHA-256 checksums instead of mtime to detect
+            changed granules (checksums of ingested granules are always recorded in the
+            manifest, which doubles as the dataset catalog, see catalog.py).
 
     Returns:
-        str: Path to the combined CSV file.
+        str: Path to the combined table.
     """
+    if incremental and output_format == "csv":
+        raise ValueError("Incremental ingestion requires output_format='parquet'.")
+
     Path(output_folder).mkdir(parents=True, exist_ok=True)
-    output_path = Path(output_folder) / "combined_oco2_data.csv"
+    output_path = Path(output_folder) / f"combined_oco2_data.{output_format}"
 
-    if output_path.exists() and not overwrite:
-        print(f"✅ Ingestion skipped. File already exists: {output_path}")
+    if output_path.exists() and not overwrite and not incremental:
+        logger.info(f"✅ Ingestion skipped. File already exists: {output_path}")
         return str(output_path)
 
-    data_files = [f for f in os.listdir(data_folder) if f.endswith((".nc4", ".h5"))]
-    if not data_files:
-        print("⚠️ No data files found to ingest.")
-        return ""
+    return _run_ingest(data_folder, output_path, Path(output_folder) / MANIFEST_NAME,
+                       workers, incremental, checksum)
+
+
+def ingest_clean_data(
+    data_folder: str,
+    output_folder: str = "./oco2_ingested",
+    overwrite: bool = False,
+    workers: int = 1,
+    output_format: str = "parquet",
+    incremental: bool = False,
+    checksum: bool = False,
+    quality_filter: bool = False
+) -> str:
+    """
+    Fused streaming ingest + preprocess stage.
+
+    Applies the preprocessing filters (xco2 350–500 ppm, valid lat/lon and, optionally,
+    xco2_quality_flag == 0) as NumPy masks on the raw granule variables and writes the
+    surviving soundings straight to the cleaned store, one granule at a time. The
+    combined store is never materialised.
+
+    Args:
+        data_folder (str): Path to the folder containing downloaded .nc4/.h5 files.
+        output_folder (str): Path to the folder to save the cleaned table.
+        overwrite (bool): If True, reprocess data even if output already exists.
+        workers (int): Number of processes used to decode granules.
+        output_format (str): "parquet" (default) or "csv".
+        incremental (bool): Only process new/changed granules (see ingest_data).
+        checksum (bool): Use SHA-256 checksums to detect changed granules.
+        quality_filter (bool): If True, keep only soundings with xco2_quality_flag == 0.
+
+    Returns:
+        str: Path to the cleaned table.
+    """
+    if incremental and output_format == "csv":
+        raise ValueError("Incremental ingestion requires output_format='parquet'.")
 
-    all_dfs = []
-    for file in data_files:
-        filepath = os.path.join(data_folder, file)
-        print(f"📂 Processing file: {filepath}")
-        try:
-            ds = xr.open_dataset(filepath, decode_times=True)
-            df = pd.DataFrame({
-                "xco2": ds["xco2"].values,
-                "latitude": ds["latitude"].values,
-                "longitude": ds["longitude"].values,
-                "time": pd.to_datetime(ds["time"].values),
-            })
-            df["date"] = df["time"].dt.date
-            df_clean = df.dropna(subset=["xco2", "latitude", "longitude", "date"])
-            df_clean["source_file"] = file
-            all_dfs.append(df_clean)
-        except Exception as e:
-            print(f"❌ Failed to process {file}: {e}")
-            continue
-
-    if all_dfs:
-        combined_df = pd.concat(all_dfs, ignore_index=True)
-        combined_df.to_csv(output_path, index=False)
-        print(f"🎉 Ingestion complete. Combined data saved to {output_path}")
+    Path(output_folder).mkdir(parents=True, exist_ok=True)
+    output_path = Path(output_folder) / f"cleaned_oco2_data.{output_format}"
+
+    if output_path.exists() and not overwrite and not incremental:
+        logger.info(f"✅ Ingestion skipped. File already exists: {output_path}")
         return str(output_path)
-    else:
-        print("⚠️ No valid data ingested.")
-        return ""
+
+    return _run_ingest(data_folder, output_path, Path(output_folder) / CLEAN_MANIFEST_NAME,
+                       workers, incremental, checksum, clean=True, quality_filter=quality_filter)
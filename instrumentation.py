@@ -0,0 +1,153 @@
+# instrumentation.py
+import os
+import sys
+import time
+import logging
+import resource
+import cProfile
+from pathlib import Path
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+LOG_FORMAT = "%(message)s"
+COUNTERS = ("rows_in", "rows_out", "bytes_read", "bytes_written", "cache_hits", "cache_misses")
+
+# Metrics of the stage running in this process (None outside an instrumented stage,
+# which turns every count() call into a no-op)
+_active: ContextVar["StageMetrics | None"] = ContextVar("active_stage_metrics", default=None)
+
+
+def configure_logging(level: str | int = "INFO") -> None:
+    """
+    Send pipeline log records to stderr.
+
+    Every module logs through logging.getLogger(__name__); raising the level to
+    'WARNING' silences the progress messages, and with them their formatting cost.
+
+    Args:
+        level (str | int): Logging level name or number.
+    """
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    logging.getLogger().setLevel(level)
+
+
+@dataclass
+class StageMetrics:
+    """
+    Resource usage and I/O counters of one stage run.
+    """
+    name: str
+    counters: dict = field(default_factory=lambda: dict.fromkeys(COUNTERS, 0))
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss_mb: float | None = None
+    peak_child_rss_mb: float | None = None
+    profile: str | None = None
+
+    def as_dict(self) -> dict:
+        return {
+            "wall_seconds": round(self.wall_seconds, 4),
+            "cpu_seconds": round(self.cpu_seconds, 4),
+            "peak_rss_mb": self.peak_rss_mb,
+            "peak_child_rss_mb": self.peak_child_rss_mb,
+            **self.counters,
+            "profile": self.profile,
+        }
+
+
+def count(counter: str, value: int = 1) -> None:
+    """
+    Add value to a counter of the active stage (no-op outside an instrumented stage).
+    """
+    metrics = _active.get()
+    if metrics is not None:
+        metrics.counters[counter] = metrics.counters.get(counter, 0) + value
+
+
+def count_files(counter: str, paths) -> None:
+    """
+    Add the on-disk size of paths (files or directories) to a byte counter.
+    """
+    if _active.get() is None:
+        return
+    total = 0
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            total += sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+        elif path.exists():
+            total += path.stat().st_size
+    count(counter, total)
+
+
+def _to_mb(maxrss: int) -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(maxrss / (1 << 20) if sys.platform == "darwin" else maxrss / 1024, 1)
+
+
+def _reset_peak_rss() -> bool:
+    """
+    Reset the kernel's RSS high-water mark so the next reading covers one stage only.
+
+    Only possible on Linux; elsewhere the peak is the process-wide maximum so far.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return _to_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+@contextmanager
+def stage_metrics(name: str, profile_path: str | None = None):
+    """
+    Measure the enclosed block as stage 'name'.
+
+    Records wall time, CPU time and peak RSS, and collects the counters reported with
+    count()/count_files() by the code it calls (storage reads/writes, cache lookups).
+    Worker processes started by the stage are only covered by peak_child_rss_mb, the
+    largest child this process has waited for so far.
+
+    Args:
+        name (str): Stage name.
+        profile_path (str | None): If given, run the block under cProfile and dump the
+            stats there (inspect with 'python -m pstats' or snakeviz).
+
+    Yields:
+        StageMetrics: Filled in when the block exits.
+    """
+    metrics = StageMetrics(name)
+    token = _active.set(metrics)
+    _reset_peak_rss()
+    profiler = cProfile.Profile() if profile_path else None
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    if profiler:
+        profiler.enable()
+    try:
+        yield metrics
+    finally:
+        if profiler:
+            profiler.disable()
+        metrics.wall_seconds = time.perf_counter() - wall_start
+        metrics.cpu_seconds = time.process_time() - cpu_start
+        metrics.peak_rss_mb = _peak_rss_mb()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        metrics.peak_child_rss_mb = _to_mb(children) if children else None
+        if profiler:
+            os.makedirs(os.path.dirname(os.path.abspath(profile_path)), exist_ok=True)
+            profiler.dump_stats(profile_path)
+            metrics.profile = str(profile_path)
+        _active.reset(token)
@@ -1,25 +1,39 @@
 # lstm.py
+import logging
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import LSTM, Dense
-from sklearn.preprocessing import MinMaxScaler
+from numpy.lib.stride_tricks import sliding_window_view
 import os
+import time
+
+from storage import read_table
+
+logger = logging.getLogger(__name__)
+
+
+def sliding_windows(series, n_steps):
+    """Zero-copy (X, y) windows: X[i] = series[i:i+n_steps], y[i] = series[i+n_steps]."""
+    series = np.asarray(series)
+    if len(series) <= n_steps:
+        return (np.empty((0, n_steps) + series.shape[1:], dtype=series.dtype),
+                np.empty((0,) + series.shape[1:], dtype=series.dtype))
+    # sliding_window_view appends the window axis last; move it next to the sample axis
+    X = np.moveaxis(sliding_window_view(series[:-1], n_steps, axis=0), -1, 1)
+    return X, series[n_steps:]
 
 
 def prepare_lstm_data(series, n_steps):
-    X, y = [], []
-    for i in range(len(series) - n_steps):
-        X.append(series[i:i+n_steps])
-        y.append(series[i+n_steps])
-    return np.array(X), np.array(y)
+    return sliding_windows(series, n_steps)
 
 
 def lstm_forecast_country(csv_path, country, n_steps=4, forecast_horizon=4, epochs=50, output_dir="./oco2_ingested"):
+    # Heavy dependencies are only loaded when a forecast actually runs
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import LSTM, Dense
+    from sklearn.preprocessing import MinMaxScaler
+
     # Load and preprocess data
-    df = pd.read_csv(csv_path)
-    df['date'] = pd.to_datetime(df['date'])
+    df = read_table(csv_path, columns=['country', 'date', 'xco2'])
 
     # Validate country
     if country not in df['country'].unique():
@@ -33,7 +47,7 @@ def lstm_forecast_country(csv_path, country, n_steps=4, forecast_horizon=4, epoc
     monthly_co2 = country_df['xco2'].copy()
     monthly_co2.index = country_df.index
 
-    print(f"Number of data points: {len(monthly_co2)}")
+    logger.info(f"Number of data points: {len(monthly_co2)}")
 
     if len(monthly_co2) < 2:
         raise ValueError("Not enough data points for LSTM modeling.")
@@ -45,7 +59,7 @@ def lstm_forecast_country(csv_path, country, n_steps=4, forecast_horizon=4, epoc
     # Adjust n_steps
     adjusted_n_steps = min(n_steps, len(data_scaled) - 1)
     if adjusted_n_steps < n_steps:
-        print(f"⚠️ Reducing n_steps from {n_steps} to {adjusted_n_steps} due to limited data.")
+        logger.warning(f"⚠️ Reducing n_steps from {n_steps} to {adjusted_n_steps} due to limited data.")
 
     # Prepare sequences
     X, y = prepare_lstm_data(data_scaled, adjusted_n_steps)
@@ -68,32 +82,248 @@ def lstm_forecast_country(csv_path, country, n_steps=4, forecast_horizon=4, epoc
         raise ValueError("Training loss became NaN. Check input data.")
 
     # Forecast
-    input_seq = data_scaled[-adjusted_n_steps:].reshape(adjusted_n_steps, 1)
-    predictions = []
-    for _ in range(forecast_horizon):
-        pred = model.predict(input_seq.reshape(1, adjusted_n_steps, 1), verbose=0)
-        predictions.append(pred[0, 0])
-        input_seq = np.vstack([input_seq[1:], [[pred[0, 0]]]])
+    input_seq = data_scaled[-adjusted_n_steps:].reshape(1, adjusted_n_steps, 1)
+    predictions = recursive_forecast(model, input_seq, forecast_horizon)[0]
 
     # Inverse scale
-    predictions = scaler.inverse_transform(np.array(predictions).reshape(-1, 1))
+    predictions = scaler.inverse_transform(predictions.reshape(-1, 1))
 
-    # Plot
-    plt.figure(figsize=(12, 6))
-    plt.plot(monthly_co2.index, monthly_co2.values, label='Observed')
+    # Plot and save
+    from render import plot_forecast
     forecast_index = pd.date_range(monthly_co2.index[-1], periods=forecast_horizon+1, freq='180D')[1:]
-    plt.plot(forecast_index, predictions, label='LSTM Forecast', color='red')
-    plt.title(f'LSTM Forecast of CO₂ for {country}')
-    plt.xlabel('Date')
-    plt.ylabel('CO₂ (ppm)')
-    plt.legend()
-    plt.grid(True)
-
-    # Save
-    os.makedirs(output_dir, exist_ok=True)
+    forecast = pd.DataFrame({'date': forecast_index, 'forecast': predictions.ravel()})
     save_path = os.path.join(output_dir, f"{country.lower()}_lstm_forecast.png")
-    plt.savefig(save_path)
-    plt.close()
+    plot_forecast(monthly_co2, forecast, country, save_path, model='LSTM')
 
-    print(f"✅ LSTM forecast saved to {save_path}")
+    logger.info(f"✅ LSTM forecast saved to {save_path}")
     return predictions, save_path
+
+
+def _get_rollout(model, horizon, with_ids, training):
+    # One compiled graph per (horizon, inputs, dropout mode), reused across calls. The
+    # graphs live on the model itself, so they are freed with it; object.__setattr__
+    # keeps Keras from tracking the cache as model state.
+    import tensorflow as tf
+
+    _rollouts = model.__dict__.get('_recursive_rollouts')
+    if _rollouts is None:
+        _rollouts = {}
+        object.__setattr__(model, '_recursive_rollouts', _rollouts)
+    key = (horizon, with_ids, training)
+    if key not in _rollouts:
+        @tf.function(reduce_retracing=True)
+        def rollout(window, ids):
+            outputs = tf.TensorArray(tf.float32, size=horizon)
+            for step in tf.range(horizon):
+                pred = model([window, ids] if with_ids else window, training=training)
+                outputs = outputs.write(step, pred[:, 0])
+                window = tf.concat([window[:, 1:, :], pred[:, tf.newaxis, :]], axis=1)
+            return tf.transpose(outputs.stack())
+        _rollouts[key] = rollout
+    return _rollouts[key]
+
+
+def recursive_forecast(model, windows, horizon, country_ids=None, mc_samples=0):
+    """
+    Roll a one-step model forward `horizon` steps for many series in one compiled call.
+
+    windows has shape (N, n_steps, 1) (scaled inputs); country_ids (N,) is passed as a
+    second input for models with a country embedding. With mc_samples > 0 the model is
+    run with dropout active (Monte Carlo dropout) on mc_samples copies of every series,
+    still in a single call.
+
+    Returns an array of shape (N, horizon), or (mc_samples, N, horizon) with MC dropout.
+    """
+    import tensorflow as tf
+
+    windows = np.asarray(windows, dtype='float32')
+    n = len(windows)
+    ids = np.zeros(n, dtype='int32') if country_ids is None else np.asarray(country_ids, dtype='int32')
+    samples = max(mc_samples, 1)
+    if samples > 1:
+        windows = np.tile(windows, (samples, 1, 1))
+        ids = np.tile(ids, samples)
+
+    rollout = _get_rollout(model, horizon, country_ids is not None, mc_samples > 0)
+    preds = rollout(tf.constant(windows), tf.constant(ids[:, None])).numpy()
+    return preds.reshape(samples, n, horizon) if mc_samples > 0 else preds
+
+
+def _predict_loop(model, windows, horizon, country_ids=None):
+    # Reference implementation: one predict call per series and horizon step
+    preds = np.empty((len(windows), horizon), dtype='float32')
+    for i, window in enumerate(np.asarray(windows, dtype='float32')):
+        input_seq = window
+        for step in range(horizon):
+            x = input_seq[np.newaxis]
+            pred = model.predict([x, np.array([[country_ids[i]]])] if country_ids is not None else x,
+                                 verbose=0)
+            preds[i, step] = pred[0, 0]
+            input_seq = np.vstack([input_seq[1:], [[pred[0, 0]]]])
+    return preds
+
+
+def benchmark_recursive_inference(model, windows, horizon, country_ids=None, repeats=3):
+    """
+    Time the per-step predict loop against recursive_forecast on the same inputs.
+
+    Returns a dict with the best wall time of each path (seconds), the speedup and the
+    maximum absolute difference between their forecasts.
+    """
+    recursive_forecast(model, windows, horizon, country_ids)  # trace/compile once
+
+    def best_of(fn):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    loop_time, loop_preds = best_of(lambda: _predict_loop(model, windows, horizon, country_ids))
+    graph_time, graph_preds = best_of(lambda: recursive_forecast(model, windows, horizon, country_ids))
+    report = {
+        'series': len(windows),
+        'horizon': horizon,
+        'loop_seconds': loop_time,
+        'graph_seconds': graph_time,
+        'speedup': loop_time / graph_time if graph_time else float('inf'),
+        'max_abs_diff': float(np.max(np.abs(loop_preds - graph_preds))),
+    }
+    logger.info(f"⏱️ {report['series']} series x {horizon} steps: loop {loop_time:.3f}s, "
+                f"compiled {graph_time:.3f}s ({report['speedup']:.1f}x)")
+    return report
+
+
+def _scale_by_country(df):
+    # Per-country min-max scaling in one vectorised pass (constant series map to 0)
+    grouped = df.groupby('country')['xco2']
+    scalers = pd.DataFrame({'min': grouped.min(), 'max': grouped.max()})
+    scalers['span'] = (scalers['max'] - scalers['min']).replace(0, 1.0)
+    xmin = df['country'].map(scalers['min'])
+    span = df['country'].map(scalers['span'])
+    return ((df['xco2'] - xmin) / span).to_numpy(dtype='float32'), scalers
+
+
+def build_global_lstm(n_steps, n_countries=0, embedding_dim=4, dropout=0.0):
+    """Shared LSTM over all countries, optionally conditioned on a learned country embedding."""
+    from tensorflow.keras.models import Model
+    from tensorflow.keras.layers import LSTM, Dense, Dropout, Input, Embedding, Flatten, Concatenate
+
+    seq_in = Input(shape=(n_steps, 1), name='sequence')
+    features = LSTM(50, activation='relu')(seq_in)
+    if dropout:
+        features = Dropout(dropout)(features)
+    inputs = [seq_in]
+    if n_countries:
+        id_in = Input(shape=(1,), name='country_id')
+        embedded = Flatten()(Embedding(n_countries, embedding_dim)(id_in))
+        features = Concatenate()([features, embedded])
+        inputs.append(id_in)
+    model = Model(inputs=inputs, outputs=Dense(1)(features))
+    model.compile(optimizer='adam', loss='mse')
+    return model
+
+
+def fit_forecast_global(df, n_steps=4, forecast_horizon=4, epochs=50, use_embedding=True,
+                        embedding_dim=4, batch_size=256, dropout=0.0, mc_samples=0,
+                        interval=(5, 95), verbose=1):
+    """
+    Train one LSTM on the stacked windows of all countries in df and forecast each of them.
+
+    df holds 'country' and 'xco2' sorted by country and date. Each country is min-max
+    scaled separately; windows are strided views of the scaled series, stacked once for
+    training. The full horizon for all countries is produced by one recursive_forecast
+    call. With dropout > 0 and mc_samples > 0, the `interval` percentiles of Monte Carlo
+    dropout samples give lower/upper bounds.
+
+    Returns (names, preds, lower, upper, model): preds/lower/upper have shape
+    (len(names), forecast_horizon), lower/upper are None without MC dropout.
+    """
+    scaled, scalers = _scale_by_country(df)
+    sizes = df.groupby('country', sort=True).size()
+    too_short = sizes[sizes <= n_steps].index.tolist()
+    if too_short:
+        logger.warning(f"⚠️ Skipping {len(too_short)} countries with {n_steps} or fewer data points.")
+    names = sizes[sizes > n_steps].index.tolist()
+    if not names:
+        raise ValueError("Not enough data points for LSTM modeling in any country.")
+
+    # Country rows are contiguous after sorting, so each series is a slice of `scaled`
+    offsets = dict(zip(sizes.index, np.concatenate([[0], np.cumsum(sizes.to_numpy())[:-1]])))
+    Xs, ys, ids, last_windows = [], [], [], []
+    for cid, name in enumerate(names):
+        series = scaled[offsets[name]:offsets[name] + sizes[name]]
+        X, y = sliding_windows(series, n_steps)
+        Xs.append(X)
+        ys.append(y)
+        ids.append(np.full(len(y), cid, dtype='int32'))
+        last_windows.append(series[-n_steps:])
+
+    X = np.concatenate(Xs)[..., np.newaxis]
+    y = np.concatenate(ys)
+    country_ids = np.concatenate(ids)
+    logger.info(f"Training global LSTM on {len(y)} windows from {len(names)} countries")
+
+    model = build_global_lstm(n_steps, len(names) if use_embedding else 0, embedding_dim, dropout)
+    inputs = [X, country_ids] if use_embedding else X
+    history = model.fit(inputs, y, epochs=epochs, batch_size=batch_size, verbose=verbose)
+    if np.isnan(history.history['loss']).any():
+        raise ValueError("Training loss became NaN. Check input data.")
+
+    # Forecast all countries and the whole horizon in one call
+    window = np.stack(last_windows)[..., np.newaxis]
+    all_ids = np.arange(len(names), dtype='int32') if use_embedding else None
+    preds = recursive_forecast(model, window, forecast_horizon, all_ids)
+    if mc_samples > 0:
+        samples = recursive_forecast(model, window, forecast_horizon, all_ids, mc_samples)
+
+    # Inverse scale
+    scale = scalers.loc[names]
+    span = scale['span'].to_numpy()[:, None]
+    xmin = scale['min'].to_numpy()[:, None]
+    preds = preds * span + xmin
+    lower = upper = None
+    if mc_samples > 0:
+        samples = samples * span + xmin
+        lower, upper = np.percentile(samples, list(interval), axis=0)
+    return names, preds, lower, upper, model
+
+
+def lstm_forecast_all(csv_path, countries=None, n_steps=4, forecast_horizon=4, epochs=50,
+                      use_embedding=True, embedding_dim=4, batch_size=256,
+                      dropout=0.0, mc_samples=0, plot_dir=None):
+    """
+    Train one LSTM on the stacked windows of all countries and forecast every country
+    (see fit_forecast_global). With dropout > 0 and mc_samples > 0, Monte Carlo dropout
+    samples give 'lower'/'upper' (5th/95th percentile) columns. With plot_dir, one figure
+    per country is rendered there in parallel.
+
+    Returns a tidy DataFrame with 'country', 'step', 'date' and 'forecast', plus the model.
+    """
+    df = read_table(csv_path, columns=['country', 'date', 'xco2'])
+    if countries is not None:
+        df = df[df['country'].isin(countries)]
+    df = df.sort_values(['country', 'date'], ignore_index=True)
+
+    names, preds, lower, upper, model = fit_forecast_global(
+        df, n_steps, forecast_horizon, epochs, use_embedding, embedding_dim, batch_size,
+        dropout, mc_samples)
+
+    last_dates = df.groupby('country')['date'].max().loc[names]
+    rows = []
+    for i, name in enumerate(names):
+        forecast_index = pd.date_range(last_dates[name], periods=forecast_horizon+1, freq='180D')[1:]
+        frame = pd.DataFrame({'country': name, 'step': np.arange(1, forecast_horizon + 1),
+                              'date': forecast_index, 'forecast': preds[i]})
+        if lower is not None:
+            frame['lower'] = lower[i]
+            frame['upper'] = upper[i]
+        rows.append(frame)
+    result = pd.concat(rows, ignore_index=True)
+
+    if plot_dir is not None:
+        from render import render_forecasts
+        observed = {name: group.set_index('date')['xco2'] for name, group in df.groupby('country')}
+        render_forecasts(observed, result, plot_dir, model='LSTM')
+    return result, model
@@ -1,54 +1,450 @@
 # pipeline.py
+import logging
 import os
-from data import fetch_oco2_data
-from ingest import ingest_data
-from preprocessing import preprocess_oco2_data
-from aggregation import aggregate_global_lat_bands
-from country import aggregate_country_daily
-from arima import arima_forecast_country
-from lstm import lstm_forecast_country
+import json
+import hashlib
+import argparse
+import importlib
+from datetime import datetime, timezone
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from instrumentation import configure_logging, stage_metrics
+
+logger = logging.getLogger(__name__)
 
 # === CONFIG ===
 data_folder = "./oco2_downloads"
 ingested_folder = "./oco2_ingested"
-combined_csv = os.path.join(ingested_folder, "combined_oco2_data.csv")
-country_csv = os.path.join(ingested_folder, "country_daily_co2.csv")
+cleaned_csv = os.path.join(ingested_folder, "cleaned_oco2_data.parquet")
+global_csv = os.path.join(ingested_folder, "daily_global_mean.parquet")
+latband_csv = os.path.join(ingested_folder, "daily_latband_mean.parquet")
+country_csv = os.path.join(ingested_folder, "country_daily_co2.parquet")
+timeseries_dir = os.path.join(ingested_folder, "timeseries_stats")
+region_csv = os.path.join(ingested_folder, "region_daily_stats.parquet")
+shapefile_path = "./data/naturalearth/ne_110m_admin_0_countries.shp"
 country_name = "India"  # Change as needed
+fetch_start, fetch_end = "2018-01-01", "2024-12-31"  # Inclusive date range to download
+arima_order = "auto"  # 'auto' searches SARIMA orders per country, or an explicit (p, d, q)
+# Extra polygon layers for the regions stage, e.g. {"basin": ("./data/basins.shp", "NAME")};
+# countries are already covered by the aggregate stage. The stage is skipped while empty.
+region_layers = {}
+manifest_file = os.path.join(ingested_folder, "clean_manifest.json")
+state_file = os.path.join(ingested_folder, ".pipeline_state.json")
+report_file = os.path.join(ingested_folder, "run_report.json")
+profile_dir = os.path.join(ingested_folder, "profiles")
+
+
+@dataclass
+class Stage:
+    """
+    One node of the pipeline graph.
+
+    target is a 'module:function' reference imported only when the stage runs, so the
+    heavy dependencies of one stage are never loaded by another. Dependencies are
+    derived from inputs/outputs: a stage depends on every stage producing one of its inputs.
+
+    A stage with touched_manifest reports the dates it changed in that manifest's
+    'touched_dates'. Incremental stages downstream of it take a dates argument: while
+    their parameters are unchanged and their outputs exist, they are run with only the
+    dates changed upstream since they last succeeded.
+    """
+    name: str
+    target: str
+    kwargs: dict
+    inputs: list[str] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)
+    always_run: bool = False
+    incremental: bool = False
+    touched_manifest: str | None = None
+
+
+def build_stages() -> list[Stage]:
+    arima_plot = os.path.join(ingested_folder, f"{country_name.lower()}_arima_forecast.png")
+    lstm_plot = os.path.join(ingested_folder, f"{country_name.lower()}_lstm_forecast.png")
+    regions = [
+        Stage("regions", "regions:aggregate_regions_daily",
+              dict(input_file=cleaned_csv, output_file=region_csv,
+                   layers=[(name, path, column) for name, (path, column) in region_layers.items()]),
+              inputs=[cleaned_csv] + [path for path, _ in region_layers.values()],
+              outputs=[region_csv], incremental=True),
+    ] if region_layers else []
+    return [
+        Stage("fetch", "data:fetch_oco2_range",
+              dict(start_date=fetch_start, end_date=fetch_end, output_dir=data_folder),
+              outputs=[data_folder], always_run=True),
+        # Fused ingest + preprocess: granules are filtered while decoded and streamed into
+        # the cleaned store one at a time; the combined store is never written
+        Stage("ingest", "ingest:ingest_clean_data",
+              dict(data_folder=data_folder, output_folder=ingested_folder, incremental=True),
+              inputs=[data_folder], outputs=[cleaned_csv], touched_manifest=manifest_file),
+        # Global, latitude-band and country statistics from one scan of the cleaned store
+        Stage("aggregate", "aggregation:aggregate_all",
+              dict(input_file=cleaned_csv, shapefile_path=shapefile_path,
+                   output_dir=ingested_folder, country_method="grid", output_global=global_csv,
+                   output_latband=latband_csv, output_country=country_csv),
+              inputs=[cleaned_csv, shapefile_path], outputs=[global_csv, latband_csv, country_csv],
+              incremental=True),
+        *regions,
+        # Extended with the touched dates when only new days arrived; rebuilt otherwise
+        # (first run, past dates re-ingested or aggregates recomputed in full)
+        Stage("timeseries", "timeseries:update_timeseries_stats",
+              dict(global_file=global_csv, latband_file=latband_csv, country_file=country_csv,
+                   output_dir=timeseries_dir, rebuild=True),
+              inputs=[global_csv, latband_csv, country_csv], outputs=[timeseries_dir],
+              incremental=True),
+        Stage("arima", "arima:arima_forecast_country",
+              dict(csv_path=country_csv, country=country_name, forecast_months=12,
+                   save_plot=arima_plot, order=arima_order),
+              inputs=[country_csv], outputs=[arima_plot]),
+        Stage("lstm", "lstm:lstm_forecast_country",
+              dict(csv_path=country_csv, country=country_name, n_steps=4, forecast_horizon=4,
+                   epochs=50, output_dir=ingested_folder),
+              inputs=[country_csv], outputs=[lstm_plot]),
+    ]
+
+
+def _dependencies(stages: list[Stage]) -> dict[str, set[str]]:
+    producers = {out: s.name for s in stages for out in s.outputs}
+    return {
+        s.name: {producers[i] for i in s.inputs if i in producers and producers[i] != s.name}
+        for s in stages
+    }
+
+
+def _descendants(deps: dict[str, set[str]], roots: set[str]) -> set[str]:
+    found = set(roots)
+    changed = True
+    while changed:
+        changed = False
+        for name, upstream in deps.items():
+            if name not in found and upstream & found:
+                found.add(name)
+                changed = True
+    return found
+
+
+def _file_hash(path: str, memo: dict) -> str:
+    """
+    SHA-256 of a file's contents, memoised by (size, mtime) so unchanged files are
+    not re-read on every run.
+    """
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    cached = memo.get(key)
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    memo[key] = [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+    return memo[key][2]
+
+
+def _content_hash(path: str, memo: dict) -> str | None:
+    """
+    Content hash of a file or, recursively, of a directory (relative names + file hashes).
+    """
+    if os.path.isfile(path):
+        return _file_hash(path, memo)
+    if not os.path.isdir(path):
+        return None
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            digest.update(os.path.relpath(full, path).encode())
+            digest.update(_file_hash(full, memo).encode())
+    return digest.hexdigest()
+
+
+def _signature(stage: Stage, memo: dict) -> str:
+    payload = {
+        "target": stage.target,
+        "kwargs": stage.kwargs,
+        "inputs": {i: _content_hash(i, memo) for i in stage.inputs},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _params_hash(stage: Stage) -> str:
+    payload = {"target": stage.target, "kwargs": stage.kwargs}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _unreported_inputs(stage: Stage, stages: dict[str, Stage], memo: dict) -> dict[str, str | None]:
+    """
+    Content hashes of the inputs whose changes are not reported as touched dates: files
+    outside the pipeline (e.g. the shapefile) and outputs of stages that neither write a
+    manifest nor run incrementally (an incremental stage only rewrites the dates it was
+    given, and a full run of it queues full runs downstream).
+    """
+    reported = {out for s in stages.values() if s.touched_manifest or s.incremental
+                for out in s.outputs}
+    return {i: _content_hash(i, memo) for i in stage.inputs if i not in reported}
+
+
+def _incremental_dates(stage: Stage, stages: dict[str, Stage], state: dict,
+                       forced: bool) -> list[str] | None:
+    """
+    Dates an incremental stage has to recompute, or None when it needs a full run
+    (forced, first run, changed parameters, missing outputs, nothing reported upstream,
+    or a change to an input that does not report touched dates).
+    """
+    pending = state["pending_dates"].get(stage.name)
+    if forced or not pending or state["params"].get(stage.name) != _params_hash(stage):
+        return None
+    if not all(os.path.exists(o) for o in stage.outputs):
+        return None
+    if state["inputs"].get(stage.name) != _unreported_inputs(stage, stages, state["files"]):
+        return None
+    return pending
+
+
+def _record_touched(stage: Stage, stages: dict[str, Stage], deps: dict[str, set[str]],
+                    state: dict) -> None:
+    """
+    Queue the dates a stage reported in its manifest for its incremental descendants.
+    """
+    if not stage.touched_manifest or not os.path.exists(stage.touched_manifest):
+        return
+    with open(stage.touched_manifest, "r", encoding="utf-8") as fh:
+        touched = json.load(fh).get("touched_dates", [])
+    for name in _descendants(deps, {stage.name}) - {stage.name}:
+        pending = state["pending_dates"].get(name)
+        # Stages that never completed will do a full run anyway
+        if stages[name].incremental and pending is not None:
+            state["pending_dates"][name] = sorted(set(pending) | set(touched))
+
+
+def _queue_full_runs(stage: Stage, stages: dict[str, Stage], deps: dict[str, set[str]],
+                     state: dict) -> None:
+    """
+    After a full run of a stage any date of its outputs may have changed, so its
+    incremental descendants have to run in full as well.
+    """
+    for name in _descendants(deps, {stage.name}) - {stage.name}:
+        if stages[name].incremental:
+            state["pending_dates"][name] = None
+
+
+def _load_state() -> dict:
+    state = {"stages": {}, "files": {}}
+    if os.path.exists(state_file):
+        with open(state_file, "r", encoding="utf-8") as fh:
+            state = json.load(fh)
+    state.setdefault("pending_dates", {})
+    state.setdefault("params", {})
+    state.setdefault("inputs", {})
+    return state
+
+
+def _save_state(state: dict) -> None:
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    tmp_path = state_file + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(state, fh, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_file)
+
+
+def _run_stage(name: str, target: str, kwargs: dict, log_level: str = "INFO",
+               instrument: bool = True, profile: bool = False) -> dict | None:
+    """
+    Process-pool worker: run one stage and return its metrics (None when not instrumented).
+    """
+    configure_logging(log_level)
+    module_name, func_name = target.split(":")
+    func = getattr(importlib.import_module(module_name), func_name)
+    if not instrument:
+        func(**kwargs)
+        return None
+    profile_path = os.path.join(profile_dir, f"{name}.prof") if profile else None
+    with stage_metrics(name, profile_path) as metrics:
+        func(**kwargs)
+    return metrics.as_dict()
+
+
+def _write_report(report: dict, path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_pipeline(from_stage: str | None = None,
+                 only: list[str] | None = None,
+                 force: bool = False,
+                 workers: int = 2,
+                 instrument: bool = True,
+                 profile: list[str] | None = None,
+                 log_level: str = "INFO",
+                 report_path: str | None = report_file) -> dict[str, str]:
+    """
+    Run the pipeline graph, skipping stages whose inputs and parameters are unchanged.
+
+    Every stage that runs is measured (wall/CPU time, peak RSS, rows and bytes read and
+    written, cache hits and misses) and the results are written as a JSON run report.
+
+    Args:
+        from_stage (str | None): Re-run this stage and everything downstream of it;
+            upstream stages are not run.
+        only (list[str] | None): Run only these stages (forced), nothing else.
+        force (bool): Run every selected stage even if it is up to date.
+        workers (int): Maximum number of stages run concurrently (in separate processes).
+        instrument (bool): Collect per-stage metrics; False runs stages bare.
+        profile (list[str] | None): Stages to run under cProfile; stats are saved as
+            profiles/<stage>.prof next to the report.
+        log_level (str): Logging level for the pipeline and its stages ('WARNING' hides
+            progress messages).
+        report_path (str | None): Where to write the JSON run report; None disables it.
+
+    Returns:
+        dict[str, str]: Stage name -> 'ran', 'skipped', 'failed' or 'blocked'.
+    """
+    stages = {s.name: s for s in build_stages()}
+    deps = _dependencies(list(stages.values()))
+
+    for name in ([from_stage] if from_stage else []) + (only or []):
+        if name not in stages:
+            raise ValueError(f"Unknown stage '{name}'. Stages: {', '.join(stages)}")
+
+    if only:
+        selected, forced = set(only), set(only)
+    elif from_stage:
+        selected = forced = _descendants(deps, {from_stage})
+    else:
+        selected, forced = set(stages), set(stages) if force else set()
+
+    for name in profile or []:
+        if name not in stages:
+            raise ValueError(f"Unknown stage '{name}'. Stages: {', '.join(stages)}")
+
+    configure_logging(log_level)
+    state = _load_state()
+    status = {name: "skipped" for name in stages if name not in selected}
+    metrics = {}
+    running = {}
+    full_runs = set()
+    started = datetime.now(timezone.utc)
 
-def run_pipeline():
-    # STEP 0: Fetch raw OCO-2 data
-    print("\n=== STEP 0: FETCH RAW DATA ===")
-    os.makedirs(data_folder, exist_ok=True)
-    fetch_oco2_data(output_dir=data_folder)
+    def ready(name):
+        # Upstream stages outside the selection count as satisfied
+        return all(status.get(d) in ("ran", "skipped") for d in deps[name] if d in selected)
 
-    
-    # STEP 1: Ingest
-    print("\n=== STEP 1: INGEST DATA ===")
-    ingest_data(data_folder, ingested_folder)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while len(status) < len(stages):
+            for name in stages:
+                if name in status or name in running.values():
+                    continue
+                if any(status.get(d) in ("failed", "blocked") for d in deps[name]):
+                    status[name] = "blocked"
+                    logger.info(f"⏭️ {name}: blocked by a failed upstream stage")
+                    continue
+                if not ready(name):
+                    continue
+                stage = stages[name]
+                signature = _signature(stage, state["files"])
+                up_to_date = (
+                    not stage.always_run
+                    and name not in forced
+                    and state["stages"].get(name) == signature
+                    and all(os.path.exists(o) for o in stage.outputs)
+                )
+                if up_to_date:
+                    status[name] = "skipped"
+                    logger.info(f"✅ {name}: up to date, skipped")
+                    continue
+                kwargs = stage.kwargs
+                if stage.incremental:
+                    dates = _incremental_dates(stage, stages, state, name in forced)
+                    if dates is not None:
+                        kwargs = {**kwargs, "dates": dates}
+                        logger.info(f"🔁 {name}: {len(dates)} changed dates")
+                    else:
+                        full_runs.add(name)
+                logger.info(f"=== {name.upper()} ===")
+                running[pool.submit(_run_stage, name, stage.target, kwargs, log_level,
+                                    instrument, name in (profile or []))] = name
 
-    # STEP 2: Preprocess
-    print("\n=== STEP 2: PREPROCESS DATA ===")
-    preprocess_data(ingested_folder)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    status[name] = "failed"
+                    metrics[name] = {"error": str(e)}
+                    logger.error(f"❌ {name} failed: {e}")
+                    continue
+                status[name] = "ran"
+                if result is not None:
+                    metrics[name] = result
+                    logger.info(f"⏱️ {name}: {result['wall_seconds']:.2f}s wall, "
+                                f"{result['cpu_seconds']:.2f}s CPU, peak {result['peak_rss_mb']} MB, "
+                                f"{result['rows_in']} rows in, {result['rows_out']} rows out")
+                # Inputs were final before the stage started; re-hash in case the
+                # stage touched them (e.g. fetch adds files to its own output)
+                state["stages"][name] = _signature(stages[name], state["files"])
+                _record_touched(stages[name], stages, deps, state)
+                if name in full_runs:
+                    _queue_full_runs(stages[name], stages, deps, state)
+                if stages[name].incremental:
+                    state["pending_dates"][name] = []
+                    state["params"][name] = _params_hash(stages[name])
+                    state["inputs"][name] = _unreported_inputs(stages[name], stages, state["files"])
+                _save_state(state)
 
-    # STEP 3: Aggregate
-    print("\n=== STEP 3: AGGREGATE DATA ===")
-    aggregate_data(ingested_folder, combined_csv)
+    if report_path:
+        finished = datetime.now(timezone.utc)
+        _write_report({
+            "started": started.isoformat(timespec="seconds"),
+            "finished": finished.isoformat(timespec="seconds"),
+            "wall_seconds": round((finished - started).total_seconds(), 3),
+            "workers": workers,
+            "stages": {
+                name: {"status": status[name], **metrics.get(name, {})} for name in stages
+            },
+        }, report_path)
+        logger.info(f"📊 Run report saved to {report_path}")
 
-    # STEP 4: Country-level aggregation
-    print("\n=== STEP 4: COUNTRY AGGREGATION ===")
-    aggregate_country_daily(combined_csv, country_csv)
+    failed = [n for n, st in status.items() if st in ("failed", "blocked")]
+    if failed:
+        logger.warning(f"⚠️ Pipeline finished with failures: {', '.join(failed)}")
+    else:
+        logger.info("✅ Pipeline completed successfully!")
+    return status
 
-    # STEP 5: ARIMA Forecast
-    print("\n=== STEP 5: ARIMA FORECAST ===")
-    arima_forecast_country(country_csv, country_name, forecast_months=12,
-                           save_plot=f"{country_name.lower()}_arima_forecast.png")
 
-    # STEP 6: LSTM Forecast
-    print("\n=== STEP 6: LSTM FORECAST ===")
-    lstm_forecast_country(country_csv, country_name, n_steps=4, forecast_horizon=4,
-                          epochs=50, output_dir=ingested_folder)
+def main(argv: list[str] | None = None) -> None:
+    stage_names = [s.name for s in build_stages()]
+    parser = argparse.ArgumentParser(description="Run the OCO-2 CO₂ pipeline.")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--from", dest="from_stage", choices=stage_names,
+                       help="re-run this stage and everything downstream of it")
+    group.add_argument("--only", nargs="+", choices=stage_names,
+                       help="run only these stages")
+    parser.add_argument("--force", action="store_true",
+                        help="run stages even if their inputs are unchanged")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="maximum number of stages run concurrently")
+    parser.add_argument("--profile", nargs="+", choices=stage_names, default=[],
+                        help="run these stages under cProfile")
+    parser.add_argument("--no-metrics", dest="instrument", action="store_false",
+                        help="do not collect per-stage metrics")
+    parser.add_argument("--log-level", default="INFO",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--report", default=report_file,
+                        help="path of the JSON run report")
+    args = parser.parse_args(argv)
+    run_pipeline(from_stage=args.from_stage, only=args.only, force=args.force,
+                 workers=args.workers, instrument=args.instrument, profile=args.profile,
+                 log_level=args.log_level, report_path=args.report)
 
-    print("\n✅ Pipeline completed successfully!")
 
 if __name__ == "__main__":
-    run_pipeline()
+    main()
@@ -1,71 +1,143 @@
 # oco2_preprocess.py
+import io
+import logging
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from pathlib import Path
 
+from storage import (read_table, write_table, write_partitions, drop_partitions,
+                     list_partitions, clear_table, is_csv, compact_soundings)
+
+logger = logging.getLogger(__name__)
+
+# Valid ranges used to filter soundings
+XCO2_RANGE = (350, 500)
+LAT_RANGE = (-90, 90)
+LON_RANGE = (-180, 180)
+
+
+def valid_sounding_mask(xco2, latitude, longitude, quality_flag=None) -> np.ndarray:
+    """
+    Boolean mask of soundings passing the preprocessing filters.
+
+    Works on raw NumPy arrays (e.g. straight from xarray variables) as well as
+    DataFrame columns. NaNs fail every range comparison, so missing values are
+    dropped as well.
+
+    Args:
+        xco2, latitude, longitude: Array-likes of equal length.
+        quality_flag: Optional xco2_quality_flag array; when given only 0 (good) passes.
+
+    Returns:
+        np.ndarray: Boolean mask.
+    """
+    xco2 = np.asarray(xco2)
+    latitude = np.asarray(latitude)
+    longitude = np.asarray(longitude)
+
+    mask = (xco2 >= XCO2_RANGE[0]) & (xco2 <= XCO2_RANGE[1])
+    mask &= (latitude >= LAT_RANGE[0]) & (latitude <= LAT_RANGE[1])
+    mask &= (longitude >= LON_RANGE[0]) & (longitude <= LON_RANGE[1])
+    if quality_flag is not None:
+        mask &= np.asarray(quality_flag) == 0
+    return mask
+
+
+def _clean_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    return df[valid_sounding_mask(df["xco2"], df["latitude"], df["longitude"])]
+
+
 def preprocess_oco2_data(
-    input_csv: str = "./oco2_ingested/combined_oco2_data.csv",
-    output_csv: str = "./oco2_ingested/cleaned_oco2_data.csv",
-    plot: bool = True
-) -> pd.DataFrame:
+    input_csv: str = "./oco2_ingested/combined_oco2_data.parquet",
+    output_csv: str = "./oco2_ingested/cleaned_oco2_data.parquet",
+    plot: bool = True,
+    dates: list[str] | None = None
+) -> pd.DataFrame | None:
     """
     Preprocess OCO-2 combined dataset:
       - Convert dates
       - Drop missing values
       - Filter by valid ranges
-      - Save cleaned dataset
-      - Optionally plot spatial distribution
+      - Save cleaned dataset (Parquet store partitioned by date, or CSV if the
+        output path ends in '.csv')
+      - Optionally map the spatial distribution (rasterised, saved next to the output)
+
+    Partitioned input written to a Parquet store is streamed one date partition at a
+    time: each cleaned partition is written and released, so memory holds one date.
+    For ingestion straight from the granules, use ingest.ingest_clean_data, which
+    applies the same filters before any DataFrame is built.
     
     Args:
-        input_csv (str): Path to combined OCO-2 data CSV.
-        output_csv (str): Path to save cleaned CSV.
-        plot (bool): Whether to show a scatter plot of xco2 distribution.
+        input_csv (str): Path to combined OCO-2 data (Parquet store or CSV).
+        output_csv (str): Path to save cleaned data.
+        plot (bool): Whether to save a map of mean xco2 per 0.5° cell as xco2_map.png
+            next to output_csv.
+        dates (list[str] | None): If given (e.g. the manifest's touched dates after an
+            incremental ingest), only these date partitions are re-cleaned and replaced
+            in the output store. Requires Parquet input and output.
     
     Returns:
-        pd.DataFrame: Cleaned dataframe.
+        pd.DataFrame | None: Cleaned dataframe, or None when a partitioned input was
+            streamed into the Parquet store (read it back with storage.read_table).
     """
     input_csv = Path(input_csv)
     output_csv = Path(output_csv)
 
     if not input_csv.exists():
-        raise FileNotFoundError(f"Input CSV not found: {input_csv}")
-
-    # Load Data
-    df = pd.read_csv(input_csv)
-    df["date"] = pd.to_datetime(df["date"])
-
-    print("✅ Loaded data")
-    print(df.info())
-
-    # Cleaning
-    df_clean = df.dropna(subset=["xco2", "latitude", "longitude"])
-    df_clean = df_clean[(df_clean["xco2"] >= 350) & (df_clean["xco2"] <= 500)]
-    df_clean = df_clean[(df_clean["latitude"] >= -90) & (df_clean["latitude"] <= 90)]
-    df_clean = df_clean[(df_clean["longitude"] >= -180) & (df_clean["longitude"] <= 180)]
-
-    print(f"✅ Cleaned dataset rows: {len(df_clean)}")
-
-    # Save
-    output_csv.parent.mkdir(parents=True, exist_ok=True)
-    df_clean.to_csv(output_csv, index=False)
-    print(f"💾 Cleaned data saved to: {output_csv}")
-
-    # Optional plotting
-    if plot:
-        plt.figure(figsize=(10, 6))
-        scatter = plt.scatter(
-            df_clean["longitude"], df_clean["latitude"],
-            c=df_clean["xco2"], cmap="viridis", s=1
-        )
-        plt.colorbar(scatter, label="xco2 (ppm)")
-        plt.xlabel("Longitude")
-        plt.ylabel("Latitude")
-        plt.title("Spatial distribution of CO₂ measurements")
-        plt.show()
+        raise FileNotFoundError(f"Input data not found: {input_csv}")
+    if dates is not None and (is_csv(input_csv) or is_csv(output_csv)):
+        raise ValueError("Date-restricted preprocessing requires Parquet input and output.")
+
+    if input_csv.is_dir() and not is_csv(output_csv):
+        # Stream the partitioned store one date at a time
+        keys = list(list_partitions(input_csv))
+        if dates is None:
+            clear_table(output_csv)
+        else:
+            drop_partitions(output_csv, dates)
+            keys = [k for k in keys if k in set(dates)]
+
+        loaded, cleaned = 0, 0
+        for key in keys:
+            df = compact_soundings(read_table(input_csv, partitions=[key]))
+            loaded += len(df)
+            chunk = _clean_chunk(df)
+            write_partitions(chunk, output_csv)
+            cleaned += len(chunk)
+        logger.info(f"✅ Loaded data ({loaded} rows in {len(keys)} date partitions)")
+        logger.info(f"✅ Cleaned dataset rows: {cleaned}")
+        df_clean = None
+    else:
+        # Load Data
+        df = compact_soundings(read_table(input_csv))
+
+        logger.info(f"✅ Loaded data ({len(df)} rows)")
+        if logger.isEnabledFor(logging.DEBUG):
+            buf = io.StringIO()
+            df.info(buf=buf)
+            logger.debug(buf.getvalue())
+
+        # Cleaning
+        df_clean = _clean_chunk(df)
+        logger.info(f"✅ Cleaned dataset rows: {len(df_clean)}")
+
+        # Save
+        write_table(df_clean, output_csv,
+                    partition_by=None if is_csv(output_csv) else "date")
+    logger.info(f"💾 Cleaned data saved to: {output_csv}")
+
+    # Optional plotting (a streamed store is rasterised back one partition at a time)
+    if plot and (df_clean is None or not df_clean.empty):
+        from render import plot_sounding_map
+
+        plot_sounding_map(str(output_csv) if df_clean is None else df_clean,
+                          str(output_csv.parent / "xco2_map.png"))
 
     return df_clean
 
 
 # Example manual run
 if __name__ == "__main__":
+    from instrumentation import configure_logging
+    configure_logging()
     preprocess_oco2_data()
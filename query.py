@@ -0,0 +1,154 @@
+# query.py
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as pads
+
+from storage import read_table, list_partitions, partition_dir, drop_partitions
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "_index.parquet"
+STAT_COLUMNS = ("latitude", "longitude", "xco2")
+
+
+def _tile_name(row: int, col: int) -> str:
+    return f"tile-{row:03d}-{col:03d}.parquet"
+
+
+def build_query_store(
+    input_file: str = "./oco2_ingested/cleaned_oco2_data.parquet",
+    store_dir: str = "./oco2_ingested/query_store",
+    tile_deg: float = 10.0,
+    dates: list[str] | None = None
+) -> pd.DataFrame:
+    """
+    Re-partition soundings by date and spatial tile and record per-partition statistics.
+
+    Every (date, tile) partition is written as its own Parquet file, and a small index
+    holds its row count and min/max of latitude, longitude and xco2. query() uses the
+    index to skip partitions before reading anything.
+
+    Args:
+        input_file (str): Cleaned soundings (partitioned Parquet store or CSV/Parquet file).
+        store_dir (str): Output directory of the tiled store.
+        tile_deg (float): Tile size in degrees (default 10).
+        dates (list[str] | None): Rebuild only these dates; other partitions and their
+            index entries are kept.
+
+    Returns:
+        pd.DataFrame: The partition index.
+    """
+    store = Path(store_dir)
+    index_path = store / INDEX_NAME
+    index = pd.read_parquet(index_path) if dates is not None and index_path.exists() else None
+
+    if Path(input_file).is_dir():
+        keys = list(list_partitions(input_file))
+        if dates is not None:
+            keys = [k for k in keys if k in set(dates)]
+        chunks = (read_table(input_file, partitions=[k]) for k in keys)
+    else:
+        chunks = iter([read_table(input_file)])
+
+    if dates is not None:
+        drop_partitions(store, dates)
+        if index is not None:
+            index = index[~index["date"].isin(pd.to_datetime(dates))]
+    else:
+        drop_partitions(store, list(list_partitions(store)))
+
+    ny, nx = int(np.ceil(180 / tile_deg)), int(np.ceil(360 / tile_deg))
+    entries = []
+    for df in chunks:
+        if df.empty:
+            continue
+        tile_row = np.clip(((df["latitude"] + 90) // tile_deg).astype(int), 0, ny - 1)
+        tile_col = np.clip(((df["longitude"] + 180) // tile_deg).astype(int), 0, nx - 1)
+        for (date, row, col), part in df.groupby([df["date"], tile_row, tile_col]):
+            part_dir = partition_dir(store, date)
+            part_dir.mkdir(parents=True, exist_ok=True)
+            path = part_dir / _tile_name(row, col)
+            part.to_parquet(path, index=False)
+            entry = {"date": date, "tile_row": row, "tile_col": col,
+                     "path": str(path.relative_to(store)), "rows": len(part)}
+            for column in STAT_COLUMNS:
+                entry[f"{column}_min"] = part[column].min()
+                entry[f"{column}_max"] = part[column].max()
+            entries.append(entry)
+
+    new_index = pd.DataFrame(entries)
+    if index is not None:
+        new_index = pd.concat([index, new_index], ignore_index=True)
+    new_index = new_index.sort_values(["date", "tile_row", "tile_col"], ignore_index=True)
+    store.mkdir(parents=True, exist_ok=True)
+    new_index.to_parquet(index_path, index=False)
+    logger.info(f"✅ Query store with {len(new_index)} (date, tile) partitions saved to {store}")
+    return new_index
+
+
+def query(
+    bbox: tuple[float, float, float, float] | None = None,
+    start: str | None = None,
+    end: str | None = None,
+    columns: list[str] | None = None,
+    store_dir: str = "./oco2_ingested/query_store"
+) -> pd.DataFrame:
+    """
+    Return the soundings inside a bounding box and date range.
+
+    Partitions are pruned with the index statistics first; only the surviving files are
+    opened, and the exact row filter is pushed down to the Parquet reader.
+
+    Args:
+        bbox (tuple | None): (lon_min, lat_min, lon_max, lat_max); None means global.
+        start (str | None): First date (inclusive), e.g. '2020-03-01'.
+        end (str | None): Last date (inclusive), e.g. '2020-03-31'.
+        columns (list[str] | None): Columns to return; None returns all of them.
+        store_dir (str): Tiled store written by build_query_store.
+
+    Returns:
+        pd.DataFrame: Matching soundings.
+    """
+    store = Path(store_dir)
+    index = pd.read_parquet(store / INDEX_NAME)
+
+    keep = np.ones(len(index), dtype=bool)
+    if start is not None:
+        keep &= (index["date"] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        keep &= (index["date"] <= pd.Timestamp(end)).to_numpy()
+    if bbox is not None:
+        lon_min, lat_min, lon_max, lat_max = bbox
+        keep &= ((index["longitude_max"] >= lon_min) & (index["longitude_min"] <= lon_max)
+                 & (index["latitude_max"] >= lat_min) & (index["latitude_min"] <= lat_max)).to_numpy()
+    files = [str(store / p) for p in index.loc[keep, "path"]]
+    if not files:
+        return pd.DataFrame(columns=columns or [])
+
+    expr = None
+    conditions = []
+    if bbox is not None:
+        conditions += [pads.field("longitude") >= lon_min, pads.field("longitude") <= lon_max,
+                       pads.field("latitude") >= lat_min, pads.field("latitude") <= lat_max]
+    if start is not None:
+        conditions.append(pads.field("date") >= pd.Timestamp(start))
+    if end is not None:
+        conditions.append(pads.field("date") <= pd.Timestamp(end))
+    for condition in conditions:
+        expr = condition if expr is None else expr & condition
+
+    table = pads.dataset(files, format="parquet").to_table(columns=columns, filter=expr)
+    return table.to_pandas()
+
+
+# Example manual run
+if __name__ == "__main__":
+    from instrumentation import configure_logging
+    configure_logging()
+    build_query_store()
+    india = query(bbox=(68, 6, 97, 36), start="2020-03-01", end="2020-03-31",
+                  columns=["date", "latitude", "longitude", "xco2"])
+    print(india.head())
@@ -0,0 +1,345 @@
+# regions.py
+import json
+import time
+import hashlib
+import logging
+import argparse
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from storage import read_table, write_table, update_by_date, list_partitions, compact_soundings
+from country import _shapefile_hash
+from aggregation import PartialAggregates
+from instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "./oco2_ingested/region_cache"
+INDEX_STATS_NAME = "index_stats.json"
+
+
+@dataclass(frozen=True)
+class RegionLayer:
+    """
+    One polygon layer: a vector file and the attribute column naming its regions.
+    """
+    name: str
+    path: str
+    name_column: str = "NAME"
+
+    @classmethod
+    def parse(cls, spec) -> "RegionLayer":
+        """
+        Accept a RegionLayer, a (name, path[, column]) tuple or a 'name=path[#column]' string.
+        """
+        if isinstance(spec, RegionLayer):
+            return spec
+        if isinstance(spec, (tuple, list)):
+            return cls(*spec)
+        name, _, rest = spec.partition("=")
+        if not rest:
+            raise ValueError(f"Layer spec must look like 'name=path[#column]': {spec}")
+        path, _, column = rest.partition("#")
+        return cls(name, path, column or "NAME")
+
+
+def _layer_hash(layer: RegionLayer) -> str:
+    """
+    Content hash of a layer: its file(s) plus the region name column.
+    """
+    digest = hashlib.sha256()
+    if Path(layer.path).suffix.lower() == ".shp":
+        digest.update(_shapefile_hash(layer.path).encode())
+    else:
+        digest.update(Path(layer.path).read_bytes())
+    digest.update(layer.name_column.encode())
+    return digest.hexdigest()
+
+
+def _load_polygons(layer: RegionLayer, key: str, cache_dir: Path):
+    """
+    Polygons and region names of a layer, from a WKB cache when available.
+    """
+    import shapely
+
+    cache_path = cache_dir / "polygons" / f"{key}.npz"
+    if cache_path.exists():
+        cached = np.load(cache_path, allow_pickle=False)
+        chunks = np.split(cached["wkb"], np.cumsum(cached["lengths"])[:-1])
+        return shapely.from_wkb([c.tobytes() for c in chunks]), cached["names"].tolist()
+
+    import geopandas as gpd
+
+    gdf = gpd.read_file(layer.path)
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+    geoms = gdf.geometry.to_numpy()
+    names = gdf[layer.name_column].astype(str).tolist()
+    wkb = shapely.to_wkb(geoms)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(cache_path,
+             wkb=np.frombuffer(b"".join(wkb), dtype=np.uint8),
+             lengths=np.array([len(b) for b in wkb], dtype=np.int64),
+             names=np.array(names))
+    return geoms, names
+
+
+class LayerIndex:
+    """
+    Prepared polygons of one layer for bulk point-in-polygon assignment.
+
+    Parameters
+    ----------
+    layer : RegionLayer
+        Layer to index.
+    cache_dir : str
+        Directory of the polygon (WKB) and assignment caches and of index_stats.json,
+        which records how long each layer's index took to build.
+    """
+
+    def __init__(self, layer: RegionLayer, cache_dir: str = DEFAULT_CACHE_DIR):
+        import shapely
+
+        self.layer = layer
+        self.cache_dir = Path(cache_dir)
+        self.key = f"{layer.name}-{_layer_hash(layer)[:16]}"
+
+        start = time.perf_counter()
+        geoms, names = _load_polygons(layer, self.key, self.cache_dir)
+        loaded = time.perf_counter()
+        # Prepared once, the polygons answer the 'contains' queries of assign() cheaply
+        shapely.prepare(geoms)
+        self.geoms = geoms
+        # Duplicate names (e.g. multi-part regions stored as rows) share one category
+        self.categories, self.codes = np.unique(np.array(names, dtype=object), return_inverse=True)
+        self.build_seconds = time.perf_counter() - loaded
+        self._record_stats(len(names), loaded - start)
+
+    def _record_stats(self, polygons: int, load_seconds: float) -> None:
+        path = self.cache_dir / INDEX_STATS_NAME
+        stats = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as fh:
+                stats = json.load(fh)
+        stats[self.key] = {
+            "layer": self.layer.name,
+            "path": str(self.layer.path),
+            "polygons": polygons,
+            "load_seconds": round(load_seconds, 4),
+            "build_seconds": round(self.build_seconds, 4),
+            "built_at": time.time(),
+        }
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(stats, fh, indent=2, sort_keys=True)
+
+    def assign(self, points: np.ndarray, tree=None) -> np.ndarray:
+        """
+        Region code per point (-1 outside every polygon) from one bulk tree query.
+
+        The STRtree is built over the points (or passed in as tree, to share it between
+        layers) and queried with the prepared polygons, so every candidate pair is tested
+        as 'prepared polygon contains point'.
+        """
+        if tree is None:
+            from shapely import STRtree
+            tree = STRtree(points)
+        geom_idx, point_idx = tree.query(self.geoms, predicate="contains")
+        codes = np.full(len(points), -1, dtype=np.int32)
+        if len(point_idx):
+            # Overlapping polygons: the first polygon of the layer wins
+            order = np.lexsort((geom_idx, point_idx))
+            point_idx, geom_idx = point_idx[order], geom_idx[order]
+            first = np.unique(point_idx, return_index=True)[1]
+            codes[point_idx[first]] = self.codes[geom_idx[first]]
+        return codes
+
+    def _assignment_path(self, chunk: str) -> Path:
+        return self.cache_dir / "assignments" / self.key / f"{chunk}.npz"
+
+    def load_codes(self, chunk: str, signature: str) -> np.ndarray | None:
+        path = self._assignment_path(chunk)
+        if not path.exists():
+            return None
+        cached = np.load(path, allow_pickle=False)
+        if str(cached["signature"]) != signature:
+            return None
+        return cached["codes"]
+
+    def save_codes(self, chunk: str, signature: str, codes: np.ndarray) -> None:
+        path = self._assignment_path(chunk)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, codes=codes, signature=np.array(signature))
+
+
+@lru_cache(maxsize=16)
+def get_layer_index(layer: RegionLayer, cache_dir: str = DEFAULT_CACHE_DIR) -> LayerIndex:
+    """
+    LayerIndex built once per process and layer.
+    """
+    return LayerIndex(layer, cache_dir)
+
+
+def _chunk_signature(files) -> str:
+    """
+    Identity of an input chunk: names, sizes and mtimes of its files.
+    """
+    parts = []
+    for f in files:
+        st = Path(f).stat()
+        parts.append(f"{Path(f).name}:{st.st_size}:{st.st_mtime_ns}")
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def assign_regions(df: pd.DataFrame, layers: list, cache_dir: str = DEFAULT_CACHE_DIR) -> pd.DataFrame:
+    """
+    Assign each sounding to a region of every layer in one pass.
+
+    Points and their STRtree are built once and queried with each layer's prepared polygons.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Soundings with 'longitude' and 'latitude'.
+    layers : list
+        RegionLayer objects or 'name=path[#column]' specs.
+    cache_dir : str
+        See LayerIndex.
+
+    Returns
+    -------
+    pd.DataFrame
+        One categorical column per layer (NaN outside all regions), indexed like df.
+    """
+    import shapely
+    from shapely import STRtree
+
+    points = shapely.points(df['longitude'].to_numpy(dtype=np.float64),
+                            df['latitude'].to_numpy(dtype=np.float64))
+    tree = STRtree(points)
+    out = {}
+    for layer in map(RegionLayer.parse, layers):
+        index = get_layer_index(layer, cache_dir)
+        out[layer.name] = pd.Categorical.from_codes(index.assign(points, tree), categories=index.categories)
+    return pd.DataFrame(out, index=df.index)
+
+
+def _daily_stats(layer: str, regions: pd.Categorical, dates: pd.Series, xco2: pd.Series) -> pd.DataFrame:
+    # Same accumulators and finalisation as the global/latitude-band/country statistics
+    work = pd.DataFrame({'region': regions, 'date': dates.to_numpy(), 'xco2': xco2.to_numpy()})
+    stats = PartialAggregates.from_frame(work, {'region': ['region', 'date']}).finalize()['region']
+    stats.insert(0, 'layer', layer)
+    stats['region'] = stats['region'].astype(str)
+    return stats
+
+
+def aggregate_regions_daily(input_file: str,
+                            layers: list,
+                            output_file: str = "./oco2_ingested/region_daily_stats.parquet",
+                            dates: list[str] | None = None,
+                            cache_dir: str = DEFAULT_CACHE_DIR) -> pd.DataFrame:
+    """
+    Daily xco2 statistics per layer and region for several polygon layers at once.
+
+    The input is streamed one date partition at a time. For each partition, the region
+    codes of every layer are loaded from the assignment cache when the partition is
+    unchanged; otherwise Points are built once and assigned to all layers that miss.
+
+    Parameters
+    ----------
+    input_file : str
+        Cleaned soundings (Parquet store, Parquet file or CSV).
+    layers : list
+        RegionLayer objects, (name, path[, column]) tuples or 'name=path[#column]' specs.
+    output_file : str, optional
+        Output table with 'layer', 'region', 'date', 'xco2', 'xco2_std', 'count'.
+    dates : list[str] | None, optional
+        Only recompute these date partitions and replace them in the existing output.
+    cache_dir : str, optional
+        Polygon, assignment and index-timing caches (see LayerIndex).
+
+    Returns
+    -------
+    pd.DataFrame
+        The per-layer, per-region daily statistics.
+    """
+    layers = [RegionLayer.parse(layer) for layer in layers]
+    if len({layer.name for layer in layers}) != len(layers):
+        raise ValueError("Layer names must be unique.")
+    indexes = [get_layer_index(layer, cache_dir) for layer in layers]
+
+    columns = ['longitude', 'latitude', 'xco2', 'date']
+    if Path(input_file).is_dir():
+        partitions = list_partitions(input_file)
+        if dates is not None:
+            partitions = {k: v for k, v in partitions.items() if k in set(dates)}
+        chunks = [(key, [key], files) for key, files in partitions.items()]
+    else:
+        if dates is not None:
+            raise ValueError("Date-restricted aggregation requires a partitioned Parquet input.")
+        chunks = [("all", None, [input_file])]
+
+    tables = []
+    for key, partition, files in chunks:
+        signature = _chunk_signature(files)
+        df = compact_soundings(read_table(input_file, columns=columns, partitions=partition))
+        if df.empty:
+            continue
+
+        codes = {}
+        for index in indexes:
+            cached = index.load_codes(key, signature)
+            if cached is not None and len(cached) == len(df):
+                codes[index.layer.name] = cached
+        count("cache_hits", len(codes))
+        count("cache_misses", len(indexes) - len(codes))
+
+        missing = [index for index in indexes if index.layer.name not in codes]
+        if missing:
+            import shapely
+            from shapely import STRtree
+            points = shapely.points(df['longitude'].to_numpy(dtype=np.float64),
+                                    df['latitude'].to_numpy(dtype=np.float64))
+            tree = STRtree(points)
+            for index in missing:
+                codes[index.layer.name] = index.assign(points, tree)
+                index.save_codes(key, signature, codes[index.layer.name])
+
+        for index in indexes:
+            regions = pd.Categorical.from_codes(codes[index.layer.name], categories=index.categories)
+            tables.append(_daily_stats(index.layer.name, regions, df['date'], df['xco2']))
+
+    result = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(
+        columns=['layer', 'region', 'date', 'xco2', 'xco2_std', 'count'])
+    sort_by = ['layer', 'region', 'date']
+    if dates is not None:
+        result = update_by_date(output_file, result, dates, sort_by)
+    else:
+        result = result.sort_values(sort_by, ignore_index=True)
+
+    write_table(result, output_file)
+    logger.info(f"✅ Daily statistics for {len(layers)} region layers saved to {output_file}")
+    return result
+
+
+def main(argv: list[str] | None = None) -> None:
+    from instrumentation import configure_logging
+
+    parser = argparse.ArgumentParser(description="Aggregate soundings over several polygon layers.")
+    parser.add_argument("--input", default="./oco2_ingested/cleaned_oco2_data.parquet")
+    parser.add_argument("--layer", action="append", required=True, dest="layers",
+                        help="layer spec 'name=path[#column]' (repeatable)")
+    parser.add_argument("--output", default="./oco2_ingested/region_daily_stats.parquet")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    aggregate_regions_daily(args.input, args.layers, args.output, cache_dir=args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+# render.py
+import os
+import logging
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from storage import read_table, list_partitions
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_EXTENT = (-180.0, 180.0, -90.0, 90.0)  # lon_min, lon_max, lat_min, lat_max
+
+
+def _figure(figsize=(12, 6)):
+    """
+    A Figure bound to the Agg canvas.
+
+    Figures are built through the object API rather than pyplot, so nothing depends on
+    the configured backend, no GUI event loop is touched and nothing ever blocks.
+    Figures are independent objects, which is safe in worker processes and threads.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _save(fig, path, dpi: int = 150) -> str:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fig.savefig(path, dpi=dpi, bbox_inches="tight")
+    return str(path)
+
+
+class PointRaster:
+    """
+    Running 2-D histogram of points (count and value sum per cell).
+
+    The edges are uniform, so points are binned by direct index arithmetic and
+    np.bincount, much faster than np.histogram2d's edge search. Any number of chunks can
+    be added while memory holds only the grid.
+    """
+
+    def __init__(self, resolution: float = 0.5, extent: tuple = GLOBAL_EXTENT):
+        self.resolution = resolution
+        self.extent = extent
+        lon_min, lon_max, lat_min, lat_max = extent
+        self.shape = (int(round((lat_max - lat_min) / resolution)),
+                      int(round((lon_max - lon_min) / resolution)))
+        self.count = np.zeros(self.shape, dtype=np.int64)
+        self.total = np.zeros(self.shape, dtype=np.float64)
+
+    def add(self, longitude, latitude, values=None) -> "PointRaster":
+        lon_min, lon_max, lat_min, lat_max = self.extent
+        lat = np.asarray(latitude, dtype=np.float64)
+        lon = np.asarray(longitude, dtype=np.float64)
+        inside = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+        ny, nx = self.shape
+        # Points on the upper/right edge fall into the last cell, as in np.histogram2d
+        rows = np.minimum(((lat[inside] - lat_min) / self.resolution).astype(np.int64), ny - 1)
+        cols = np.minimum(((lon[inside] - lon_min) / self.resolution).astype(np.int64), nx - 1)
+        cell = rows * nx + cols
+        self.count += np.bincount(cell, minlength=ny * nx).reshape(self.shape)
+        if values is not None:
+            weights = np.asarray(values, dtype=np.float64)[inside]
+            self.total += np.bincount(cell, weights=weights, minlength=ny * nx).reshape(self.shape)
+        return self
+
+    def mean(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, self.total / self.count, np.nan)
+
+
+def rasterize_table(
+    input_file: str,
+    resolution: float = 0.5,
+    extent: tuple = GLOBAL_EXTENT,
+    value_column: str = "xco2"
+) -> PointRaster:
+    """
+    Rasterise a sounding table, one date partition at a time for partitioned stores.
+
+    Args:
+        input_file (str): Sounding table (Parquet store, Parquet file or CSV) with
+            longitude, latitude and value_column.
+        resolution (float): Cell size in degrees.
+        extent (tuple): (lon_min, lon_max, lat_min, lat_max) of the image.
+        value_column (str): Column averaged per cell.
+
+    Returns:
+        PointRaster: Counts and value sums per cell.
+    """
+    raster = PointRaster(resolution, extent)
+    columns = ["longitude", "latitude", value_column]
+    if Path(input_file).is_dir():
+        chunks = (read_table(input_file, columns=columns, partitions=[key])
+                  for key in list_partitions(input_file))
+    else:
+        chunks = iter([read_table(input_file, columns=columns)])
+    for df in chunks:
+        raster.add(df["longitude"], df["latitude"], df[value_column])
+    return raster
+
+
+def plot_raster(
+    raster: PointRaster,
+    output_path: str,
+    statistic: str = "mean",
+    title: str = "Spatial distribution of CO₂ measurements",
+    cmap: str = "viridis"
+) -> str:
+    """
+    Draw a PointRaster as an image: per-cell mean value or sounding density.
+
+    Args:
+        raster (PointRaster): Binned points.
+        output_path (str): Image file to write (format from the extension).
+        statistic (str): 'mean' for the mean value per cell, 'count' for the number of
+            soundings per cell (log colour scale).
+        title (str): Figure title.
+        cmap (str): Matplotlib colormap name.
+
+    Returns:
+        str: Path of the saved image.
+    """
+    from matplotlib.colors import LogNorm
+
+    if statistic == "mean":
+        image, norm, label = raster.mean(), None, "xco2 (ppm)"
+    elif statistic == "count":
+        counts = raster.count.astype(np.float64)
+        image = np.where(counts > 0, counts, np.nan)
+        norm = LogNorm(vmin=1, vmax=max(counts.max(), 1)) if counts.any() else None
+        label = "soundings per cell"
+    else:
+        raise ValueError(f"Unknown statistic: {statistic}")
+
+    fig = _figure((10, 6))
+    ax = fig.add_subplot()
+    mesh = ax.imshow(image, origin="lower", extent=raster.extent, cmap=cmap, norm=norm,
+                     aspect="auto", interpolation="nearest")
+    fig.colorbar(mesh, ax=ax, label=label)
+    ax.set_xlabel("Longitude")
+    ax.set_ylabel("Latitude")
+    ax.set_title(title)
+    return _save(fig, output_path)
+
+
+def plot_sounding_map(
+    data,
+    output_path: str = "./oco2_ingested/xco2_map.png",
+    resolution: float = 0.5,
+    statistic: str = "mean"
+) -> str:
+    """
+    Rasterised map of soundings, replacing a scatter plot of every point.
+
+    Args:
+        data: DataFrame with longitude, latitude and xco2, or a path to a sounding table.
+        output_path (str): Image file to write.
+        resolution (float): Cell size in degrees.
+        statistic (str): 'mean' or 'count' (see plot_raster).
+
+    Returns:
+        str: Path of the saved image.
+    """
+    if isinstance(data, pd.DataFrame):
+        raster = PointRaster(resolution).add(data["longitude"], data["latitude"], data["xco2"])
+    else:
+        raster = rasterize_table(data, resolution)
+    path = plot_raster(raster, output_path, statistic)
+    logger.info(f"🗺️ Map of {int(raster.count.sum())} soundings saved to {path}")
+    return path
+
+
+def plot_daily_series(
+    dates,
+    values,
+    output_path: str,
+    title: str = "Global Daily Mean CO₂",
+    label: str = "Global Mean xco2",
+    scatter: bool = False
+) -> str:
+    """
+    Line (or scatter) plot of a daily series saved to output_path.
+    """
+    fig = _figure((10, 5))
+    ax = fig.add_subplot()
+    if scatter:
+        ax.scatter(dates, values, label=label, s=10)
+    else:
+        ax.plot(dates, values, label=label)
+    ax.set_xlabel("Date")
+    ax.set_ylabel("CO₂ (ppm)")
+    ax.set_title(title)
+    ax.legend()
+    return _save(fig, output_path)
+
+
+def plot_forecast(
+    observed: pd.Series,
+    forecast: pd.DataFrame,
+    country: str,
+    output_path: str | None = None,
+    model: str = "ARIMA",
+    dpi: int = 150
+):
+    """
+    Observed series with a forecast and, when present, its 'lower'/'upper' interval.
+
+    Args:
+        observed (pd.Series): Observed CO₂ indexed by date.
+        forecast (pd.DataFrame): Rows of one country with 'date' and 'forecast'
+            (optionally 'lower' and 'upper').
+        country (str): Country name used in the title.
+        output_path (str | None): Image file to write; None returns the Figure instead
+            (it displays inline in notebooks).
+        model (str): Model name used in the title and legend.
+        dpi (int): Resolution of the saved image.
+
+    Returns:
+        str | Figure: Saved path, or the Figure when output_path is None.
+    """
+    fig = _figure((12, 6))
+    ax = fig.add_subplot()
+    ax.plot(observed.index, observed.to_numpy(), label="Observed")
+    ax.plot(forecast["date"], forecast["forecast"], label=f"{model} Forecast", color="red")
+    if {"lower", "upper"} <= set(forecast.columns):
+        ax.fill_between(forecast["date"], forecast["lower"], forecast["upper"],
+                        color="pink", alpha=0.3)
+    ax.set_title(f"{model} Forecast of CO₂ for {country}")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("CO₂ (ppm)")
+    ax.legend()
+    ax.grid(True)
+    if output_path is None:
+        return fig
+    return _save(fig, output_path, dpi)
+
+
+def _forecast_plot_task(task: tuple) -> tuple[str, str | None, str | None]:
+    """
+    Process-pool worker: render one country's forecast figure, returning errors.
+    """
+    country, observed, forecast, output_path, model = task
+    try:
+        return country, plot_forecast(observed, forecast, country, output_path, model), None
+    except Exception as e:
+        return country, None, str(e)
+
+
+def _file_stem(country: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in country.lower()).strip("_")
+
+
+def render_forecasts(
+    observed: dict[str, pd.Series],
+    forecasts: pd.DataFrame,
+    output_dir: str,
+    model: str = "ARIMA",
+    workers: int | None = None
+) -> dict[str, str]:
+    """
+    Render the forecast figure of every country in parallel, one PNG per country.
+
+    Args:
+        observed (dict[str, pd.Series]): Observed series per country.
+        forecasts (pd.DataFrame): Tidy forecast table ('country', 'date', 'forecast',
+            optionally 'lower'/'upper'), e.g. from arima_forecast_all or lstm_forecast_all.
+        output_dir (str): Directory receiving '<country>_<model>_forecast.png' files.
+        model (str): Model name used in titles and file names.
+        workers (int | None): Number of processes (None = one per CPU).
+
+    Returns:
+        dict[str, str]: Country -> saved image path.
+    """
+    tasks = [
+        (country, observed[country], group,
+         os.path.join(output_dir, f"{_file_stem(country)}_{model.lower()}_forecast.png"), model)
+        for country, group in forecasts.groupby("country", sort=True)
+        if country in observed
+    ]
+    paths = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for country, path, error in pool.map(_forecast_plot_task, tasks):
+            if error is not None:
+                logger.error(f"❌ Failed to plot {country}: {error}")
+                continue
+            paths[country] = path
+    logger.info(f"✅ {len(paths)} {model} forecast plots saved to {output_dir}")
+    return paths
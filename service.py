@@ -0,0 +1,376 @@
+# service.py
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+
+from storage import read_table
+
+logger = logging.getLogger(__name__)
+
+METHODS = ("arima", "lstm")
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values in bytes.
+
+    Least recently used entries are evicted until a new value fits; a value larger than
+    the whole budget is not cached.
+    """
+
+    def __init__(self, max_bytes: int = 64 << 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                self.stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats["hits"] += 1
+            return self._items[key][0]
+
+    def put(self, key, value, nbytes: int) -> None:
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            while self._items and self.nbytes + nbytes > self.max_bytes:
+                self.nbytes -= self._items.popitem(last=False)[1][1]
+                self.stats["evictions"] += 1
+            self._items[key] = (value, nbytes)
+            self.nbytes += nbytes
+
+    def invalidate(self, predicate) -> int:
+        """
+        Drop every entry whose key satisfies predicate; returns the number dropped.
+        """
+        with self._lock:
+            stale = [key for key in self._items if predicate(key)]
+            for key in stale:
+                self.nbytes -= self._items.pop(key)[1]
+            return len(stale)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def _table_signature(path: str) -> tuple | None:
+    """
+    (size, mtime) of a table file, or of every file of a partitioned store.
+    """
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime_ns)
+    if not os.path.isdir(path):
+        return None
+    entries = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            st = os.stat(os.path.join(root, name))
+            entries.append((name, st.st_size, st.st_mtime_ns))
+    return tuple(sorted(entries))
+
+
+def _arima_task(task: tuple) -> tuple:
+    """
+    Process-pool worker: fitted (or cached/updated) SARIMAX results of one country.
+    """
+    from arima import ArimaModelCache
+
+    country, series, cache_dir = task
+    try:
+        return country, ArimaModelCache(cache_dir).get_results(country, series), None
+    except Exception as e:
+        return country, None, str(e)
+
+
+def _log_refresh_failure(future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"❌ Forecast model refresh failed: {future.exception()}")
+
+
+class ForecastService:
+    """
+    Long-lived forecaster answering (country, method, horizon) queries from memory.
+
+    Fitted models are held in a registry keyed by (country, method): SARIMAX results
+    per country for 'arima', and for 'lstm' the global model with the forecasts of
+    every country up to max_horizon (recursive forecasts of a shorter horizon are a
+    prefix of the longer rollout). Answers are memoised in an LRU cache bounded in bytes.
+
+    Models are (re)built by refresh(), which runs on a background thread: ARIMA models
+    are fitted or updated in a process pool through the on-disk ArimaModelCache, the
+    LSTM is retrained once for all countries. The previous models keep serving until the
+    new ones are swapped in. With poll_seconds set, a watcher thread refreshes whenever
+    the country table changes.
+    """
+
+    def __init__(self,
+                 csv_path: str = "./oco2_ingested/country_daily_co2.parquet",
+                 methods: tuple = METHODS,
+                 max_horizon: int = 24,
+                 cache_bytes: int = 64 << 20,
+                 workers: int | None = None,
+                 cache_dir: str = "./oco2_ingested/arima_cache",
+                 poll_seconds: float | None = 60,
+                 lstm_kwargs: dict | None = None):
+        unknown = set(methods) - set(METHODS)
+        if unknown:
+            raise ValueError(f"Unknown forecast methods: {', '.join(sorted(unknown))}")
+        self.csv_path = csv_path
+        self.methods = tuple(methods)
+        self.max_horizon = max_horizon
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.poll_seconds = poll_seconds
+        self.lstm_kwargs = lstm_kwargs or {}
+        self.cache = LRUCache(cache_bytes)
+
+        self._models = {}          # (country, method) -> fitted state
+        self._generation = 0       # bumped on every swap; part of the cache key
+        self._signature = None     # table signature the current models were built from
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="forecast-refresh")
+        self._pending = None
+        self._stop = threading.Event()
+        self._watcher = None
+        self.last_refresh = None
+
+    # --- model building -------------------------------------------------------
+
+    def _fit_arima(self, df: pd.DataFrame) -> dict:
+        from arima import monthly_country_series
+
+        # Fits/updates every country of the loaded table in parallel through the model
+        # cache; nothing is re-read, plotted or written besides the cached models
+        tasks = [(country, series, self.cache_dir)
+                 for country, series in monthly_country_series(df).items()]
+        models = {}
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for country, results, error in pool.map(_arima_task, tasks):
+                if error is not None:
+                    logger.error(f"❌ Failed to fit ARIMA model for {country}: {error}")
+                    continue
+                models[(country, "arima")] = results
+        return models
+
+    def _fit_lstm(self) -> dict:
+        from lstm import lstm_forecast_all
+
+        forecasts, model = lstm_forecast_all(self.csv_path, forecast_horizon=self.max_horizon,
+                                             **self.lstm_kwargs)
+        return {
+            (country, "lstm"): {"model": model, "forecast": group.drop(columns="step")}
+            for country, group in forecasts.groupby("country", sort=True)
+        }
+
+    def _refresh(self) -> dict:
+        signature = _table_signature(self.csv_path)
+        start = time.perf_counter()
+        df = read_table(self.csv_path, columns=["country", "date", "xco2"])
+        models = {}
+        if "arima" in self.methods:
+            models.update(self._fit_arima(df))
+        if "lstm" in self.methods:
+            models.update(self._fit_lstm())
+
+        with self._lock:
+            self._models = models
+            self._generation += 1
+            self._signature = signature
+            generation = self._generation
+        # Entries of older generations can no longer be hit; free their memory now
+        self.cache.invalidate(lambda key: key[0] != generation)
+        self.last_refresh = time.time()
+        logger.info(f"🔄 Forecast models refreshed: {len(models)} models in "
+                    f"{time.perf_counter() - start:.1f}s")
+        return {"models": len(models), "seconds": time.perf_counter() - start}
+
+    def refresh(self, wait: bool = False):
+        """
+        Rebuild the models in the background (a refresh already queued is reused).
+
+        Args:
+            wait (bool): Block until the refresh finished.
+
+        Returns:
+            concurrent.futures.Future: Resolves to {'models', 'seconds'}.
+        """
+        with self._lock:
+            if self._pending is None or self._pending.done():
+                self._pending = self._refresher.submit(self._refresh)
+                self._pending.add_done_callback(_log_refresh_failure)
+            future = self._pending
+        if wait:
+            future.result()
+        return future
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_seconds):
+            signature = _table_signature(self.csv_path)
+            if signature is not None and signature != self._signature:
+                logger.info(f"📥 {self.csv_path} changed, refreshing forecast models")
+                self.refresh()
+
+    def start(self, wait: bool = True) -> "ForecastService":
+        """
+        Build the initial models and start watching the country table for changes.
+        """
+        future = self.refresh()
+        if self.poll_seconds and self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="forecast-watch", daemon=True)
+            self._watcher.start()
+        if wait:
+            future.result()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._refresher.shutdown(wait=False, cancel_futures=True)
+
+    # --- queries --------------------------------------------------------------
+
+    def forecast(self, country: str, method: str = "arima", horizon: int = 12) -> pd.DataFrame:
+        """
+        Forecast table ('country', 'date', 'forecast', and 'lower'/'upper' where
+        available) for one country, method and horizon in months (ARIMA) or steps (LSTM).
+
+        The result is a copy, so callers may modify it without corrupting the cache.
+        """
+        if method not in self.methods:
+            raise ValueError(f"Method '{method}' is not served. Methods: {', '.join(self.methods)}")
+        if horizon < 1:
+            raise ValueError("horizon must be at least 1")
+
+        with self._lock:
+            generation = self._generation
+            state = self._models.get((country, method))
+        key = (generation, country, method, horizon)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached.copy()
+        if state is None:
+            raise KeyError(f"No {method} model for country: {country}")
+
+        if method == "arima":
+            from arima import _forecast_frame
+            result = _forecast_frame(country, state, horizon)
+        else:
+            if horizon > self.max_horizon:
+                raise ValueError(f"LSTM horizon is limited to {self.max_horizon} steps")
+            result = state["forecast"].iloc[:horizon].reset_index(drop=True)
+        with self._lock:
+            # A refresh may have swapped the models meanwhile; an entry of an older
+            # generation could never be hit again
+            if generation == self._generation:
+                self.cache.put(key, result, int(result.memory_usage(deep=True).sum()))
+        return result.copy()
+
+    def status(self) -> dict:
+        with self._lock:
+            models = list(self._models)
+        return {
+            "models": len(models),
+            "countries": len({country for country, _ in models}),
+            "methods": list(self.methods),
+            "generation": self._generation,
+            "last_refresh": self.last_refresh,
+            "refreshing": self._pending is not None and not self._pending.done(),
+            "cache": {**self.cache.stats, "entries": len(self.cache), "bytes": self.cache.nbytes},
+        }
+
+
+def _json_records(df: pd.DataFrame) -> list[dict]:
+    out = df.copy()
+    out["date"] = out["date"].dt.strftime("%Y-%m-%d")
+    return out.to_dict(orient="records")
+
+
+def make_handler(service: ForecastService):
+    """
+    HTTP handler serving GET /forecast?country=&method=&horizon= and GET /status.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code: int, payload) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            if url.path == "/status":
+                return self._send(200, service.status())
+            if url.path != "/forecast":
+                return self._send(404, {"error": f"Unknown path: {url.path}"})
+            try:
+                df = service.forecast(query["country"], query.get("method", "arima"),
+                                      int(query.get("horizon", 12)))
+            except KeyError as e:
+                return self._send(404, {"error": str(e).strip("'")})
+            except ValueError as e:
+                return self._send(400, {"error": str(e)})
+            return self._send(200, _json_records(df))
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+def serve(service: ForecastService, host: str = "127.0.0.1", port: int = 8050) -> None:
+    """
+    Serve forecasts over HTTP until interrupted.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    logger.info(f"🌐 Forecast service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+def main(argv: list[str] | None = None) -> None:
+    from instrumentation import configure_logging
+
+    parser = argparse.ArgumentParser(description="Serve CO₂ forecasts over HTTP.")
+    parser.add_argument("--input", default="./oco2_ingested/country_daily_co2.parquet")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--max-horizon", type=int, default=24)
+    parser.add_argument("--cache-mb", type=float, default=64)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--poll-seconds", type=float, default=60)
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    service = ForecastService(args.input, tuple(args.methods), args.max_horizon,
+                              int(args.cache_mb * (1 << 20)), args.workers,
+                              poll_seconds=args.poll_seconds).start()
+    serve(service, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
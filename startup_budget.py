@@ -0,0 +1,67 @@
+# startup_budget.py
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+# Modules that must not be imported by the ingest/aggregation path
+HEAVY_MODULES = ("tensorflow", "statsmodels", "geopandas", "shapely", "matplotlib", "sklearn")
+
+# Modules needed to run the pipeline up to the aggregation stages
+INGEST_PATH = ("pipeline", "storage", "ingest", "preprocessing", "aggregation")
+
+
+def measure_startup(modules=INGEST_PATH, runs: int = 3) -> dict:
+    """
+    Measure the import time of a set of modules in fresh interpreters.
+
+    Args:
+        modules: Module names to import.
+        runs (int): Number of fresh interpreters; the best time is reported.
+
+    Returns:
+        dict: {'seconds': best import time, 'heavy': heavy modules that got imported}.
+    """
+    code = (
+        "import sys, time, json\n"
+        "start = time.perf_counter()\n"
+        f"for name in {list(modules)!r}:\n"
+        "    __import__(name)\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"heavy = [m for m in {list(HEAVY_MODULES)!r} if m in sys.modules]\n"
+        "print(json.dumps({'seconds': elapsed, 'heavy': heavy}))\n"
+    )
+    best = None
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent,
+                             capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Check the ingest-only startup budget.")
+    parser.add_argument("--budget", type=float, default=1.5,
+                        help="maximum import time in seconds (default: 1.5)")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    result = measure_startup(runs=args.runs)
+    print(f"⏱️ Ingest-path import time: {result['seconds']:.3f}s (budget {args.budget:.3f}s)")
+    ok = True
+    if result["heavy"]:
+        print(f"❌ Heavy modules imported on the ingest path: {', '.join(result['heavy'])}")
+        ok = False
+    if result["seconds"] > args.budget:
+        print("❌ Startup budget exceeded")
+        ok = False
+    if ok:
+        print("✅ Startup within budget")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+# storage.py
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pads
+
+from instrumentation import count, count_files
+
+# Compact layout of sounding tables: float32 measurements (the precision of the OCO-2
+# Lite files), 'date' as midnight datetime64 and the granule name dictionary-encoded
+SOUNDING_DTYPES = {"xco2": "float32", "latitude": "float32", "longitude": "float32"}
+
+
+def is_csv(path) -> bool:
+    """
+    Return True when a table path should be read/written as CSV rather than Parquet.
+    """
+    return Path(path).suffix.lower() == ".csv"
+
+
+def _encode_dates(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Store 'date' as a real datetime column so readers never have to re-parse text.
+    """
+    if "date" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["date"]):
+        df = df.copy()
+        df["date"] = pd.to_datetime(df["date"])
+    return df
+
+
+def compact_soundings(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert a sounding table to the compact schema (columns that are absent are skipped).
+
+    Tables already in the compact schema, e.g. anything read back from the Parquet
+    store, are returned unchanged without a copy.
+
+    Args:
+        df (pd.DataFrame): Soundings with some of xco2, latitude, longitude, date and
+            source_file.
+
+    Returns:
+        pd.DataFrame: The same rows with compact column types.
+    """
+    df = _encode_dates(df)
+    casts = {col: dtype for col, dtype in SOUNDING_DTYPES.items()
+             if col in df.columns and df[col].dtype != dtype}
+    if "source_file" in df.columns and not isinstance(df["source_file"].dtype, pd.CategoricalDtype):
+        casts["source_file"] = "category"
+    return df.astype(casts) if casts else df
+
+
+def concat_soundings(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate compact sounding tables, keeping 'source_file' categorical.
+
+    pd.concat falls back to object dtype when the categories differ (e.g. one granule
+    per frame); unioning them first keeps the dictionary encoding.
+    """
+    if not frames:
+        return pd.DataFrame()
+    files = [f["source_file"] for f in frames if "source_file" in f.columns]
+    if files and all(isinstance(s.dtype, pd.CategoricalDtype) for s in files):
+        categories = sorted(set().union(*(s.cat.categories for s in files)))
+        frames = [f.assign(source_file=f["source_file"].cat.set_categories(categories))
+                  if "source_file" in f.columns else f for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def partition_dir(root, key, partition_by: str = "date") -> Path:
+    """
+    Directory holding one partition of a partitioned store, e.g. root/date=2020-07-01.
+    """
+    if partition_by == "date":
+        key = pd.Timestamp(key).strftime("%Y-%m-%d")
+    return Path(root) / f"{partition_by}={key}"
+
+
+def list_partitions(root, partition_by: str = "date") -> dict[str, list[Path]]:
+    """
+    List the Parquet files of a partitioned store, keyed by partition value.
+
+    Args:
+        root: Path to the store directory.
+        partition_by (str): Name of the partition column.
+
+    Returns:
+        dict[str, list[Path]]: Partition value -> sorted list of part files.
+    """
+    root = Path(root)
+    prefix = f"{partition_by}="
+    partitions = {}
+    if not root.is_dir():
+        return partitions
+    for d in sorted(root.iterdir()):
+        if d.is_dir() and d.name.startswith(prefix):
+            files = sorted(d.glob("*.parquet"))
+            if files:
+                partitions[d.name[len(prefix):]] = files
+    return partitions
+
+
+def write_partitions(
+    df: pd.DataFrame,
+    root,
+    partition_by: str = "date",
+    part_name: str = "part-0"
+) -> list[str]:
+    """
+    Write a DataFrame into a partitioned Parquet store, one directory per partition value.
+
+    Existing part files with the same name are replaced; other parts are left untouched,
+    so several writers (e.g. one per granule) can share a partition. The partition column
+    is stored only in the directory names (hive layout), so generic Parquet readers such
+    as pd.read_parquet(root) can open the store too.
+
+    Returns:
+        list[str]: Partition values that were written.
+    """
+    df = _encode_dates(df)
+    written = []
+    for key, part in df.groupby(partition_by, sort=True):
+        d = partition_dir(root, key, partition_by)
+        d.mkdir(parents=True, exist_ok=True)
+        part.drop(columns=partition_by).to_parquet(d / f"{part_name}.parquet", index=False)
+        count_files("bytes_written", [d / f"{part_name}.parquet"])
+        written.append(d.name.split("=", 1)[1])
+    count("rows_out", len(df))
+    return written
+
+
+def clear_table(path) -> None:
+    """
+    Remove a table (file or partitioned store) if it exists.
+    """
+    path = Path(path)
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+def drop_partitions(root, partitions: list[str], partition_by: str = "date") -> None:
+    """
+    Remove whole partitions from a partitioned store (missing partitions are ignored).
+    """
+    for key in partitions:
+        d = partition_dir(root, key, partition_by)
+        if d.is_dir():
+            shutil.rmtree(d)
+
+
+def update_by_date(path, df: pd.DataFrame, dates: list[str], sort_by: list[str]) -> pd.DataFrame:
+    """
+    Merge freshly computed rows for some dates into an existing aggregate table.
+
+    Rows of the existing table whose 'date' is in dates are replaced by df; all other
+    rows are kept. Used by the aggregation stages to update only the dates touched by
+    an incremental ingest.
+
+    Args:
+        path: Existing aggregate table (CSV or Parquet file); may not exist yet.
+        df (pd.DataFrame): Recomputed rows for the given dates.
+        dates (list[str]): Dates ('YYYY-MM-DD') that were recomputed.
+        sort_by (list[str]): Columns defining the output row order.
+
+    Returns:
+        pd.DataFrame: The merged table.
+    """
+    path = Path(path)
+    if path.exists():
+        existing = read_table(path)
+        existing = existing[~existing["date"].isin(pd.to_datetime(dates))]
+        df = pd.concat([existing, _encode_dates(df)], ignore_index=True)
+    return df.sort_values(sort_by, ignore_index=True)
+
+
+def write_table(df: pd.DataFrame, path, partition_by: str | None = None) -> str:
+    """
+    Write a stage output table.
+
+    Paths ending in '.csv' are exported as CSV. Anything else is written as Parquet:
+    a single file when partition_by is None, otherwise a directory partitioned by
+    that column (replacing any previous store at the same path).
+
+    Args:
+        df (pd.DataFrame): Table to write.
+        path: Output path.
+        partition_by (str | None): Column to partition the Parquet store by.
+
+    Returns:
+        str: Path that was written.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    if is_csv(path):
+        df.to_csv(path, index=False)
+        count("rows_out", len(df))
+        count_files("bytes_written", [path])
+        return str(path)
+
+    if partition_by is None:
+        _encode_dates(df).to_parquet(path, index=False)
+        count("rows_out", len(df))
+        count_files("bytes_written", [path])
+        return str(path)
+
+    clear_table(path)
+    path.mkdir(parents=True)
+    write_partitions(df, path, partition_by)
+    return str(path)
+
+
+def read_table(
+    path,
+    columns: list[str] | None = None,
+    partitions: list[str] | None = None,
+    partition_by: str = "date",
+    after: str | None = None
+) -> pd.DataFrame:
+    """
+    Read a stage table written by write_table (CSV, Parquet file or partitioned store).
+
+    Args:
+        path: Table path.
+        columns (list[str] | None): Columns to load; None loads all of them.
+        partitions (list[str] | None): For partitioned stores, only read these partition
+            values (e.g. ['2020-07-01']); None reads every partition.
+        partition_by (str): Name of the partition column.
+        after (str | None): Only read rows whose 'date' is later than this day. Date
+            partitions up to that day are skipped and Parquet files are filtered while
+            they are read.
+
+    Returns:
+        pd.DataFrame: Loaded table with 'date' (if present) as datetime64.
+    """
+    path = Path(path)
+    after = pd.Timestamp(after) if after is not None else None
+
+    if is_csv(path):
+        df = pd.read_csv(path, usecols=columns)
+        count_files("bytes_read", [path])
+        if after is not None:
+            df = df[pd.to_datetime(df["date"]) > after]
+    elif path.is_dir():
+        available = list_partitions(path, partition_by)
+        if partitions is not None:
+            wanted = set(partitions)
+            available = {k: v for k, v in available.items() if k in wanted}
+        if after is not None and partition_by == "date":
+            available = {k: v for k, v in available.items() if pd.Timestamp(k) > after}
+        files = [str(f) for parts in available.values() for f in parts]
+        if not files:
+            return pd.DataFrame(columns=columns or [])
+        # The partition column is rebuilt from the 'key=value' directory names
+        key_type = pa.timestamp("ns") if partition_by == "date" else pa.string()
+        partitioning = pads.partitioning(pa.schema([(partition_by, key_type)]), flavor="hive")
+        df = pads.dataset(files, format="parquet", partitioning=partitioning,
+                          partition_base_dir=str(path)).to_table(columns=columns).to_pandas()
+        count_files("bytes_read", files)
+    else:
+        filters = [("date", ">", after)] if after is not None else None
+        df = pd.read_parquet(path, columns=columns, filters=filters)
+        count_files("bytes_read", [path])
+
+    count("rows_in", len(df))
+
+    return _encode_dates(df)
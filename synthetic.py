@@ -0,0 +1,148 @@
+# synthetic.py
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+logger = logging.getLogger(__name__)
+
+# Rough OCO-2 climatology used for synthetic XCO2 (ppm)
+BASE_XCO2 = 405.0
+GROWTH_PPM_PER_YEAR = 2.4
+SEASONAL_AMPLITUDE = 3.0
+
+
+def _synthetic_xco2(time: pd.DatetimeIndex, latitude: np.ndarray, rng) -> np.ndarray:
+    years = (time - pd.Timestamp("2018-01-01")).days.to_numpy() / 365.25
+    # Seasonal cycle is stronger and phase-flipped in the northern hemisphere
+    phase = 2 * np.pi * (time.dayofyear.to_numpy() - 120) / 365.25
+    seasonal = SEASONAL_AMPLITUDE * np.cos(phase) * np.clip(latitude / 45, -1, 1.5)
+    return BASE_XCO2 + GROWTH_PPM_PER_YEAR * years + seasonal + rng.normal(0, 1.0, len(latitude))
+
+
+def generate_granule(path: str, day: str, soundings: int = 100_000, seed: int = 0) -> str:
+    """
+    Write one synthetic OCO2_L2_Lite-style NetCDF granule.
+
+    Soundings follow a sun-synchronous-like ground track (latitude sweeping between
+    ±82°, longitude drifting westwards over ~15 orbits) with a trend + seasonal XCO2
+    signal, Gaussian noise, a few missing values and out-of-range retrievals, and a
+    ~30% bad xco2_quality_flag rate.
+
+    Args:
+        path (str): Output .nc4 path.
+        day (str): Granule date, 'YYYY-MM-DD'.
+        soundings (int): Number of soundings in the granule.
+        seed (int): Random seed.
+
+    Returns:
+        str: Path to the written granule.
+    """
+    rng = np.random.default_rng(seed)
+    seconds = np.sort(rng.uniform(0, 86_400, soundings))
+    time = pd.Timestamp(day) + pd.to_timedelta(seconds, unit="s")
+
+    orbit_phase = 2 * np.pi * seconds / 5_940  # ~99 minute orbit
+    latitude = 82 * np.sin(orbit_phase) + rng.normal(0, 0.05, soundings)
+    longitude = (180 - 360 * seconds / 86_400 - 24.7 * np.floor(seconds / 5_940)) % 360 - 180
+    longitude = longitude + rng.normal(0, 0.05, soundings)
+
+    xco2 = _synthetic_xco2(time, latitude, rng)
+    xco2[rng.random(soundings) < 0.001] = np.nan
+    outliers = rng.random(soundings) < 0.002
+    xco2[outliers] = rng.choice([200.0, 900.0], outliers.sum())
+    quality_flag = (rng.random(soundings) < 0.3).astype(np.int8)
+
+    ds = xr.Dataset(
+        {
+            "xco2": ("sounding_id", xco2.astype(np.float32), {"units": "ppm"}),
+            "latitude": ("sounding_id", np.clip(latitude, -90, 90).astype(np.float32),
+                         {"units": "degrees_north"}),
+            "longitude": ("sounding_id", longitude.astype(np.float32), {"units": "degrees_east"}),
+            "time": ("sounding_id", time.values),
+            "xco2_quality_flag": ("sounding_id", quality_flag),
+        },
+        coords={"sounding_id": np.arange(soundings, dtype=np.int64)},
+        attrs={"title": "Synthetic OCO-2 Lite FP granule", "date": day},
+    )
+    encoding = {name: {"zlib": True, "complevel": 4} for name in ds.data_vars}
+    # Lite files store time as float64 seconds since the Unix epoch
+    encoding["time"].update(units="seconds since 1970-01-01 00:00:00", dtype="float64")
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    ds.to_netcdf(path, encoding=encoding)
+    return str(path)
+
+
+def generate_granules(
+    output_dir: str = "./oco2_synthetic",
+    start_date: str = "2020-01-01",
+    days: int = 30,
+    soundings: int = 100_000,
+    seed: int = 0
+) -> list[str]:
+    """
+    Write one synthetic granule per day, named like real Lite files.
+
+    Args:
+        output_dir (str): Directory for the granules.
+        start_date (str): First day, 'YYYY-MM-DD'.
+        days (int): Number of daily granules.
+        soundings (int): Soundings per granule.
+        seed (int): Base random seed (each day uses seed + day index).
+
+    Returns:
+        list[str]: Paths of the written granules.
+    """
+    paths = []
+    for i, day in enumerate(pd.date_range(start_date, periods=days, freq="D")):
+        name = f"oco2_LtCO2_{day:%y%m%d}_B11014Ar_synthetic.nc4"
+        paths.append(generate_granule(str(Path(output_dir) / name), f"{day:%Y-%m-%d}",
+                                      soundings, seed + i))
+    logger.info(f"✅ {len(paths)} synthetic granules ({soundings} soundings each) written to {output_dir}")
+    return paths
+
+
+def generate_country_shapefile(path: str = "./oco2_synthetic/countries.shp",
+                               tile_deg: float = 30.0) -> str:
+    """
+    Write a shapefile of rectangular land 'countries' (with a NAME column) covering
+    the land-heavy latitudes, for benchmarking the country stage without Natural Earth.
+    """
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    geoms, names = [], []
+    for lat in np.arange(-60, 75, tile_deg):
+        for lon in np.arange(-180, 180, tile_deg):
+            geoms.append(box(lon, lat, lon + tile_deg, min(lat + tile_deg, 75)))
+            names.append(f"Country_{len(names):03d}")
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    gpd.GeoDataFrame({"NAME": names}, geometry=geoms, crs="EPSG:4326").to_file(path)
+    return str(path)
+
+
+def generate_country_daily(path: str = "./oco2_synthetic/country_daily_co2.parquet",
+                           countries: int = 20,
+                           start_date: str = "2016-01-01",
+                           years: int = 6,
+                           seed: int = 0) -> str:
+    """
+    Write a synthetic country-level daily table (country, date, xco2) long enough for
+    the forecasters, with irregular sampling like real overpasses.
+    """
+    from storage import write_table
+
+    rng = np.random.default_rng(seed)
+    all_days = pd.date_range(start_date, periods=int(years * 365.25), freq="D")
+    frames = []
+    for i in range(countries):
+        days = all_days[rng.random(len(all_days)) < 0.15]
+        latitude = np.full(len(days), rng.uniform(-50, 60))
+        frames.append(pd.DataFrame({
+            "country": f"Country_{i:03d}",
+            "date": days,
+            "xco2": _synthetic_xco2(days, latitude, rng),
+        }))
+    return write_table(pd.concat(frames, ignore_index=True), path)
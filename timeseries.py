@@ -1,60 +1,260 @@
 # oco2_timeseries.py
+import json
+import logging
+from dataclasses import dataclass, field
 import pandas as pd
-import matplotlib.pyplot as plt
 from pathlib import Path
 
+from storage import read_table, write_partitions, clear_table
+from aggregation import scan_partials, empty_stats
+
+logger = logging.getLogger(__name__)
+
+
 def analyze_timeseries(
-    input_csv: str = "./oco2_ingested/cleaned_oco2_data.csv",
+    input_csv: str = "./oco2_ingested/cleaned_oco2_data.parquet",
     plot: bool = True
 ) -> pd.DataFrame:
     """
     Generate a global daily mean CO₂ time series from OCO-2 data.
 
     Args:
-        input_csv (str): Path to the cleaned OCO-2 dataset.
-        plot (bool): Whether to generate plots.
+        input_csv (str): Path to the cleaned OCO-2 dataset (Parquet store or CSV).
+        plot (bool): Whether to save line and scatter plots of the series next to the
+            input ('global_daily_mean.png', 'global_daily_mean_scatter.png').
 
     Returns:
-        pd.DataFrame: DataFrame with ['date', 'xco2'] daily global means.
+        pd.DataFrame: Daily global 'xco2' mean, 'xco2_std' and 'count' per 'date'.
     """
     input_csv = Path(input_csv)
     if not input_csv.exists():
-        raise FileNotFoundError(f"Input CSV not found: {input_csv}")
+        raise FileNotFoundError(f"Input data not found: {input_csv}")
 
-    # Load cleaned data
-    df = pd.read_csv(input_csv)
-    df["date"] = pd.to_datetime(df["date"])
+    # Aggregate daily mean with the shared aggregation engine
+    daily_mean = scan_partials(str(input_csv)).finalize().get("global", empty_stats("global"))
 
-    # Aggregate daily mean
-    daily_mean = df.groupby("date")["xco2"].mean().reset_index()
-
-    print(f"✅ Daily mean CO₂ computed for {len(daily_mean)} days")
-    print("Date range:", daily_mean["date"].min(), "to", daily_mean["date"].max())
+    logger.info(f"✅ Daily mean CO₂ computed for {len(daily_mean)} days")
+    logger.info("Date range: %s to %s", daily_mean["date"].min(), daily_mean["date"].max())
 
     # Optional plots
     if plot:
+        from render import plot_daily_series
+
         # Line plot
-        plt.figure(figsize=(10, 5))
-        plt.plot(daily_mean["date"], daily_mean["xco2"], label="Global Mean xco2")
-        plt.xlabel("Date")
-        plt.ylabel("CO₂ (ppm)")
-        plt.title("Global Daily Mean CO₂")
-        plt.legend()
-        plt.show()
+        plot_daily_series(daily_mean["date"], daily_mean["xco2"],
+                          str(input_csv.parent / "global_daily_mean.png"))
 
         # Scatter plot
-        plt.figure(figsize=(10, 5))
-        plt.scatter(daily_mean["date"], daily_mean["xco2"], label="Global Mean xco2", s=10)
-        plt.xlabel("Date")
-        plt.ylabel("CO₂ (ppm)")
-        plt.title("Global Daily Mean CO₂ (Scatter)")
-        plt.legend()
-        plt.show()
+        plot_daily_series(daily_mean["date"], daily_mean["xco2"],
+                          str(input_csv.parent / "global_daily_mean_scatter.png"),
+                          title="Global Daily Mean CO₂ (Scatter)", scatter=True)
+        logger.info(f"✅ Plots saved to {input_csv.parent}")
 
     return daily_mean
 
 
+# Rolling windows (days) maintained for every series
+WINDOWS = (7, 30)
+# Trend time axis: decimal years since this date
+EPOCH = pd.Timestamp("2015-01-01")
+# Input column holding the series key, per grouping (None: a single series)
+SERIES_GROUPS = {"global": None, "lat_band": "lat_band", "country": "country"}
+STATE_NAME = "timeseries_state.json"
+
+
+@dataclass
+class SeriesState:
+    """
+    Running statistics of one daily series, updated in O(1) per new day.
+
+    Rolling means keep at most one value per day of each window. The trend is an
+    ordinary least-squares line kept as running sums, and the seasonal climatology as
+    per-calendar-month sums of values and times, so the detrended monthly means can be
+    recomputed exactly from the sums whenever the trend changes.
+    """
+    last_date: str | None = None
+    windows: dict = field(default_factory=lambda: {str(w): [] for w in WINDOWS})
+    window_sums: dict = field(default_factory=lambda: {str(w): 0.0 for w in WINDOWS})
+    n: int = 0
+    sum_t: float = 0.0
+    sum_y: float = 0.0
+    sum_tt: float = 0.0
+    sum_ty: float = 0.0
+    month_n: list = field(default_factory=lambda: [0] * 12)
+    month_t: list = field(default_factory=lambda: [0.0] * 12)
+    month_y: list = field(default_factory=lambda: [0.0] * 12)
+
+    def trend(self) -> tuple[float, float]:
+        """
+        (intercept, slope in ppm/year) of the least-squares trend; slope is 0 until two
+        distinct times have been seen.
+        """
+        denom = self.n * self.sum_tt - self.sum_t ** 2
+        if self.n < 2 or denom <= 0:
+            return (self.sum_y / self.n if self.n else 0.0), 0.0
+        slope = (self.n * self.sum_ty - self.sum_t * self.sum_y) / denom
+        return (self.sum_y - slope * self.sum_t) / self.n, slope
+
+    def seasonal(self, month: int) -> float:
+        """
+        Mean detrended value of a calendar month (1-12) under the current trend.
+        """
+        m = month - 1
+        if not self.month_n[m]:
+            return 0.0
+        intercept, slope = self.trend()
+        return (self.month_y[m] - intercept * self.month_n[m] - slope * self.month_t[m]) / self.month_n[m]
+
+    def update(self, date: pd.Timestamp, value: float) -> dict:
+        """
+        Add one day and return its derived statistics.
+        """
+        t = (date - EPOCH).days / 365.25
+        self.n += 1
+        self.sum_t += t
+        self.sum_y += value
+        self.sum_tt += t * t
+        self.sum_ty += t * value
+        m = date.month - 1
+        self.month_n[m] += 1
+        self.month_t[m] += t
+        self.month_y[m] += value
+
+        row = {}
+        ordinal = date.toordinal()
+        for w in WINDOWS:
+            buf, key = self.windows[str(w)], str(w)
+            buf.append([ordinal, value])
+            self.window_sums[key] += value
+            while buf[0][0] <= ordinal - w:
+                self.window_sums[key] -= buf.pop(0)[1]
+            row[f"xco2_{w}d"] = self.window_sums[key] / len(buf)
+
+        intercept, slope = self.trend()
+        trend = intercept + slope * t
+        row.update(trend=trend, trend_slope=slope,
+                   anomaly=value - trend - self.seasonal(date.month))
+        self.last_date = date.strftime("%Y-%m-%d")
+        return row
+
+
+def _series_states(state: dict) -> dict[str, SeriesState]:
+    return {name: SeriesState(**fields) for name, fields in state.get("series", {}).items()}
+
+
+def update_timeseries_stats(
+    global_file: str = "./oco2_ingested/daily_global_mean.parquet",
+    latband_file: str | None = "./oco2_ingested/daily_latband_mean.parquet",
+    country_file: str | None = "./oco2_ingested/country_daily_co2.parquet",
+    output_dir: str = "./oco2_ingested/timeseries_stats",
+    rebuild: bool = False,
+    dates: list[str] | None = None
+) -> pd.DataFrame:
+    """
+    Extend the rolling, anomaly and trend series with the days not seen yet.
+
+    Each (grouping, key) series keeps a SeriesState in output_dir/timeseries_state.json.
+    Only days later than a series' last processed day are added, each in O(1), and the
+    new rows are appended to a date-partitioned store in output_dir. The daily tables are
+    read from the oldest last processed day of each grouping on, so adding a day neither
+    rescans the soundings or the earlier daily rows nor rewrites earlier output.
+
+    Anomalies are computed with the trend and climatology known when the day is added
+    and are not revised afterwards. Running sums cannot be rewound, so when the daily
+    values of an already processed day change (re-ingested or deleted granules), every
+    series is recomputed from scratch: pass the changed days as dates, or rebuild=True.
+
+    Args:
+        global_file (str): Daily global mean table (columns 'date', 'xco2').
+        latband_file (str | None): Daily latitude-band means ('lat_band', 'date', 'xco2').
+        country_file (str | None): Daily country means ('country', 'date', 'xco2').
+        output_dir (str): Directory holding the state file and the 'series' store.
+        rebuild (bool): Discard the saved state and output first. Ignored when dates is
+            given, which rebuilds only if needed.
+        dates (list[str] | None): Days ('YYYY-MM-DD') whose daily values were rewritten
+            since the last call, e.g. the touched dates of an incremental ingest. If any
+            is on or before the last processed day of a series, everything is rebuilt;
+            otherwise the series are extended as usual.
+
+    Returns:
+        pd.DataFrame: Rows added by this call, with group, key, date, xco2, xco2_7d,
+            xco2_30d, trend, trend_slope (ppm/year) and anomaly.
+    """
+    output_dir = Path(output_dir)
+    state_path = output_dir / STATE_NAME
+    store = output_dir / "series"
+
+    state = {"runs": 0, "series": {}}
+    if state_path.exists():
+        with open(state_path, "r", encoding="utf-8") as fh:
+            state = json.load(fh)
+    if dates is not None:
+        processed = [s["last_date"] for s in state["series"].values() if s.get("last_date")]
+        rebuild = bool(dates and processed) and min(dates) <= max(processed)
+        if rebuild:
+            logger.info(f"🔁 Daily values changed from {min(dates)} on; rebuilding all series")
+    if rebuild:
+        clear_table(output_dir)
+        state = {"runs": 0, "series": {}}
+    series = _series_states(state)
+
+    inputs = {"global": global_file, "lat_band": latband_file, "country": country_file}
+    rows = []
+    for group, path in inputs.items():
+        if path is None or not Path(path).exists():
+            continue
+        key_column = SERIES_GROUPS[group]
+        # Only days after the oldest last_date of this grouping can extend any of its series
+        known = [s.last_date for name, s in series.items() if name.startswith(f"{group}|")]
+        after = min(known) if known and None not in known else None
+        daily = read_table(path, columns=["date", "xco2"] + ([key_column] if key_column else []),
+                           after=after)
+        keys = daily[key_column].astype(str) if key_column else pd.Series(group, index=daily.index)
+        for key, part in daily.groupby(keys, sort=True):
+            name = f"{group}|{key}"
+            current = series.setdefault(name, SeriesState())
+            if current.last_date is not None:
+                part = part[part["date"] > pd.Timestamp(current.last_date)]
+            for date, value in part.sort_values("date")[["date", "xco2"]].itertuples(index=False):
+                if pd.isna(value):
+                    continue
+                rows.append({"group": group, "key": key, "date": date, "xco2": value,
+                             **current.update(date, float(value))})
+
+    added = pd.DataFrame(rows)
+    if not added.empty:
+        state["runs"] += 1
+        # A new part name per run: later runs may add other series to the same dates
+        write_partitions(added, store, part_name=f"run-{state['runs']:06d}")
+
+    state["series"] = {name: vars(s) for name, s in series.items()}
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = state_path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(state, fh)
+    tmp_path.replace(state_path)
+
+    logger.info(f"✅ Time-series statistics: {len(added)} new daily values across "
+                f"{added['key'].nunique() if len(added) else 0} series saved to {store}")
+    return added
+
+
+def load_timeseries_stats(
+    output_dir: str = "./oco2_ingested/timeseries_stats",
+    group: str | None = None
+) -> pd.DataFrame:
+    """
+    Read the series written by update_timeseries_stats, optionally one grouping only.
+    """
+    df = read_table(Path(output_dir) / "series")
+    if group is not None and not df.empty:
+        df = df[df["group"] == group]
+    return df.sort_values(["group", "key", "date"], ignore_index=True) if not df.empty else df
+
+
 # Example manual run
 if __name__ == "__main__":
+    from instrumentation import configure_logging
+    configure_logging()
     daily_mean = analyze_timeseries()
     print(daily_mean.head())